@@ -0,0 +1,258 @@
+"""Persistent on-disk cache for arXiv paper metadata.
+
+Entries are keyed by arXiv id and store the dict returned by
+`_parse_arxiv_xml`. Each entry has its own TTL. Once an entry goes stale, it
+is only re-fetched if arXiv could have published a new version since we
+fetched it (arXiv announces new/updated papers once per weekday, at
+~00:00 UTC), otherwise its TTL is simply extended.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional
+
+from lib import env_vars
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 100_000
+# the number of entries is kept in memory, and counted again every this many
+# puts, to catch up with other processes using the same file.
+RECOUNT_EVERY_PUTS = 1000
+
+# arXiv's announcements go out Sun-Thu 20:00 US/Eastern, i.e. Mon-Fri ~00:00 UTC.
+ARXIV_ANNOUNCEMENT_WEEKDAYS_UTC = {0, 1, 2, 3, 4}
+
+
+def _last_arxiv_announcement_before(timestamp: float) -> float:
+    """Get the time of the most recent arXiv announcement before `timestamp`."""
+    day = datetime.fromtimestamp(timestamp, tz=timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    while day.weekday() not in ARXIV_ANNOUNCEMENT_WEEKDAYS_UTC:
+        day -= timedelta(days=1)
+    return day.timestamp()
+
+
+def could_have_changed(fetched_at: float, now: Optional[float] = None) -> bool:
+    """Whether arXiv could have updated a paper since we fetched it."""
+    now = time.time() if now is None else now
+    return fetched_at < _last_arxiv_announcement_before(now)
+
+
+class ArxivMetadataCache:
+    """SQLite-backed cache of arXiv metadata with TTLs and LRU eviction.
+
+    Safe to share across threads in one process, and across processes
+    through the database file.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        default_ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        path = env_vars.ARXIV_CACHE_PATH if path is None else path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.default_ttl_seconds = default_ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            create table if not exists arxiv_metadata (
+                arxiv_id text primary key,
+                metadata text not null,
+                updated_date text,
+                fetched_at real not null,
+                expires_at real not null,
+                last_accessed_at real not null
+            )
+            """
+        )
+        self._conn.execute(
+            "create index if not exists idx_arxiv_metadata_last_accessed_at "
+            "on arxiv_metadata (last_accessed_at)"
+        )
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stale_revalidations": 0,  # stale, but arXiv can't have changed it.
+            "stale_refreshes": 0,  # stale, and re-fetched from arXiv.
+            "stale_served_on_error": 0,  # stale, and the re-fetch failed.
+            "evictions": 0,
+        }
+        self._num_entries = self._count()
+        self._puts_since_count = 0
+
+    def _count(self) -> int:
+        return self._conn.execute("select count(*) from arxiv_metadata").fetchone()[0]
+
+    def get(self, arxiv_id: str, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        """Get cached metadata for a paper, or None if missing (or stale)."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "select metadata, expires_at from arxiv_metadata where arxiv_id = ?",
+                (arxiv_id,),
+            ).fetchone()
+            if row is None or (row[1] < now and not allow_stale):
+                self.stats["misses"] += 1
+                return None
+            self._conn.execute(
+                "update arxiv_metadata set last_accessed_at = ? where arxiv_id = ?",
+                (now, arxiv_id),
+            )
+            self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    def put(
+        self,
+        arxiv_id: str,
+        paper_data: Dict[str, Any],
+        ttl_seconds: Optional[float] = None,
+    ) -> None:
+        """Cache metadata for a paper, evicting least-recently-used entries if full."""
+        now = time.time()
+        ttl_seconds = self.default_ttl_seconds if ttl_seconds is None else ttl_seconds
+        values = (arxiv_id, json.dumps(paper_data), paper_data.get("updated_date"), now, now + ttl_seconds, now)
+        with self._lock:
+            # insert and update separately, to know whether there's a new entry.
+            inserted = self._conn.execute(
+                """
+                insert into arxiv_metadata
+                    (arxiv_id, metadata, updated_date, fetched_at, expires_at, last_accessed_at)
+                values (?, ?, ?, ?, ?, ?)
+                on conflict (arxiv_id) do nothing
+                """,
+                values,
+            ).rowcount
+            if inserted:
+                self._num_entries += 1
+            else:
+                self._conn.execute(
+                    """
+                    update arxiv_metadata set
+                        metadata = ?, updated_date = ?, fetched_at = ?, expires_at = ?, last_accessed_at = ?
+                    where arxiv_id = ?
+                    """,
+                    (*values[1:], arxiv_id),
+                )
+            self._puts_since_count += 1
+            if self._puts_since_count >= RECOUNT_EVERY_PUTS:
+                self._num_entries = self._count()
+                self._puts_since_count = 0
+            self._evict_if_full()
+
+    def _evict_if_full(self) -> None:
+        overflow = self._num_entries - self.max_entries
+        if overflow <= 0:
+            return
+        num_deleted = self._conn.execute(
+            """
+            delete from arxiv_metadata where arxiv_id in (
+                select arxiv_id from arxiv_metadata
+                order by last_accessed_at asc
+                limit ?
+            )
+            """,
+            (overflow,),
+        ).rowcount
+        self._num_entries -= num_deleted
+        self.stats["evictions"] += num_deleted
+
+    def get_or_fetch(
+        self,
+        arxiv_id: str,
+        fetch_fn: Callable[[str], Optional[Dict[str, Any]]],
+        ttl_seconds: Optional[float] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Get metadata from the cache, falling back to `fetch_fn` on a miss.
+
+        A stale entry is only re-fetched if arXiv could have updated the paper
+        since it was fetched. If the re-fetch fails (returns None or raises,
+        e.g. while arXiv is down), the stale entry is returned rather than
+        nothing.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "select metadata, fetched_at, expires_at from arxiv_metadata where arxiv_id = ?",
+                (arxiv_id,),
+            ).fetchone()
+            if row is not None:
+                metadata, fetched_at, expires_at = row
+                if expires_at >= now:
+                    self.stats["hits"] += 1
+                    self._conn.execute(
+                        "update arxiv_metadata set last_accessed_at = ? where arxiv_id = ?",
+                        (now, arxiv_id),
+                    )
+                    return json.loads(metadata)
+                if not could_have_changed(fetched_at, now):
+                    self.stats["stale_revalidations"] += 1
+                    ttl = self.default_ttl_seconds if ttl_seconds is None else ttl_seconds
+                    self._conn.execute(
+                        "update arxiv_metadata set expires_at = ?, last_accessed_at = ? "
+                        "where arxiv_id = ?",
+                        (now + ttl, now, arxiv_id),
+                    )
+                    return json.loads(metadata)
+                self.stats["stale_refreshes"] += 1
+            else:
+                self.stats["misses"] += 1
+
+        try:
+            paper_data = fetch_fn(arxiv_id)
+        except Exception:
+            # e.g. arXiv is down: a stale entry beats an error.
+            if row is None:
+                raise
+            self.stats["stale_served_on_error"] += 1
+            return json.loads(row[0])
+        if paper_data is None:
+            return json.loads(row[0]) if row is not None else None
+        self.put(arxiv_id, paper_data, ttl_seconds=ttl_seconds)
+        return paper_data
+
+    def invalidate(self, arxiv_id: str) -> None:
+        with self._lock:
+            self._num_entries -= self._conn.execute(
+                "delete from arxiv_metadata where arxiv_id = ?", (arxiv_id,)
+            ).rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("delete from arxiv_metadata")
+            self._num_entries = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._num_entries = self._count()
+            return self._num_entries
+
+    def hit_rate(self) -> float:
+        hits = self.stats["hits"] + self.stats["stale_revalidations"]
+        total = hits + self.stats["misses"] + self.stats["stale_refreshes"]
+        return hits / total if total else 0.0
+
+
+_arxiv_cache: Optional[ArxivMetadataCache] = None
+_arxiv_cache_lock = threading.Lock()
+
+
+def get_arxiv_cache() -> ArxivMetadataCache:
+    """Get the process-wide arXiv metadata cache."""
+    global _arxiv_cache
+    if _arxiv_cache is None:
+        with _arxiv_cache_lock:
+            if _arxiv_cache is None:
+                _arxiv_cache = ArxivMetadataCache()
+    return _arxiv_cache
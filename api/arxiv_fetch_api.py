@@ -1,106 +1,488 @@
-"""API for fetching papers from Arxiv."""
-import urllib
-import urllib.request
+"""API for fetching papers from Arxiv.
+
+`urllib.request`, the arXiv cache and the arXiv snapshot are imported on
+first use, to keep this module cheap to import for callers that only parse
+feeds.
+
+Papers are looked up in the local arXiv snapshot first (see
+`api.arxiv_snapshot`), if there is one, then in the arXiv cache, and only
+then fetched from arXiv.
+
+Requests to arXiv get the time left before the caller's deadline (see
+`lib.resilience.deadline`), or `DEFAULT_REQUEST_TIMEOUT_SECONDS`, are
+retried with jittered backoff on connection errors, timeouts and 5xx/429
+responses, and fail fast with `ArxivUnavailableError` while arXiv keeps
+failing (`arxiv_breaker`).
+"""
+import time
+import urllib.parse
 import xml.etree.ElementTree as ET
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator
 from datetime import datetime
 
+from api.arxiv_ids import normalize_arxiv_id
+from lib.metrics import timed
+from lib.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    call_with_resilience,
+    deadline,
+    is_transient_error,
+)
+
+ARXIV_API_URL = "http://export.arxiv.org/api/query"
+
+# number of IDs to put in a single `id_list` (keeps the URL a sane length).
+DEFAULT_CHUNK_SIZE = 100
+# number of entries to request per page within a chunk.
+DEFAULT_PAGE_SIZE = 100
+# arXiv asks API clients to wait ~3 seconds between consecutive requests.
+DEFAULT_REQUEST_INTERVAL_SECONDS = 3.0
+# timeout per request, when the caller didn't set a deadline.
+DEFAULT_REQUEST_TIMEOUT_SECONDS = 30.0
+# transient failures are retried after ~1s, then ~2s (jittered).
+ARXIV_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay_seconds=1.0, max_delay_seconds=4.0)
+# send a second single-paper request if the first hasn't returned after this
+# many seconds; None to never hedge (arXiv asks clients not to burst).
+ARXIV_HEDGE_AFTER_SECONDS: Optional[float] = None
+
+# shared by the sync and async clients, so both fail fast while arXiv is down.
+arxiv_breaker = CircuitBreaker("arxiv", failure_threshold=5, reset_timeout_seconds=30.0)
+
+# fully-qualified tag names, so we don't resolve namespace prefixes per lookup.
+_ATOM = "{http://www.w3.org/2005/Atom}"
+_ARXIV = "{http://arxiv.org/schemas/atom}"
+_OPENSEARCH = "{http://a9.com/-/spec/opensearch/1.1/}"
+_ENTRY_TAG = f"{_ATOM}entry"
+_TOTAL_RESULTS_TAG = f"{_OPENSEARCH}totalResults"
+
+
+class ArxivUnavailableError(RuntimeError):
+    """arXiv couldn't be reached (after retries, within the deadline), or its
+    circuit breaker is open. Unlike a missing paper, worth trying again later."""
+
+
+def _strip_arxiv_version(arxiv_id: str) -> str:
+    """Strip a trailing version suffix (e.g. "v2") from an arxiv id."""
+    head, sep, tail = arxiv_id.rpartition("v")
+    if sep and head and tail.isdigit():
+        return head
+    return arxiv_id
+
+
+def _entry_id_from_atom_id(atom_id: str) -> str:
+    """Get the arxiv id from an entry's <id>, e.g. http://arxiv.org/abs/2410.08698v1."""
+    if "/abs/" in atom_id:
+        return atom_id.split("/abs/", 1)[1]
+    return atom_id.split("/")[-1]
+
+
+def _format_arxiv_date(date_str: str) -> str:
+    """Convert an arXiv timestamp (e.g. 2024-10-11T17:59:59Z) to YYYY-MM-DD."""
+    return datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%SZ').strftime('%Y-%m-%d')
+
+
+def _parse_arxiv_entry(entry: ET.Element) -> tuple[str, Dict[str, Any]]:
+    """Parse a single <entry> element in one pass over its children.
+
+    Returns:
+        Tuple of (entry id, e.g. "2410.08698v1", paper dictionary).
+    """
+    title = summary = atom_id = published = updated = comment = None
+    authors = []
+    links = {}
+    categories = []
+    for child in entry:
+        tag = child.tag
+        if tag == f"{_ATOM}author":
+            name = child.find(f"{_ATOM}name")
+            authors.append(name.text if name is not None else None)
+        elif tag == f"{_ATOM}link":
+            links[child.get('title', 'alternate')] = child.get('href')
+        elif tag == f"{_ATOM}category":
+            categories.append(child.get('term'))
+        elif tag == f"{_ATOM}title":
+            title = child.text
+        elif tag == f"{_ATOM}summary":
+            summary = child.text
+        elif tag == f"{_ATOM}id":
+            atom_id = child.text
+        elif tag == f"{_ATOM}published":
+            published = child.text
+        elif tag == f"{_ATOM}updated":
+            updated = child.text
+        elif tag == f"{_ARXIV}comment":
+            comment = child.text
+
+    paper_data = {
+        'title': title.strip(),
+        'abstract': ' '.join(summary.split()),
+        'authors': authors,
+        'arxiv_id': _entry_id_from_atom_id(atom_id),
+        'published_date': _format_arxiv_date(published),
+        'updated_date': _format_arxiv_date(updated),
+        'categories': categories,
+        'links': links,
+        'comment': comment,
+    }
+    return _entry_id_from_atom_id(atom_id), paper_data
+
+
+def _iter_arxiv_feed_entries(
+    source: Any, feed_info: Optional[dict] = None
+) -> Iterator[tuple[str, Dict[str, Any]]]:
+    """Incrementally parse an Atom feed, yielding (entry id, paper) per entry.
+
+    Each <entry> is parsed once as soon as it closes and is then cleared, so
+    memory stays flat regardless of the number of entries in the feed.
+
+    Args:
+        source: A file path or binary file-like object (e.g. an HTTP response).
+        feed_info: Optional dict that gets "total_results" set from the feed's
+            opensearch:totalResults, if present.
+    """
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+        if elem.tag == _ENTRY_TAG:
+            try:
+                yield _parse_arxiv_entry(elem)
+            except Exception as e:
+                # e.g., arXiv returns an error <entry> for malformed ids.
+                print(f"Error parsing ArXiv entry: {str(e)}")
+            elem.clear()
+            root.clear()
+        elif elem.tag == _TOTAL_RESULTS_TAG and feed_info is not None and elem.text:
+            feed_info["total_results"] = int(elem.text)
+
+
+def iter_parse_arxiv_feed(source: Any) -> Iterator[Dict[str, Any]]:
+    """Incrementally parse an Atom feed (path or binary stream) into paper dicts."""
+    for _, paper_data in _iter_arxiv_feed_entries(source):
+        yield paper_data
+
+
 def _parse_arxiv_xml(xml_data: str) -> Optional[Dict[str, Any]]:
     """Parse ArXiv XML response into a dictionary."""
     try:
-        # Define namespaces used in ArXiv XML
-        namespaces = {
-            'atom': 'http://www.w3.org/2005/Atom',
-            'arxiv': 'http://arxiv.org/schemas/atom'
-        }
-        
-        # Parse XML
         root = ET.fromstring(xml_data)
-        
-        # Find the entry element (contains paper data)
-        entry = root.find('.//atom:entry', namespaces)
+        entry = root.find(f'.//{_ENTRY_TAG}')
         if entry is None:
             return None
-            
-        # Extract authors
-        authors = [author.find('atom:name', namespaces).text 
-                  for author in entry.findall('atom:author', namespaces)]
-        
-        # Extract links
-        links = {link.get('title', 'alternate'): link.get('href') 
-                for link in entry.findall('atom:link', namespaces)}
-        
-        # Extract categories
-        categories = [cat.get('term') for cat in entry.findall('atom:category', namespaces)]
-        
-        # Parse dates
-        published = datetime.strptime(
-            entry.find('atom:published', namespaces).text,
-            '%Y-%m-%dT%H:%M:%SZ'
-        )
-        updated = datetime.strptime(
-            entry.find('atom:updated', namespaces).text,
-            '%Y-%m-%dT%H:%M:%SZ'
-        )
-        
-        # Build response dictionary
-        paper_data = {
-            'title': entry.find('atom:title', namespaces).text.strip(),
-            'abstract': ' '.join(entry.find('atom:summary', namespaces).text.strip().split()),
-            'authors': authors,
-            'arxiv_id': entry.find('atom:id', namespaces).text.split('/')[-1],
-            'published_date': published.strftime('%Y-%m-%d'),
-            'updated_date': updated.strftime('%Y-%m-%d'),
-            'categories': categories,
-            'links': links,
-            'comment': entry.find('arxiv:comment', namespaces).text if entry.find('arxiv:comment', namespaces) is not None else None
-        }
-        
+        _, paper_data = _parse_arxiv_entry(entry)
         return paper_data
     except Exception as e:
         print(f"Error parsing ArXiv XML: {str(e)}")
         return None
 
-def fetch_paper_from_arxiv_given_id(arxiv_id: str) -> Optional[Dict[str, Any]]:
-    """Fetch a paper from Arxiv given an arxiv id."""
-    url = f'http://export.arxiv.org/api/query?id_list={arxiv_id}&start=0&max_results=1'
+def _arxiv_host() -> str:
+    """The arXiv API's host, the target of "arxiv.request" metrics."""
+    return urllib.parse.urlsplit(ARXIV_API_URL).netloc
+
+
+class _CountingReader:
+    """Wraps a binary file-like object, counting the bytes read from it."""
+
+    def __init__(self, source: Any):
+        self._source = source
+        self.num_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._source.read(size)
+        self.num_bytes += len(data)
+        return data
+
+
+def _get_paper_from_snapshot(arxiv_id: str) -> Optional[Dict[str, Any]]:
+    """Get a paper from the local arXiv snapshot, or None if it isn't in it (or there's none)."""
+    from api.arxiv_snapshot import get_arxiv_snapshot
+
+    snapshot = get_arxiv_snapshot()
+    return snapshot.get(arxiv_id) if snapshot is not None else None
+
+
+def fetch_paper_from_arxiv_given_id(
+    arxiv_id: str, deadline_seconds: Optional[float] = None, use_snapshot: bool = True
+) -> Optional[Dict[str, Any]]:
+    """Fetch a paper from Arxiv given an arxiv id.
+
+    Args:
+        arxiv_id: The arxiv id, e.g. "2410.08698"
+        deadline_seconds: Max seconds for the fetch, including retries
+            (within the caller's deadline, if shorter)
+        use_snapshot: Look the paper up in the local arXiv snapshot first
+
+    Returns:
+        The paper dictionary, or None if arXiv doesn't have the paper (or
+        rejected the id). Raises ArxivUnavailableError if arXiv couldn't be
+        reached, so callers can tell the two apart.
+    """
+    if use_snapshot:
+        paper_data = _get_paper_from_snapshot(arxiv_id)
+        if paper_data is not None:
+            return paper_data
     try:
-        data = urllib.request.urlopen(url)
-        xml_data = data.read().decode('utf-8')
-        return _parse_arxiv_xml(xml_data)
+        with deadline(deadline_seconds):
+            results, _ = _fetch_arxiv_feed(
+                {"id_list": arxiv_id, "start": 0, "max_results": 1},
+                hedge_after_seconds=ARXIV_HEDGE_AFTER_SECONDS,
+            )
+    except (ArxivUnavailableError, TimeoutError):
+        raise
     except Exception as e:
         print(f"Error fetching paper from ArXiv: {str(e)}")
         return None
+    return results[0][1] if results else None
+
+def fetch_paper_from_arxiv_given_url(url: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+    """Fetch a paper from Arxiv given a url.
+
+    Reads from the local arXiv snapshot and then the local arXiv metadata
+    cache first (see `api.arxiv_snapshot` and `api.arxiv_cache`), only going
+    to arXiv on a miss or when a stale entry could have changed.
+    """
+    from api.arxiv_cache import get_arxiv_cache
+
+    id = normalize_arxiv_id(url) or url.split("/")[-1]
+    if not use_cache:
+        return fetch_paper_from_arxiv_given_id(id, use_snapshot=False)
+    paper_data = _get_paper_from_snapshot(id)
+    if paper_data is not None:
+        return paper_data
+    return get_arxiv_cache().get_or_fetch(
+        id, lambda arxiv_id: fetch_paper_from_arxiv_given_id(arxiv_id, use_snapshot=False)
+    )
+
+def _fetch_arxiv_feed(
+    params: dict[str, Any], hedge_after_seconds: Optional[float] = None
+) -> tuple[list[tuple[str, Dict[str, Any]]], Optional[int]]:
+    """Run a query against the arXiv API and parse the resulting feed.
+
+    Returns:
+        Tuple of ((entry_id, paper) pairs, total number of results or None).
+        Raises ArxivUnavailableError if arXiv couldn't be reached.
+    """
+    from urllib.request import urlopen
+
+    url = f"{ARXIV_API_URL}?{urllib.parse.urlencode(params, safe=',:')}"
+
+    def fetch(timeout: Optional[float]) -> tuple[list[tuple[str, Dict[str, Any]]], Optional[int]]:
+        feed_info: dict[str, int] = {}
+        with timed("arxiv.request", _arxiv_host()) as op, urlopen(url, timeout=timeout) as response:
+            reader = _CountingReader(response)
+            results = list(_iter_arxiv_feed_entries(reader, feed_info))
+            op.num_bytes = reader.num_bytes
+        return results, feed_info.get("total_results")
+
+    try:
+        return call_with_resilience(
+            fetch,
+            idempotent=True,
+            retry=ARXIV_RETRY_POLICY,
+            breaker=arxiv_breaker,
+            default_timeout_seconds=DEFAULT_REQUEST_TIMEOUT_SECONDS,
+            hedge_after_seconds=hedge_after_seconds,
+        )
+    except CircuitOpenError as e:
+        raise ArxivUnavailableError(str(e)) from e
+    except OSError as e:  # includes timeouts, URLError and HTTPError
+        if is_transient_error(e):
+            raise ArxivUnavailableError(f"arXiv request failed: {e}") from e
+        raise
+
+
+def _fetch_arxiv_page(
+    arxiv_ids: list[str], start: int, max_results: int
+) -> tuple[list[tuple[str, Dict[str, Any]]], Optional[int]]:
+    """Fetch a single page of results for a list of arxiv ids."""
+    return _fetch_arxiv_feed(
+        {"id_list": ",".join(arxiv_ids), "start": start, "max_results": max_results}
+    )
+
+
+def iter_papers_from_arxiv_given_ids(
+    arxiv_ids: list[str],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    request_interval_seconds: float = DEFAULT_REQUEST_INTERVAL_SECONDS,
+) -> Iterator[tuple[str, Optional[Dict[str, Any]]]]:
+    """Fetch papers from Arxiv in chunks, yielding results as they arrive.
+
+    Duplicate ids are removed. The ids are split into chunks of `chunk_size`
+    and each chunk is walked page by page (`start`/`max_results`). Once a
+    chunk is done, its results are yielded in the caller's id order.
+
+    Args:
+        arxiv_ids: The arxiv ids to fetch. Versioned ids (e.g. "2410.08698v2")
+            only match that version; unversioned ids match any version.
+        chunk_size: Max number of ids per request.
+        page_size: Max number of entries per page.
+        request_interval_seconds: Time to wait between consecutive requests.
+
+    Yields:
+        (arxiv_id, paper) tuples, where paper is None if arXiv didn't return
+        the id (or rejected the request). Raises ArxivUnavailableError (or
+        TimeoutError) if arXiv couldn't be reached, rather than yielding the
+        rest of the ids as missing.
+    """
+    if chunk_size < 1 or page_size < 1:
+        raise ValueError("chunk_size and page_size must be positive.")
+    unique_ids = list(dict.fromkeys(arxiv_ids))
+    last_request_at: Optional[float] = None
+
+    for chunk_start in range(0, len(unique_ids), chunk_size):
+        chunk = unique_ids[chunk_start:chunk_start + chunk_size]
+        found: dict[str, Dict[str, Any]] = {}
+        start = 0
+        while start < len(chunk):
+            if last_request_at is not None:
+                wait = request_interval_seconds - (time.monotonic() - last_request_at)
+                if wait > 0:
+                    time.sleep(wait)
+            last_request_at = time.monotonic()
+            try:
+                page, total_results = _fetch_arxiv_page(chunk, start, page_size)
+            except (ArxivUnavailableError, TimeoutError):
+                raise
+            except Exception as e:
+                print(f"Error fetching papers from ArXiv: {str(e)}")
+                break
+            for entry_id, paper_data in page:
+                found.setdefault(entry_id, paper_data)
+                found.setdefault(_strip_arxiv_version(entry_id), paper_data)
+            start += page_size
+            if total_results is not None and start >= total_results:
+                break
+            if len(page) < page_size:
+                break
+
+        for arxiv_id in chunk:
+            yield arxiv_id, found.get(arxiv_id)
+
+
+def fetch_papers_from_arxiv_given_ids_in_bulk(
+    arxiv_ids: list[str],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    request_interval_seconds: float = DEFAULT_REQUEST_INTERVAL_SECONDS,
+) -> dict[str, list]:
+    """Fetch papers from Arxiv in chunks, and report which ids were missing.
+
+    Returns:
+        Dictionary with "papers" (in the caller's id order, deduplicated) and
+        "missing_ids" (ids that arXiv didn't return). Raises
+        ArxivUnavailableError if arXiv couldn't be reached.
+    """
+    papers = []
+    missing_ids = []
+    for arxiv_id, paper_data in iter_papers_from_arxiv_given_ids(
+        arxiv_ids,
+        chunk_size=chunk_size,
+        page_size=page_size,
+        request_interval_seconds=request_interval_seconds,
+    ):
+        if paper_data is None:
+            missing_ids.append(arxiv_id)
+        else:
+            papers.append(paper_data)
+    return {"papers": papers, "missing_ids": missing_ids}
 
-def fetch_paper_from_arxiv_given_url(url: str) -> Optional[Dict[str, Any]]:
-    """Fetch a paper from Arxiv given a url."""
-    id = url.split("/")[-1]
-    return fetch_paper_from_arxiv_given_id(id)
 
 def fetch_papers_from_arxiv_given_ids(arxiv_ids: list[str]) -> list[Dict[str, Any]]:
     """Fetch papers from Arxiv."""
-    ids_str = ",".join(arxiv_ids)
-    max_results = len(arxiv_ids)
-    url = f'http://export.arxiv.org/api/query?id_list={ids_str}&start=0&max_results={max_results}'
-    try:
-        data = urllib.request.urlopen(url)
-        xml_data = data.read().decode('utf-8')
-        
-        # Parse multiple entries
-        root = ET.fromstring(xml_data)
-        namespaces = {
-            'atom': 'http://www.w3.org/2005/Atom',
-            'arxiv': 'http://arxiv.org/schemas/atom'
-        }
-        
-        papers = []
-        for entry in root.findall('.//atom:entry', namespaces):
-            entry_xml = ET.tostring(entry, encoding='unicode')
-            paper_data = _parse_arxiv_xml(f'<?xml version="1.0" encoding="UTF-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">{entry_xml}</feed>')
-            if paper_data:
-                papers.append(paper_data)
-        
-        return papers
-    except Exception as e:
-        print(f"Error fetching papers from ArXiv: {str(e)}")
-        return []
+    return fetch_papers_from_arxiv_given_ids_in_bulk(arxiv_ids)["papers"]
+
+
+def fetch_papers_from_arxiv_given_urls(
+    urls: list[str], use_cache: bool = True
+) -> dict[str, Optional[Dict[str, Any]]]:
+    """Fetch papers from Arxiv given urls, in as few requests as possible.
+
+    Papers in the local arXiv snapshot or cache are served from them, the
+    rest are fetched in bulk (and then cached).
+
+    Returns:
+        Dictionary of url -> paper (None if arXiv doesn't have it). Raises
+        ArxivUnavailableError if arXiv couldn't be reached; the papers
+        fetched until then are cached.
+    """
+    from api.arxiv_cache import get_arxiv_cache
+
+    ids_by_url = {url: normalize_arxiv_id(url) or url.split("/")[-1] for url in urls}
+    papers_by_id: dict[str, Dict[str, Any]] = {}
+    cache = get_arxiv_cache() if use_cache else None
+    if cache is not None:
+        for arxiv_id in set(ids_by_url.values()):
+            paper_data = _get_paper_from_snapshot(arxiv_id) or cache.get(arxiv_id)
+            if paper_data is not None:
+                papers_by_id[arxiv_id] = paper_data
+    missing_ids = [
+        arxiv_id for arxiv_id in dict.fromkeys(ids_by_url.values())
+        if arxiv_id not in papers_by_id
+    ]
+    for arxiv_id, paper_data in iter_papers_from_arxiv_given_ids(missing_ids):
+        if paper_data is None:
+            continue
+        papers_by_id[arxiv_id] = paper_data
+        if cache is not None:
+            cache.put(arxiv_id, paper_data)
+    return {url: papers_by_id.get(arxiv_id) for url, arxiv_id in ids_by_url.items()}
+
+
+def iter_papers_from_arxiv_given_query(
+    search_query: str,
+    start: int = 0,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    sort_by: str = "lastUpdatedDate",
+    sort_order: str = "ascending",
+    request_interval_seconds: float = DEFAULT_REQUEST_INTERVAL_SECONDS,
+) -> Iterator[tuple[int, Dict[str, Any]]]:
+    """Page through the results of an arXiv search query.
+
+    Unlike the id lookups, errors are raised rather than swallowed, so a
+    caller that checkpoints the yielded offsets can resume where it left off
+    by passing `start`.
+
+    Args:
+        search_query: arXiv search query, e.g.
+            "cat:cs.LG AND lastUpdatedDate:[202410110000 TO 202410120000]".
+        start: Offset of the first result to fetch.
+        page_size: Max number of entries per page.
+        sort_by: "lastUpdatedDate", "submittedDate" or "relevance".
+        sort_order: "ascending" or "descending".
+        request_interval_seconds: Time to wait between consecutive requests.
+
+    Yields:
+        (offset, paper) tuples, where offset is the paper's position in the
+        query's results.
+    """
+    last_request_at: Optional[float] = None
+    while True:
+        if last_request_at is not None:
+            wait = request_interval_seconds - (time.monotonic() - last_request_at)
+            if wait > 0:
+                time.sleep(wait)
+        last_request_at = time.monotonic()
+        page, total_results = _fetch_arxiv_feed(
+            {
+                "search_query": search_query,
+                "start": start,
+                "max_results": page_size,
+                "sortBy": sort_by,
+                "sortOrder": sort_order,
+            }
+        )
+        if not page and total_results is not None and start < total_results:
+            # arXiv occasionally returns empty pages mid-way through results.
+            raise RuntimeError(
+                f"arXiv returned an empty page at offset {start} of {total_results}."
+            )
+        for offset, (_, paper_data) in enumerate(page, start=start):
+            yield offset, paper_data
+        start += page_size
+        if not page or (total_results is not None and start >= total_results):
+            return
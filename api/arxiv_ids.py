@@ -0,0 +1,53 @@
+"""Canonical arXiv ids.
+
+The same paper shows up under many URLs and ids, e.g.:
+- https://arxiv.org/abs/2410.08698
+- https://arxiv.org/pdf/2410.08698v2.pdf
+- arXiv:2410.08698v2
+- http://arxiv.org/abs/hep-th/9901001v1 (old-style ids)
+
+`normalize_arxiv_id` maps all of these to one canonical id (the unversioned
+id, e.g. "2410.08698" or "hep-th/9901001"), which is what we key papers on.
+"""
+import re
+from typing import Optional
+
+# new-style ids (since 2007): YYMM.NNNN, or YYMM.NNNNN since 2015.
+_new_style_id = r"\d{4}\.\d{4,5}"
+# old-style ids: archive(.subject class)/YYMMNNN, e.g. hep-th/9901001, math.CO/0101001.
+_old_style_id = r"[a-z][a-z\-]*(?:\.[A-Z]{2})?/\d{7}"
+
+_arxiv_id_pattern = re.compile(
+    rf"(?:^|/|arxiv:)(?P<id>{_new_style_id}|{_old_style_id})(?:v(?P<version>\d+))?(?:\.pdf)?/?$",
+    re.IGNORECASE,
+)
+
+
+def parse_arxiv_id(id_or_url: str) -> Optional[tuple[str, Optional[int]]]:
+    """Parse an arXiv id or URL into (canonical id, version or None).
+
+    Returns None if it isn't a recognizable arXiv id or URL.
+    """
+    value = id_or_url.strip().split("?", 1)[0].split("#", 1)[0]
+    match = _arxiv_id_pattern.search(value)
+    if match is None:
+        return None
+    arxiv_id = match.group("id")
+    if "/" in arxiv_id:
+        archive, number = arxiv_id.split("/")
+        # the archive is lowercase, but the subject class (e.g. math.CO) isn't.
+        archive_name, dot, subject_class = archive.partition(".")
+        arxiv_id = f"{archive_name.lower()}{dot}{subject_class.upper()}/{number}"
+    version = match.group("version")
+    return arxiv_id, int(version) if version else None
+
+
+def normalize_arxiv_id(id_or_url: str) -> Optional[str]:
+    """Get the canonical (unversioned) arXiv id for an id or URL, or None."""
+    parsed = parse_arxiv_id(id_or_url)
+    return parsed[0] if parsed is not None else None
+
+
+def canonical_arxiv_url(arxiv_id: str) -> str:
+    """The URL we store arXiv papers under, e.g. https://arxiv.org/abs/2410.08698."""
+    return f"https://arxiv.org/abs/{normalize_arxiv_id(arxiv_id) or arxiv_id}"
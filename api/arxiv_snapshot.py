@@ -0,0 +1,359 @@
+"""Local copy of arXiv's metadata snapshot, for lookups without the arXiv API.
+
+arXiv publishes its metadata for every paper (~2.5M) as one JSONL file, e.g.
+https://www.kaggle.com/datasets/Cornell-University/arxiv. `build_arxiv_snapshot`
+loads it into a single file: each paper's metadata as a compact, compressed
+record, followed by an index of the papers' arXiv ids, sorted, with fixed-size
+entries. `ArxivSnapshot` memory-maps the file and binary searches the index,
+so a lookup is O(log n) and only touches the pages it reads; nothing is
+loaded into memory up front.
+
+The JSONL file is split into byte ranges that are parsed in a process pool,
+and the records are written in the file's order as the ranges finish, so
+memory stays bounded by the ranges in flight.
+
+Lookups return the same dict as `api.arxiv_fetch_api._parse_arxiv_xml` for
+the paper's latest version. `fetch_paper_from_arxiv_given_id` tries the
+snapshot (at ARXIV_SNAPSHOT_PATH) first, if there is one, and only goes to
+arXiv for papers newer than the snapshot, or for older versions.
+
+Usage:
+    python api/arxiv_snapshot.py arxiv-metadata-oai-snapshot.json
+
+    get_arxiv_snapshot().get("2410.08698")  # {"title": ..., "arxiv_id": "2410.08698v1", ...}
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from api.arxiv_ids import parse_arxiv_id
+from lib import env_vars
+
+# bytes of the JSONL file parsed per task.
+DEFAULT_CHUNK_BYTES = 32 * 1024 * 1024
+
+_file_magic = b"GPARXSNP"
+_file_version = 1
+# the JSON header is padded to this size, so it can be written last.
+_header_size = 4096
+# index entries are (id, padded with zero bytes to the id width, record offset, record length).
+_index_entry_format = "<{id_width}sQI"
+_month_numbers = {
+    month: idx + 1
+    for idx, month in enumerate(["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"])
+}
+
+
+def _format_version_date(created: str) -> str:
+    """Convert a version's timestamp (e.g. "Mon, 2 Apr 2007 19:18:42 GMT") to YYYY-MM-DD."""
+    # parsed by hand, since strptime is most of the cost of a record.
+    _, day, month, year = created.split(" ", 4)[:4]
+    return f"{year}-{_month_numbers[month]:02d}-{int(day):02d}"
+
+
+def _author_name(parsed_name: list[str]) -> str:
+    """e.g. ["Balázs", "C.", ""] -> "C. Balázs", as the arXiv API names authors."""
+    last, first, suffix = (parsed_name + ["", "", ""])[:3]
+    return " ".join(part for part in (first, last, suffix) if part)
+
+
+def compact_record(record: Dict[str, Any]) -> tuple[str, list]:
+    """Get (canonical arxiv id, compact record) for a line of the snapshot."""
+    versions = record["versions"]
+    parsed = parse_arxiv_id(record["id"])
+    arxiv_id = parsed[0] if parsed is not None else record["id"]
+    authors = (
+        [_author_name(name) for name in record["authors_parsed"]]
+        if record.get("authors_parsed")
+        else [name.strip() for name in record["authors"].split(",")]
+    )
+    return arxiv_id, [
+        f"{record['id']}{versions[-1]['version']}",
+        record["title"].strip(),
+        " ".join(record["abstract"].split()),
+        authors,
+        _format_version_date(versions[0]["created"]),
+        _format_version_date(versions[-1]["created"]),
+        record["categories"].split(),
+        record.get("doi"),
+        record.get("comments"),
+    ]
+
+
+def paper_from_compact_record(compact: list) -> Dict[str, Any]:
+    """Get the paper dict (as returned by `_parse_arxiv_xml`) for a compact record."""
+    versioned_id, title, abstract, authors, published_date, updated_date, categories, doi, comment = compact
+    links = {
+        "alternate": f"http://arxiv.org/abs/{versioned_id}",
+        "pdf": f"http://arxiv.org/pdf/{versioned_id}",
+    }
+    if doi:
+        links["doi"] = f"http://dx.doi.org/{doi}"
+    return {
+        "title": title,
+        "abstract": abstract,
+        "authors": authors,
+        "arxiv_id": versioned_id,
+        "published_date": published_date,
+        "updated_date": updated_date,
+        "categories": categories,
+        "links": links,
+        "comment": comment,
+    }
+
+
+def _encode(compact: list) -> bytes:
+    return zlib.compress(json.dumps(compact, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def _load_chunk(path: str, start: int, end: int) -> tuple[bytes, list[tuple[str, int, int]], int]:
+    """Parse the lines starting in [start, end) of a JSONL file into records.
+
+    Returns:
+        Tuple of (the encoded records, concatenated, (arxiv id, offset in
+        them, length) per record, number of lines that failed to parse).
+    """
+    blob = bytearray()
+    entries = []
+    errors = 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                arxiv_id, compact = compact_record(json.loads(line))
+            except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                errors += 1
+                continue
+            encoded = _encode(compact)
+            entries.append((arxiv_id, len(blob), len(encoded)))
+            blob += encoded
+    return bytes(blob), entries, errors
+
+
+def _chunk_ranges(path: str, chunk_bytes: int) -> Iterator[tuple[int, int]]:
+    """Split a file into byte ranges of ~chunk_bytes that start at a line start."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()  # the rest of the line belongs to this range.
+            end = min(f.tell(), size)
+            yield start, end
+            start = end
+
+
+def build_arxiv_snapshot(
+    jsonl_path: str,
+    path: Optional[str] = None,
+    max_workers: Optional[int] = None,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+) -> dict[str, int]:
+    """Load arXiv's JSONL metadata snapshot into a snapshot file.
+
+    The file is written to a temp file and then renamed, so readers keep
+    serving the previous snapshot until it's done.
+
+    Args:
+        jsonl_path: The JSONL snapshot, one paper per line
+        path: Where to write the snapshot, by default ARXIV_SNAPSHOT_PATH
+        max_workers: Processes parsing the JSONL file, by default one per CPU
+        chunk_bytes: Bytes of the JSONL file parsed per task
+
+    Returns:
+        Counts of "papers" written, and "errors" (lines that failed to parse).
+    """
+    # imported here, since only building needs them.
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    from lib.logger import get_logger
+
+    logger = get_logger(__name__)
+    path = path or env_vars.ARXIV_SNAPSHOT_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    max_workers = max_workers or os.cpu_count() or 1
+
+    ids: list[bytes] = []
+    offsets = array("q")
+    lengths = array("I")
+    errors = 0
+    with open(tmp_path, "wb") as f, ProcessPoolExecutor(max_workers=max_workers) as executor:
+        f.write(b"\0" * _header_size)
+        # at most 2 chunks per worker in flight, so memory stays bounded.
+        pending: deque = deque()
+        ranges = _chunk_ranges(jsonl_path, chunk_bytes)
+        while True:
+            while len(pending) < 2 * max_workers:
+                chunk_range = next(ranges, None)
+                if chunk_range is None:
+                    break
+                pending.append(executor.submit(_load_chunk, jsonl_path, *chunk_range))
+            if not pending:
+                break
+            blob, entries, chunk_errors = pending.popleft().result()
+            base = f.tell()
+            f.write(blob)
+            for arxiv_id, offset, length in entries:
+                ids.append(arxiv_id.encode("utf-8"))
+                offsets.append(base + offset)
+                lengths.append(length)
+            errors += chunk_errors
+            if len(ids) // 500_000 != (len(ids) - len(entries)) // 500_000:
+                logger.info(f"Loaded {len(ids)} papers from the arXiv snapshot.")
+
+        # the sort is stable, so a paper listed twice keeps its last record.
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        order = [idx for pos, idx in enumerate(order) if pos + 1 == len(order) or ids[order[pos + 1]] != ids[idx]]
+        id_width = max((len(arxiv_id) for arxiv_id in ids), default=1)
+        entry_struct = struct.Struct(_index_entry_format.format(id_width=id_width))
+        index_offset = f.tell()
+        for idx in order:
+            f.write(entry_struct.pack(ids[idx], offsets[idx], lengths[idx]))
+
+        header = json.dumps(
+            {
+                "version": _file_version,
+                "num_papers": len(order),
+                "id_width": id_width,
+                "index_offset": index_offset,
+                "source": os.path.basename(jsonl_path),
+                "built_at": datetime.now().isoformat(timespec="seconds"),
+            }
+        ).encode("utf-8")
+        f.seek(0)
+        f.write(_file_magic)
+        f.write(len(header).to_bytes(4, "little"))
+        f.write(header)
+    os.replace(tmp_path, path)
+    logger.info(f"Built arXiv snapshot with {len(order)} papers ({errors} lines failed to parse).")
+    return {"papers": len(order), "errors": errors}
+
+
+class ArxivSnapshot:
+    """Memory-mapped arXiv snapshot file, for lookups by arXiv id."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(_file_magic)) != _file_magic:
+                raise ValueError(f"Not an arXiv snapshot: {path}")
+            header = json.loads(f.read(int.from_bytes(f.read(4), "little")))
+            if header["version"] != _file_version:
+                raise ValueError(f"Unsupported arXiv snapshot version: {header['version']}")
+            self._inode = os.fstat(f.fileno()).st_ino
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = header
+        self._num_papers = header["num_papers"]
+        self._id_width = header["id_width"]
+        self._index_offset = header["index_offset"]
+        self._entry_struct = struct.Struct(_index_entry_format.format(id_width=self._id_width))
+
+    def __len__(self) -> int:
+        return self._num_papers
+
+    def _find(self, arxiv_id: str) -> Optional[tuple[int, int]]:
+        """Binary search the index for an id's (record offset, length)."""
+        key = arxiv_id.encode("utf-8")
+        if len(key) > self._id_width:
+            return None
+        key = key.ljust(self._id_width, b"\0")
+        entry_size = self._entry_struct.size
+        lo, hi = 0, self._num_papers
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._index_offset + mid * entry_size
+            entry_id = self._mmap[pos:pos + self._id_width]
+            if entry_id < key:
+                lo = mid + 1
+            elif entry_id > key:
+                hi = mid
+            else:
+                _, offset, length = self._entry_struct.unpack_from(self._mmap, pos)
+                return offset, length
+        return None
+
+    def get(self, arxiv_id: str) -> Optional[Dict[str, Any]]:
+        """Get a paper by arxiv id or URL, or None if it isn't in the snapshot.
+
+        Versioned ids only match the paper's latest version, since the
+        snapshot only has that version's metadata.
+        """
+        parsed = parse_arxiv_id(arxiv_id)
+        if parsed is None:
+            return None
+        canonical_id, version = parsed
+        found = self._find(canonical_id)
+        if found is None:
+            return None
+        offset, length = found
+        paper = paper_from_compact_record(json.loads(zlib.decompress(self._mmap[offset:offset + length])))
+        if version is not None and not paper["arxiv_id"].endswith(f"v{version}"):
+            return None
+        return paper
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over the papers, in arxiv id order."""
+        entry_size = self._entry_struct.size
+        for idx in range(self._num_papers):
+            _, offset, length = self._entry_struct.unpack_from(self._mmap, self._index_offset + idx * entry_size)
+            yield paper_from_compact_record(json.loads(zlib.decompress(self._mmap[offset:offset + length])))
+
+    def is_stale(self) -> bool:
+        """Whether the file has been replaced since it was mapped."""
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except FileNotFoundError:
+            return False
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+_snapshot: Optional[ArxivSnapshot] = None
+_snapshot_lock = threading.Lock()
+
+
+def get_arxiv_snapshot() -> Optional[ArxivSnapshot]:
+    """Get the process-wide snapshot, or None if there's no snapshot file.
+
+    A snapshot file that's been replaced (e.g. by a newer build) is mapped
+    again on the next call.
+    """
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is not None and not snapshot.is_stale():
+        return snapshot
+    path = env_vars.ARXIV_SNAPSHOT_PATH
+    if not path or not os.path.exists(path):
+        return None
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.is_stale():
+            # the old mapping isn't closed, since other threads may be reading it.
+            _snapshot = ArxivSnapshot(path)
+        return _snapshot
+
+
+def set_arxiv_snapshot(snapshot: Optional[ArxivSnapshot]) -> None:
+    """Replace the process-wide snapshot. Pass None to map the file again on next use."""
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = snapshot
+
+
+if __name__ == "__main__":
+    import sys
+
+    print(build_arxiv_snapshot(sys.argv[1], *sys.argv[2:3]))
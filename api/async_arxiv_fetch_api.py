@@ -0,0 +1,207 @@
+"""Async client for fetching papers from Arxiv.
+
+Counterpart to the blocking functions in `api.arxiv_fetch_api`, returning
+the same paper dicts. A single `AsyncArxivClient` reuses keep-alive
+connections, spaces requests with a token bucket (arXiv asks for ~1 request
+every 3 seconds), bounds concurrency, and applies a deadline per request,
+within which transient failures are retried. It shares the sync client's
+circuit breaker, so both fail fast while arXiv is down. Concurrent fetches
+of the same paper share one request.
+
+Usage:
+    async with AsyncArxivClient() as client:
+        papers = await client.fetch_papers_given_ids(["2410.08698", "2407.01476"])
+"""
+import asyncio
+import io
+import time
+import urllib.parse
+from typing import Any, Dict, Optional
+
+import httpx
+
+from api.arxiv_fetch_api import (
+    ARXIV_API_URL,
+    ARXIV_RETRY_POLICY,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_REQUEST_INTERVAL_SECONDS,
+    _iter_arxiv_feed_entries,
+    _strip_arxiv_version,
+    arxiv_breaker,
+)
+from api.arxiv_ids import normalize_arxiv_id
+from lib.metrics import timed
+from lib.resilience import CircuitBreaker, RetryPolicy, async_call_with_resilience, deadline
+from lib.single_flight import AsyncSingleFlight
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_DEADLINE_SECONDS = 30.0
+
+
+class TokenBucket:
+    """Async token bucket rate limiter.
+
+    Tokens refill at `rate` per second, up to `capacity`. Waiters are served
+    in FIFO order.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("rate must be positive and capacity at least 1.")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class AsyncArxivClient:
+    """Async arXiv API client with connection reuse and rate limiting.
+
+    Attributes:
+        single_flight: Coalesces concurrent single-paper fetches of the same
+            arXiv ID; see its stats() for the coalescing ratio.
+    """
+
+    def __init__(
+        self,
+        base_url: str = ARXIV_API_URL,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        request_interval_seconds: float = DEFAULT_REQUEST_INTERVAL_SECONDS,
+        burst: int = 1,
+        deadline_seconds: float = DEFAULT_DEADLINE_SECONDS,
+        retry_policy: RetryPolicy = ARXIV_RETRY_POLICY,
+        breaker: Optional[CircuitBreaker] = arxiv_breaker,
+    ):
+        self.base_url = base_url
+        self.retry_policy = retry_policy
+        self.breaker = breaker
+        self._host = urllib.parse.urlsplit(base_url).netloc
+        self.deadline_seconds = deadline_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.single_flight = AsyncSingleFlight()
+        # a request interval of 0 disables rate limiting (e.g. for a local server).
+        self._rate_limiter = (
+            TokenBucket(rate=1 / request_interval_seconds, capacity=burst)
+            if request_interval_seconds > 0
+            else None
+        )
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+            ),
+            timeout=httpx.Timeout(deadline_seconds),
+        )
+
+    async def __aenter__(self) -> "AsyncArxivClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._http_client.aclose()
+
+    async def _query(self, params: dict[str, Any]) -> list[tuple[str, Dict[str, Any]]]:
+        async with self._semaphore:
+            if self._rate_limiter is not None:
+                await self._rate_limiter.acquire()
+            with timed("arxiv.request", self._host) as op:
+                response = await self._http_client.get(self.base_url, params=params)
+                response.raise_for_status()
+                op.num_bytes = len(response.content)
+        return list(_iter_arxiv_feed_entries(io.BytesIO(response.content)))
+
+    async def query(
+        self, params: dict[str, Any], deadline_seconds: Optional[float] = None
+    ) -> list[tuple[str, Dict[str, Any]]]:
+        """Run an arXiv API query, returning (entry id, paper) pairs.
+
+        The deadline covers waiting for the rate limiter and the request,
+        including retries, and is shortened by the caller's deadline (see
+        `lib.resilience.deadline`). Raises `TimeoutError` if it's exceeded,
+        and `CircuitOpenError` while arXiv is down.
+        """
+        deadline_seconds = self.deadline_seconds if deadline_seconds is None else deadline_seconds
+        with deadline(deadline_seconds):
+            return await async_call_with_resilience(
+                lambda timeout: self._query(params),
+                idempotent=True,
+                retry=self.retry_policy,
+                breaker=self.breaker,
+            )
+
+    async def fetch_paper_given_id(
+        self, arxiv_id: str, deadline_seconds: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Fetch a paper from Arxiv given an arxiv id."""
+        try:
+            results = await self.single_flight.do(
+                arxiv_id,
+                lambda: self.query(
+                    {"id_list": arxiv_id, "start": 0, "max_results": 1},
+                    deadline_seconds=deadline_seconds,
+                ),
+            )
+        except Exception as e:
+            print(f"Error fetching paper from ArXiv: {repr(e)}")
+            return None
+        return results[0][1] if results else None
+
+    async def fetch_paper_given_url(
+        self, url: str, deadline_seconds: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Fetch a paper from Arxiv given a url."""
+        arxiv_id = normalize_arxiv_id(url) or url.split("/")[-1]
+        return await self.fetch_paper_given_id(arxiv_id, deadline_seconds)
+
+    async def fetch_papers_given_ids(
+        self,
+        arxiv_ids: list[str],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        deadline_seconds: Optional[float] = None,
+    ) -> dict[str, Optional[Dict[str, Any]]]:
+        """Fetch many papers, running chunked `id_list` queries concurrently.
+
+        Returns:
+            Dictionary of arxiv id -> paper (None if missing or failed), in the
+            caller's id order, deduplicated.
+        """
+        unique_ids = list(dict.fromkeys(arxiv_ids))
+        chunks = [
+            unique_ids[start:start + chunk_size]
+            for start in range(0, len(unique_ids), chunk_size)
+        ]
+        chunk_results = await asyncio.gather(
+            *[
+                self.query(
+                    {"id_list": ",".join(chunk), "start": 0, "max_results": len(chunk)},
+                    deadline_seconds=deadline_seconds,
+                )
+                for chunk in chunks
+            ],
+            return_exceptions=True,
+        )
+        found: dict[str, Dict[str, Any]] = {}
+        for results in chunk_results:
+            if isinstance(results, BaseException):
+                print(f"Error fetching papers from ArXiv: {repr(results)}")
+                continue
+            for entry_id, paper_data in results:
+                found.setdefault(entry_id, paper_data)
+                found.setdefault(_strip_arxiv_version(entry_id), paper_data)
+        return {arxiv_id: found.get(arxiv_id) for arxiv_id in unique_ids}
@@ -0,0 +1,127 @@
+"""Benchmark the streaming Atom feed parser against the legacy parser.
+
+The legacy parser loads the whole feed with `ET.fromstring`, and then for
+each <entry> serializes it back to a string, wraps it in a fake <feed>, and
+re-parses it with `_parse_arxiv_xml`.
+
+Both parsers yield papers to the same consumer, either one that keeps them
+all (a list, like the bulk fetches) or one that only counts them (like a
+caller that writes each paper out as it arrives), so the difference
+between them is the parsers' own.
+
+Usage:
+    python api/experiments/benchmark_arxiv_feed_parser.py [--feed path/to/feed.xml] [--entries 2000]
+
+If `--feed` is given (e.g. a feed recorded with
+`curl "http://export.arxiv.org/api/query?search_query=cat:cs.LG&max_results=2000"`),
+it is used as-is. Otherwise a feed of `--entries` entries is generated from an
+entry in arXiv's Atom format.
+"""
+import argparse
+import io
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from typing import Iterator
+
+from api.arxiv_fetch_api import _parse_arxiv_xml, iter_parse_arxiv_feed
+
+sample_entry = """
+  <entry>
+    <id>http://arxiv.org/abs/2410.{idx:05d}v1</id>
+    <updated>2024-10-11T17:59:59Z</updated>
+    <published>2024-10-11T17:59:59Z</published>
+    <title>A Sample Paper Title Number {idx}:
+  With a Line Break</title>
+    <summary>  We study a sample problem and propose a sample method. Our
+method improves on prior work across a range of benchmarks, and we release
+our code and data to support future research in this area.
+</summary>
+    <author>
+      <name>First Author</name>
+    </author>
+    <author>
+      <name>Second Author</name>
+    </author>
+    <author>
+      <name>Third Author</name>
+    </author>
+    <arxiv:comment xmlns:arxiv="http://arxiv.org/schemas/atom">12 pages, 4 figures</arxiv:comment>
+    <link href="http://arxiv.org/abs/2410.{idx:05d}v1" rel="alternate" type="text/html"/>
+    <link title="pdf" href="http://arxiv.org/pdf/2410.{idx:05d}v1" rel="related" type="application/pdf"/>
+    <arxiv:primary_category xmlns:arxiv="http://arxiv.org/schemas/atom" term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>
+    <category term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>
+    <category term="cs.AI" scheme="http://arxiv.org/schemas/atom"/>
+    <category term="cs.CL" scheme="http://arxiv.org/schemas/atom"/>
+  </entry>"""
+
+
+def generate_feed(num_entries: int) -> bytes:
+    entries = "".join(sample_entry.format(idx=idx) for idx in range(num_entries))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<feed xmlns="http://www.w3.org/2005/Atom">\n'
+        '  <opensearch:totalResults xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/">'
+        f'{num_entries}</opensearch:totalResults>\n'
+        f'{entries}\n</feed>\n'
+    ).encode("utf-8")
+
+
+def legacy_parse_feed(feed: bytes) -> Iterator[dict]:
+    """The parsing approach used before the streaming parser."""
+    root = ET.fromstring(feed.decode("utf-8"))
+    namespaces = {'atom': 'http://www.w3.org/2005/Atom'}
+    for entry in root.findall('.//atom:entry', namespaces):
+        entry_xml = ET.tostring(entry, encoding='unicode')
+        paper_data = _parse_arxiv_xml(f'<?xml version="1.0" encoding="UTF-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">{entry_xml}</feed>')
+        if paper_data:
+            yield paper_data
+
+
+def streaming_parse_feed(feed: bytes) -> Iterator[dict]:
+    return iter_parse_arxiv_feed(io.BytesIO(feed))
+
+
+def count_papers(papers: Iterator[dict]) -> int:
+    return sum(1 for _ in papers)
+
+
+def keep_papers(papers: Iterator[dict]) -> int:
+    return len(list(papers))
+
+
+def run(name: str, parse_fn, consume_fn, feed: bytes, repeats: int) -> float:
+    """Time and measure parsing the feed into the consumer. Returns the peak memory in MiB."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        num_papers = consume_fn(parse_fn(feed))
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    consume_fn(parse_fn(feed))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    peak_mib = peak / 1024 / 1024
+    print(f"{name:>20}: {num_papers} papers, best {min(timings) * 1000:.1f} ms, peak memory {peak_mib:.2f} MiB")
+    return peak_mib
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--feed", help="Path to a recorded arXiv Atom feed.")
+    parser.add_argument("--entries", type=int, default=2000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.feed:
+        with open(args.feed, "rb") as f:
+            feed = f.read()
+    else:
+        feed = generate_feed(args.entries)
+
+    assert list(legacy_parse_feed(feed)) == list(streaming_parse_feed(feed))
+    print(f"Feed size: {len(feed) / 1024 / 1024:.2f} MiB")
+    for consumer, consume_fn in (("kept", keep_papers), ("counted", count_papers)):
+        legacy_mib = run(f"legacy, {consumer}", legacy_parse_feed, consume_fn, feed, args.repeats)
+        streaming_mib = run(f"streaming, {consumer}", streaming_parse_feed, consume_fn, feed, args.repeats)
+        print(f"{'parser difference':>20}: {legacy_mib - streaming_mib:.2f} MiB")
@@ -0,0 +1,115 @@
+"""Build an arXiv snapshot from a synthetic JSONL file and time lookups.
+
+Writes a JSONL file in the format of arXiv's metadata snapshot, builds the
+snapshot file from it with a process pool, and checks that:
+- lookups return the same dicts as parsing the arXiv API's Atom feed for
+  the same papers (rendered by the fake arXiv server),
+- versioned ids only match the latest version, and unknown ids miss,
+- `fetch_paper_from_arxiv_given_id` resolves from the snapshot without a
+  request to arXiv.
+
+Usage:
+    python api/experiments/benchmark_arxiv_snapshot.py [num_papers]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+os.environ["ARXIV_CACHE_PATH"] = ":memory:"
+
+import api.arxiv_fetch_api as arxiv_fetch_api
+from api.arxiv_fetch_api import _parse_arxiv_xml, fetch_paper_from_arxiv_given_id
+from api.arxiv_snapshot import ArxivSnapshot, build_arxiv_snapshot, set_arxiv_snapshot
+from api.experiments.fake_arxiv_server import FakeArxivServer, make_fake_paper, render_feed
+
+words = "model data learning neural graph attention sparse robust optimal bound kernel network".split()
+
+
+def to_snapshot_line(paper: dict, num_versions: int) -> str:
+    """Render a fake arXiv server paper as a line of arXiv's JSONL snapshot."""
+    arxiv_id, _, _ = paper["arxiv_id"].rpartition("v")
+    created = datetime.strptime(paper["updated"], "%Y-%m-%dT%H:%M:%SZ").strftime("%a, %d %b %Y %H:%M:%S GMT")
+    return json.dumps(
+        {
+            "id": arxiv_id,
+            "submitter": paper["authors"][0],
+            "authors": ", ".join(paper["authors"]),
+            "title": paper["title"],
+            "comments": paper["comment"],
+            "journal-ref": None,
+            "doi": None,
+            "report-no": None,
+            "categories": " ".join(paper["categories"]),
+            "license": None,
+            "abstract": f"  {paper['abstract']}\n",
+            "versions": [{"version": f"v{idx + 1}", "created": created} for idx in range(num_versions)],
+            "update_date": paper["updated"][:10],
+            "authors_parsed": [name.split(" ")[::-1] + [""] for name in paper["authors"]],
+        }
+    )
+
+
+def make_papers(num_papers: int) -> list[tuple[dict, int]]:
+    rng = random.Random(0)
+    papers = []
+    for idx in range(num_papers):
+        num_versions = rng.choice([1, 1, 1, 2, 3])
+        paper = make_fake_paper(
+            f"{2000 + idx // 100_000}.{idx % 100_000:05d}v{num_versions}",
+            title=" ".join(rng.choices(words, k=8)).capitalize(),
+            categories=rng.sample(["cs.LG", "cs.AI", "cs.CL", "stat.ML", "math.OC"], 2),
+        )
+        paper["abstract"] = " ".join(rng.choices(words, k=150))
+        papers.append((paper, num_versions))
+    return papers
+
+
+if __name__ == "__main__":
+    num_papers = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    tmp_dir = tempfile.mkdtemp()
+    jsonl_path = os.path.join(tmp_dir, "arxiv-metadata-oai-snapshot.json")
+    snapshot_path = os.path.join(tmp_dir, "arxiv_snapshot.bin")
+
+    papers = make_papers(num_papers)
+    with open(jsonl_path, "w") as f:
+        for paper, num_versions in papers:
+            f.write(to_snapshot_line(paper, num_versions) + "\n")
+        f.write("not json\n")
+    jsonl_mb = os.path.getsize(jsonl_path) / 1e6
+
+    for max_workers in sorted({1, os.cpu_count() or 1}):
+        start = time.perf_counter()
+        stats = build_arxiv_snapshot(jsonl_path, snapshot_path, max_workers=max_workers, chunk_bytes=8 * 1024 * 1024)
+        seconds = time.perf_counter() - start
+        print(
+            f"build, {max_workers} workers: {stats} from {jsonl_mb:.0f} MB in {seconds:.2f}s "
+            f"({num_papers / seconds:,.0f} papers/s), snapshot {os.path.getsize(snapshot_path) / 1e6:.0f} MB"
+        )
+    assert stats == {"papers": num_papers, "errors": 1}
+
+    snapshot = ArxivSnapshot(snapshot_path)
+    for paper, _ in random.Random(1).sample(papers, 1000):
+        expected = _parse_arxiv_xml(render_feed([paper], 1).decode())
+        assert snapshot.get(paper["arxiv_id"].rpartition("v")[0]) == expected, paper["arxiv_id"]
+        assert snapshot.get(paper["arxiv_id"]) == expected
+    paper, num_versions = next((paper, n) for paper, n in papers if n > 1)
+    assert snapshot.get(f"{paper['arxiv_id'].rpartition('v')[0]}v1") is None
+    assert snapshot.get("2999.99999") is None and snapshot.get("not an id") is None
+    print("lookups match the Atom feed parser")
+
+    ids = [paper["arxiv_id"].rpartition("v")[0] for paper, _ in random.Random(2).sample(papers, 10_000)]
+    start = time.perf_counter()
+    for arxiv_id in ids:
+        snapshot.get(arxiv_id)
+    print(f"lookup: {(time.perf_counter() - start) / len(ids) * 1e6:.1f} us per paper")
+
+    set_arxiv_snapshot(snapshot)
+    with FakeArxivServer({}) as server:
+        arxiv_fetch_api.ARXIV_API_URL = server.url
+        assert fetch_paper_from_arxiv_given_id(ids[0]) is not None
+        assert fetch_paper_from_arxiv_given_id("2999.99999") is None
+        print(f"fetch_paper_from_arxiv_given_id: {len(server.requests)} arXiv request (for the paper not in the snapshot)")
@@ -0,0 +1,254 @@
+"""A local stand-in for export.arxiv.org, for experiments and benchmarks.
+
+Serves Atom feeds for `id_list` queries and search queries on `cat:` and
+`lastUpdatedDate:[... TO ...]`, paginated with `start`/`max_results`, from an
+in-memory catalog of papers.
+
+It can also inject faults, e.g. to check retries and circuit breaking:
+error responses, slow responses and dropped connections at given rates, or
+every request failing while `down` is set.
+
+Usage:
+    with FakeArxivServer(make_fake_catalog(100)) as server:
+        fetch(..., base_url=server.url)
+
+    with FakeArxivServer(catalog, error_rate=0.3, slow_rate=0.05, slow_seconds=2.0) as server:
+        ...
+"""
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from xml.sax.saxutils import escape
+
+entry_template = """
+  <entry>
+    <id>http://arxiv.org/abs/{arxiv_id}</id>
+    <updated>{updated}</updated>
+    <published>{published}</published>
+    <title>{title}</title>
+    <summary>{abstract}</summary>
+{authors}
+    <arxiv:comment xmlns:arxiv="http://arxiv.org/schemas/atom">{comment}</arxiv:comment>
+    <link href="http://arxiv.org/abs/{arxiv_id}" rel="alternate" type="text/html"/>
+    <link title="pdf" href="http://arxiv.org/pdf/{arxiv_id}" rel="related" type="application/pdf"/>
+{categories}
+  </entry>"""
+
+
+def make_fake_paper(
+    arxiv_id: str,
+    title: Optional[str] = None,
+    categories: Optional[list[str]] = None,
+    updated: str = "2024-10-11T17:59:59Z",
+    published: str = "2024-10-11T17:59:59Z",
+) -> dict[str, Any]:
+    return {
+        "arxiv_id": arxiv_id,
+        "title": title or f"A Sample Paper Title ({arxiv_id})",
+        "abstract": (
+            "We study a sample problem and propose a sample method. Our method "
+            "improves on prior work across a range of benchmarks."
+        ),
+        "authors": ["First Author", "Second Author"],
+        "comment": "12 pages, 4 figures",
+        "categories": categories or ["cs.LG", "cs.AI"],
+        "updated": updated,
+        "published": published,
+    }
+
+
+def make_fake_catalog(num_papers: int, prefix: str = "2410") -> dict[str, dict[str, Any]]:
+    """Make a catalog of papers with versioned ids, e.g. 2410.00001v1."""
+    papers = [make_fake_paper(f"{prefix}.{idx:05d}v1") for idx in range(num_papers)]
+    return {paper["arxiv_id"]: paper for paper in papers}
+
+
+def render_entry(paper: dict[str, Any]) -> str:
+    authors = "\n".join(
+        f"    <author>\n      <name>{escape(name)}</name>\n    </author>"
+        for name in paper["authors"]
+    )
+    categories = "\n".join(
+        f'    <category term="{escape(term)}" scheme="http://arxiv.org/schemas/atom"/>'
+        for term in paper["categories"]
+    )
+    return entry_template.format(
+        arxiv_id=paper["arxiv_id"],
+        updated=paper["updated"],
+        published=paper["published"],
+        title=escape(paper["title"]),
+        abstract=escape(paper["abstract"]),
+        comment=escape(paper["comment"]),
+        authors=authors,
+        categories=categories,
+    )
+
+
+def render_feed(papers: list[dict[str, Any]], total_results: int, start: int = 0) -> bytes:
+    entries = "".join(render_entry(paper) for paper in papers)
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<feed xmlns="http://www.w3.org/2005/Atom" '
+        'xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/">\n'
+        f"  <opensearch:totalResults>{total_results}</opensearch:totalResults>\n"
+        f"  <opensearch:startIndex>{start}</opensearch:startIndex>\n"
+        f"  <opensearch:itemsPerPage>{len(papers)}</opensearch:itemsPerPage>\n"
+        f"{entries}\n</feed>\n"
+    ).encode("utf-8")
+
+
+def _to_query_date(timestamp: str) -> str:
+    """e.g. 2024-10-11T17:59:59Z -> 202410111759, as used in arXiv date ranges."""
+    return timestamp[:16].replace("-", "").replace("T", "").replace(":", "")
+
+
+def _strip_version(arxiv_id: str) -> str:
+    head, sep, tail = arxiv_id.rpartition("v")
+    return head if sep and head and tail.isdigit() else arxiv_id
+
+
+class FakeArxivServer:
+    """Threaded HTTP server that answers arXiv API queries from a catalog.
+
+    Attributes:
+        requests: List of (path + query string) for every request received.
+        delay_seconds: Artificial latency added to every response.
+        error_rate: Fraction of requests answered with `error_status`.
+        slow_rate: Fraction of requests delayed by a further `slow_seconds`.
+        reset_rate: Fraction of requests whose connection is closed without
+            a response.
+        down: If set, every request is answered with `error_status`.
+        faults: Count of each injected fault: "error", "slow" and "reset".
+    """
+
+    def __init__(
+        self,
+        catalog: dict[str, dict[str, Any]],
+        delay_seconds: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        slow_rate: float = 0.0,
+        slow_seconds: float = 0.0,
+        reset_rate: float = 0.0,
+        seed: Optional[int] = 0,
+    ):
+        self.catalog = catalog
+        self.delay_seconds = delay_seconds
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.reset_rate = reset_rate
+        self.down = False
+        self.requests: list[str] = []
+        self.faults = {"error": 0, "slow": 0, "reset": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/query"
+
+    def query(self, params: dict[str, list[str]]) -> tuple[list[dict[str, Any]], int, int]:
+        """Get (page of papers, total results, start) for a parsed query string."""
+        start = int(params.get("start", ["0"])[0])
+        max_results = int(params.get("max_results", ["10"])[0])
+        if "id_list" in params:
+            by_unversioned_id = {_strip_version(arxiv_id): paper for arxiv_id, paper in self.catalog.items()}
+            matches = []
+            for arxiv_id in params["id_list"][0].split(","):
+                paper = self.catalog.get(arxiv_id) or by_unversioned_id.get(arxiv_id)
+                if paper is not None:
+                    matches.append(paper)
+        else:
+            search_query = params.get("search_query", [""])[0]
+            categories = set(re.findall(r"cat:([\w.\-]+)", search_query))
+            date_range = re.search(r"lastUpdatedDate:\[(\d{12}) TO (\d{12})\]", search_query)
+            matches = [
+                paper for paper in self.catalog.values()
+                if (not categories or categories.intersection(paper["categories"]))
+                and (
+                    date_range is None
+                    or date_range.group(1) <= _to_query_date(paper["updated"]) <= date_range.group(2)
+                )
+            ]
+            reverse = params.get("sortOrder", ["descending"])[0] == "descending"
+            matches.sort(key=lambda paper: (paper["updated"], paper["arxiv_id"]), reverse=reverse)
+        return matches[start:start + max_results], len(matches), start
+
+    def _pick_fault(self) -> Optional[str]:
+        """Pick the fault to inject into a request, if any."""
+        with self._lock:
+            if self.down:
+                fault = "error"
+            else:
+                roll = self._rng.random()
+                if roll < self.error_rate:
+                    fault = "error"
+                elif roll < self.error_rate + self.reset_rate:
+                    fault = "reset"
+                elif roll < self.error_rate + self.reset_rate + self.slow_rate:
+                    fault = "slow"
+                else:
+                    return None
+            self.faults[fault] += 1
+            return fault
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests.append(self.path)
+                fault = server._pick_fault()
+                if fault == "reset":
+                    self.close_connection = True
+                    return
+                if fault == "error":
+                    self.send_error(server.error_status)
+                    return
+                delay_seconds = server.delay_seconds + (server.slow_seconds if fault == "slow" else 0.0)
+                if delay_seconds:
+                    time.sleep(delay_seconds)
+                params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                papers, total_results, start = server.query(params)
+                body = render_feed(papers, total_results, start)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/atom+xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up (e.g. its deadline passed).
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeArxivServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeArxivServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,209 @@
+"""Run the arXiv clients against a fake arXiv server that injects faults.
+
+Checks that:
+- with 30% of requests failing (5xx or dropped connections), retries make
+  nearly every lookup succeed,
+- a caller's deadline bounds a lookup of a paper that's slow to serve,
+- while arXiv is down, the circuit breaker opens and later lookups fail
+  fast without requests, and it closes again once arXiv is back,
+- a bulk fetch while arXiv is down raises, rather than reporting the
+  papers as missing,
+- a half-open trial that's cancelled doesn't leave the breaker rejecting
+  every call, and a hedged lookup that times out counts as a failure,
+- hedging cuts the tail latency when some responses are slow,
+- the async client retries through the same faults.
+
+Usage:
+    python api/experiments/try_arxiv_resilience.py
+"""
+import asyncio
+import os
+import statistics
+import time
+
+os.environ["ARXIV_CACHE_PATH"] = ":memory:"
+
+import api.arxiv_fetch_api as arxiv_fetch_api
+from api.arxiv_fetch_api import (
+    ArxivUnavailableError,
+    fetch_paper_from_arxiv_given_id,
+    iter_papers_from_arxiv_given_ids,
+)
+from api.async_arxiv_fetch_api import AsyncArxivClient
+from api.experiments.fake_arxiv_server import FakeArxivServer, make_fake_catalog
+from lib.resilience import (
+    CircuitBreaker,
+    DeadlineExceeded,
+    RetryPolicy,
+    call_with_resilience,
+    get_resilience_stats,
+)
+
+# short backoff, so the experiment runs in seconds.
+fast_retries = RetryPolicy(max_attempts=4, base_delay_seconds=0.01, max_delay_seconds=0.05)
+
+
+def use_server(server: FakeArxivServer) -> None:
+    arxiv_fetch_api.ARXIV_API_URL = server.url
+    arxiv_fetch_api.arxiv_breaker.reset()
+
+
+def try_flaky(ids: list[str], catalog: dict) -> None:
+    with FakeArxivServer(catalog, error_rate=0.2, reset_rate=0.1) as server:
+        use_server(server)
+        found = failed = 0
+        for arxiv_id in ids:
+            try:
+                found += fetch_paper_from_arxiv_given_id(arxiv_id) is not None
+            except ArxivUnavailableError:
+                failed += 1
+        print(
+            f"flaky: {found}/{len(ids)} found, {failed} unavailable, "
+            f"{len(server.requests)} requests, faults {server.faults}"
+        )
+        assert found >= len(ids) * 0.95
+
+
+def try_deadline(ids: list[str], catalog: dict) -> None:
+    with FakeArxivServer(catalog, slow_rate=1.0, slow_seconds=1.0) as server:
+        use_server(server)
+        start = time.perf_counter()
+        try:
+            fetch_paper_from_arxiv_given_id(ids[0], deadline_seconds=0.3)
+            raise AssertionError("expected the deadline to pass")
+        except (ArxivUnavailableError, DeadlineExceeded) as e:
+            seconds = time.perf_counter() - start
+            print(f"deadline: 0.3s deadline gave up after {seconds:.2f}s ({type(e).__name__})")
+            assert seconds < 0.5
+
+
+def try_circuit_breaker(ids: list[str], catalog: dict) -> None:
+    breaker = CircuitBreaker("arxiv", failure_threshold=5, reset_timeout_seconds=0.5)
+    arxiv_fetch_api.arxiv_breaker = breaker
+    try:
+        with FakeArxivServer(catalog) as server:
+            use_server(server)
+            server.down = True
+            start = time.perf_counter()
+            for arxiv_id in ids[:20]:
+                try:
+                    fetch_paper_from_arxiv_given_id(arxiv_id)
+                except ArxivUnavailableError:
+                    pass
+            seconds = time.perf_counter() - start
+            print(
+                f"down: 20 lookups failed in {seconds:.2f}s with {len(server.requests)} requests, "
+                f"breaker {breaker.stats()}"
+            )
+            assert breaker.state == CircuitBreaker.OPEN and len(server.requests) <= 6
+
+            server.down = False
+            time.sleep(0.5)
+            assert fetch_paper_from_arxiv_given_id(ids[0]) is not None
+            print(f"recovered: breaker {breaker.state} after one trial request")
+            assert breaker.state == CircuitBreaker.CLOSED
+    finally:
+        arxiv_fetch_api.arxiv_breaker = CircuitBreaker("arxiv", failure_threshold=5, reset_timeout_seconds=30.0)
+
+
+def try_bulk_fetch_down(ids: list[str], catalog: dict) -> None:
+    with FakeArxivServer(catalog) as server:
+        use_server(server)
+        results = iter_papers_from_arxiv_given_ids(ids[:40], chunk_size=20, page_size=10, request_interval_seconds=0)
+        fetched = [next(results) for _ in range(20)]
+        # arXiv goes down after the first chunk.
+        server.down = True
+        try:
+            missing = [arxiv_id for arxiv_id, paper in results if paper is None]
+            raise AssertionError(f"expected the bulk fetch to fail, got {len(missing)} missing ids")
+        except ArxivUnavailableError as e:
+            print(f"bulk fetch down: {sum(paper is not None for _, paper in fetched)}/20 fetched, then {e}")
+    assert all(paper is not None for _, paper in fetched)
+
+
+async def try_cancelled_trial(ids: list[str], catalog: dict) -> None:
+    breaker = CircuitBreaker("arxiv-async", failure_threshold=1, reset_timeout_seconds=0.1)
+    with FakeArxivServer(catalog, slow_rate=1.0, slow_seconds=1.0) as server:
+        async with AsyncArxivClient(
+            base_url=server.url, request_interval_seconds=0, retry_policy=fast_retries, breaker=breaker
+        ) as client:
+            breaker.record_failure()
+            await asyncio.sleep(0.1)
+            # the half-open trial is slow, and its caller gives up on it.
+            trial = asyncio.create_task(client.query({"id_list": ids[0], "max_results": 1}))
+            await asyncio.sleep(0.05)
+            trial.cancel()
+            await asyncio.gather(trial, return_exceptions=True)
+            state = breaker.state
+            server.slow_rate = 0.0
+            results = await client.query({"id_list": ids[0], "max_results": 1})
+    print(f"cancelled trial: breaker {state} after the cancel, {breaker.state} after the next call")
+    assert state == CircuitBreaker.HALF_OPEN and results and breaker.state == CircuitBreaker.CLOSED
+
+
+def try_hung_hedged_call() -> None:
+    breaker = CircuitBreaker("hung", failure_threshold=5)
+
+    def hang(timeout):
+        # e.g. a client that ignores its timeout.
+        time.sleep(0.5)
+
+    try:
+        call_with_resilience(
+            hang, idempotent=True, breaker=breaker, default_timeout_seconds=0.1, hedge_after_seconds=0.05
+        )
+        raise AssertionError("expected the hedged call to time out")
+    except DeadlineExceeded:
+        pass
+    print(f"hung hedged call: breaker {breaker.stats()}")
+    assert breaker.stats()["failures"] == 1
+
+
+def try_hedging(ids: list[str], catalog: dict) -> None:
+    for hedge_after_seconds in (None, 0.05):
+        with FakeArxivServer(catalog, delay_seconds=0.01, slow_rate=0.1, slow_seconds=0.5, seed=1) as server:
+            use_server(server)
+            arxiv_fetch_api.ARXIV_HEDGE_AFTER_SECONDS = hedge_after_seconds
+            latencies = []
+            for arxiv_id in ids:
+                start = time.perf_counter()
+                assert fetch_paper_from_arxiv_given_id(arxiv_id) is not None
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            label = "never" if hedge_after_seconds is None else f"{hedge_after_seconds}s"
+            print(
+                f"hedge after {label}: median {statistics.median(latencies) * 1000:.0f}ms, "
+                f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f}ms, "
+                f"max {latencies[-1] * 1000:.0f}ms, {len(server.requests)} requests"
+            )
+    arxiv_fetch_api.ARXIV_HEDGE_AFTER_SECONDS = None
+
+
+async def try_async_flaky(ids: list[str], catalog: dict) -> None:
+    with FakeArxivServer(catalog, error_rate=0.3) as server:
+        async with AsyncArxivClient(
+            base_url=server.url,
+            request_interval_seconds=0,
+            retry_policy=fast_retries,
+            breaker=CircuitBreaker("arxiv-async", failure_threshold=50),
+        ) as client:
+            papers = await asyncio.gather(*[client.fetch_paper_given_id(arxiv_id) for arxiv_id in ids])
+        found = sum(paper is not None for paper in papers)
+        print(f"async flaky: {found}/{len(ids)} found, {len(server.requests)} requests, faults {server.faults}")
+        assert found >= len(ids) * 0.95
+
+
+if __name__ == "__main__":
+    catalog = make_fake_catalog(100)
+    ids = [arxiv_id.split("v")[0] for arxiv_id in catalog]
+    arxiv_fetch_api.ARXIV_RETRY_POLICY = fast_retries
+
+    try_flaky(ids, catalog)
+    try_deadline(ids, catalog)
+    try_circuit_breaker(ids, catalog)
+    try_bulk_fetch_down(ids, catalog)
+    asyncio.run(try_cancelled_trial(ids, catalog))
+    try_hung_hedged_call()
+    try_hedging(ids, catalog)
+    asyncio.run(try_async_flaky(ids, catalog))
+    print(f"resilience stats: {get_resilience_stats()}")
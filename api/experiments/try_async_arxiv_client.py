@@ -0,0 +1,49 @@
+"""Run the async arXiv client against a local fake arXiv server.
+
+Checks that the async client returns the same paper dicts as the sync
+parser, and that the rate limiter spaces requests as configured.
+
+Usage:
+    python api/experiments/try_async_arxiv_client.py
+"""
+import asyncio
+import time
+
+from api.arxiv_fetch_api import _parse_arxiv_xml
+from api.async_arxiv_fetch_api import AsyncArxivClient
+from api.experiments.fake_arxiv_server import FakeArxivServer, make_fake_catalog, render_feed
+
+
+async def main() -> None:
+    catalog = make_fake_catalog(250)
+    with FakeArxivServer(catalog, delay_seconds=0.05) as server:
+        ids = [arxiv_id.split("v")[0] for arxiv_id in catalog]
+
+        async with AsyncArxivClient(
+            base_url=server.url, max_concurrency=8, request_interval_seconds=0
+        ) as client:
+            start = time.perf_counter()
+            papers = await asyncio.gather(*[client.fetch_paper_given_id(i) for i in ids[:50]])
+            print(f"50 single lookups: {time.perf_counter() - start:.2f}s")
+            for paper, catalog_paper in zip(papers, list(catalog.values())[:50]):
+                assert paper == _parse_arxiv_xml(render_feed([catalog_paper], 1).decode())
+
+            start = time.perf_counter()
+            papers_by_id = await client.fetch_papers_given_ids(ids + ["0000.00000"], chunk_size=100)
+            missing = [i for i, paper in papers_by_id.items() if paper is None]
+            print(
+                f"{len(ids)} bulk lookups: {time.perf_counter() - start:.2f}s, "
+                f"missing={missing}"
+            )
+
+            paper = await client.fetch_paper_given_id(ids[0], deadline_seconds=0.01)
+            print(f"lookup with a deadline shorter than the server's latency: {paper}")
+
+        async with AsyncArxivClient(base_url=server.url, request_interval_seconds=0.2) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*[client.fetch_paper_given_id(i) for i in ids[:5]])
+            print(f"5 rate-limited lookups (1 per 0.2s): {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+"""Pluggable language model backends for paper analyses.
+
+A backend turns a batch of prompts into a batch of responses. The analysis
+pipeline (`db.paper_ai_analysis`) only talks to `ModelBackend`, so the model
+can be swapped without touching it, e.g. for `StubModelBackend` in tests and
+benchmarks:
+
+    set_model_backend(StubModelBackend(latency_seconds=0.05))
+    get_model_backend().complete(["Summarize: ..."])  # ["Stub analysis ..."]
+
+`ModelBackend.name` identifies the model (and its settings), and is part of
+each analysis' cache key, so changing models re-runs analyses.
+"""
+import hashlib
+import threading
+import time
+from typing import Optional
+
+
+class ModelBackend:
+    """Completes batches of prompts with a language model."""
+
+    # identifies the model, e.g. "provider/model-name@temperature=0".
+    name: str = "model"
+    # max prompts per `complete` call.
+    max_batch_size: int = 8
+
+    def complete(self, prompts: list[str]) -> list[str]:
+        """Get the model's response to each prompt, in order.
+
+        Raises if any prompt fails, so the whole batch can be retried.
+        """
+        raise NotImplementedError
+
+
+class StubModelBackend(ModelBackend):
+    """Local stand-in for a model: deterministic responses after a fixed delay.
+
+    Counts its calls and prompts, e.g. to check that analyses are reused.
+    """
+
+    def __init__(
+        self,
+        name: str = "stub",
+        latency_seconds: float = 0.0,
+        per_prompt_seconds: float = 0.0,
+        max_batch_size: int = 8,
+        fail_prompts_containing: Optional[str] = None,
+    ):
+        self.name = name
+        self.latency_seconds = latency_seconds
+        self.per_prompt_seconds = per_prompt_seconds
+        self.max_batch_size = max_batch_size
+        self.fail_prompts_containing = fail_prompts_containing
+        self.num_calls = 0
+        self.num_prompts = 0
+        self._lock = threading.Lock()
+
+    def complete(self, prompts: list[str]) -> list[str]:
+        with self._lock:
+            self.num_calls += 1
+            self.num_prompts += len(prompts)
+        time.sleep(self.latency_seconds + self.per_prompt_seconds * len(prompts))
+        if self.fail_prompts_containing is not None:
+            for prompt in prompts:
+                if self.fail_prompts_containing in prompt:
+                    raise RuntimeError(f"Stub model failed on prompt: {prompt[:50]}")
+        return [
+            f"Stub analysis {hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]}"
+            for prompt in prompts
+        ]
+
+
+_model_backend: Optional[ModelBackend] = None
+_model_backend_lock = threading.Lock()
+
+
+def get_model_backend() -> ModelBackend:
+    """Get the process-wide model backend, set with `set_model_backend`."""
+    if _model_backend is None:
+        raise RuntimeError("No model backend is set, see api.model_backends.set_model_backend.")
+    return _model_backend
+
+
+def set_model_backend(backend: Optional[ModelBackend]) -> None:
+    """Replace the process-wide model backend."""
+    global _model_backend
+    with _model_backend_lock:
+        _model_backend = backend
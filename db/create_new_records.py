@@ -1,7 +1,11 @@
 """Base logic for creating new records in the database."""
 from typing import Literal
 
-from api.arxiv_fetch_api import fetch_paper_from_arxiv_given_url
+from api.arxiv_fetch_api import (
+    fetch_paper_from_arxiv_given_url,
+    fetch_papers_from_arxiv_given_urls,
+)
+from api.arxiv_ids import canonical_arxiv_url, normalize_arxiv_id
 from db.models import ArxivPaper, Paper, Update, User
 from lib.helper import generate_current_datetime_str
 from lib.logger import get_logger
@@ -12,25 +16,17 @@ logger = get_logger(__name__)
 default_stub_id = 999
 
 
-def user_adds_new_arxiv_paper(
-    user_id: int,
-    arxiv_url: str,
-    reading_status: Literal[
-        "added to library", "want to read", "reading", "finished reading"
-    ] = "added to library",
-    reading_progress: float = 0.0 # decimal, 0 to 1
-) -> dict[str, Paper | Update]:
-    """User adds a new paper to their library.
-    
-    When this happens, we create the following new records:
-    - ArxivPaper
-    - Update
+ReadingStatus = Literal[
+    "added to library", "want to read", "reading", "finished reading"
+]
 
-    We then return these records to be handled by the client.
+
+def build_arxiv_paper(arxiv_url: str, arxiv_paper: dict) -> Paper:
+    """Build the Paper record for a paper fetched from Arxiv.
+
+    The paper is stored under its canonical URL and arXiv ID, whichever URL
+    it was added with (that URL is kept in its ArxivPaper metadata).
     """
-    arxiv_paper = fetch_paper_from_arxiv_given_url(arxiv_url)
-    if arxiv_paper is None:
-        raise ValueError("Failed to fetch paper from Arxiv")
     arxiv_paper_obj = ArxivPaper(
         arxiv_id=arxiv_paper["arxiv_id"],
         arxiv_url=arxiv_url,
@@ -41,29 +37,136 @@ def user_adds_new_arxiv_paper(
         published_date=arxiv_paper["published_date"],
         updated_date=arxiv_paper["updated_date"],
     )
-    arxiv_paper_dict_str: str = arxiv_paper_obj.model_dump_json()
-    paper = Paper(
+    return Paper(
         paper_id=default_stub_id,
         title=arxiv_paper["title"],
         authors=arxiv_paper["authors"],
         preview=arxiv_paper["abstract"],
-        url=arxiv_url,
+        url=canonical_arxiv_url(arxiv_paper["arxiv_id"]),
         source="arxiv",
-        metadata_str=arxiv_paper_dict_str,
+        source_id=normalize_arxiv_id(arxiv_paper["arxiv_id"]),
+        metadata=arxiv_paper_obj.model_dump(),
         created_at=generate_current_datetime_str(),
     )
-    update = Update(
+
+
+def build_arxiv_paper_records(
+    user_id: int,
+    arxiv_url: str,
+    arxiv_paper: dict,
+    reading_status: ReadingStatus = "added to library",
+    reading_progress: float = 0.0, # decimal, 0 to 1
+) -> dict[str, Paper | Update]:
+    """Build the Paper and Update records for a paper fetched from Arxiv."""
+    paper = build_arxiv_paper(arxiv_url, arxiv_paper)
+    update = build_update(
+        user_id=user_id,
+        reading_status=reading_status,
+        reading_progress=reading_progress,
+    )
+    return {"paper": paper, "update": update}
+
+
+def build_update(
+    user_id: int,
+    reading_status: ReadingStatus = "added to library",
+    reading_progress: float = 0.0, # decimal, 0 to 1
+    paper_id: int = default_stub_id,
+    message: str = "User added this paper to their library.",
+) -> Update:
+    """Build the Update record for a user adding a paper to their library."""
+    return Update(
         update_id=default_stub_id,
-        paper_id=default_stub_id,
+        paper_id=paper_id,
         user_id=user_id,
-        message="User added this paper to their library.",
+        message=message,
         reading_status=reading_status,
         reading_progress=reading_progress,
         created_at=generate_current_datetime_str(),
     )
+
+
+def user_adds_new_arxiv_paper(
+    user_id: int,
+    arxiv_url: str,
+    reading_status: ReadingStatus = "added to library",
+    reading_progress: float = 0.0, # decimal, 0 to 1
+    use_cache: bool = True,
+) -> dict[str, Paper | Update]:
+    """User adds a new paper to their library.
+    
+    When this happens, we create the following new records:
+    - ArxivPaper
+    - Update
+
+    We then return these records to be handled by the client.
+
+    Paper metadata is read from the local arXiv cache first, unless
+    `use_cache` is False.
+    """
+    paper = fetch_new_arxiv_paper(arxiv_url, use_cache=use_cache)
+    update = build_update(
+        user_id=user_id,
+        reading_status=reading_status,
+        reading_progress=reading_progress,
+    )
     return {"paper": paper, "update": update}
 
 
+def fetch_new_arxiv_paper(arxiv_url: str, use_cache: bool = True) -> Paper:
+    """Fetch a paper from Arxiv and build its Paper record.
+
+    Raises ValueError if arXiv doesn't have the paper, and
+    `ArxivUnavailableError` if arXiv couldn't be reached.
+    """
+    arxiv_paper = fetch_paper_from_arxiv_given_url(arxiv_url, use_cache=use_cache)
+    if arxiv_paper is None:
+        raise ValueError(f"Paper not found on Arxiv: {arxiv_url}")
+    return build_arxiv_paper(arxiv_url, arxiv_paper)
+
+
+def users_add_new_arxiv_papers(
+    items: list[tuple[int, str, ReadingStatus, float]],
+    use_cache: bool = True,
+) -> list[dict[str, Paper | Update] | ValueError]:
+    """Many users add papers to their libraries at once.
+
+    Same as `user_adds_new_arxiv_paper`, but the Arxiv metadata for all the
+    papers is fetched in batches rather than one request per paper.
+
+    Args:
+        items: (user_id, arxiv_url, reading_status, reading_progress) tuples.
+
+    Returns:
+        For each item, in order, either the records (as returned by
+        `user_adds_new_arxiv_paper`) or the ValueError describing why the
+        item failed. Raises `ArxivUnavailableError` if arXiv couldn't be
+        reached.
+    """
+    arxiv_papers = fetch_papers_from_arxiv_given_urls(
+        [arxiv_url for _, arxiv_url, _, _ in items], use_cache=use_cache
+    )
+    results = []
+    for user_id, arxiv_url, reading_status, reading_progress in items:
+        arxiv_paper = arxiv_papers.get(arxiv_url)
+        if arxiv_paper is None:
+            results.append(ValueError(f"Failed to fetch paper from Arxiv: {arxiv_url}"))
+            continue
+        try:
+            results.append(
+                build_arxiv_paper_records(
+                    user_id=user_id,
+                    arxiv_url=arxiv_url,
+                    arxiv_paper=arxiv_paper,
+                    reading_status=reading_status,
+                    reading_progress=reading_progress,
+                )
+            )
+        except ValueError as e:  # includes pydantic.ValidationError
+            results.append(e)
+    return results
+
+
 def create_new_user(email: str, name: str, username: str) -> User:
     logger.info(f"Creating new user with email: {email}, name: {name}, username: {username}")
     user = User(
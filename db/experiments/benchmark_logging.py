@@ -0,0 +1,65 @@
+"""Benchmark the latency a log call adds to the caller.
+
+Logs the same messages (like the ones from adding papers to libraries)
+through the background-writer loggers of lib/logger.py and through a plain
+StreamHandler that formats and writes on the calling thread, as before.
+stderr is redirected to a file so the terminal's speed doesn't count, but a
+slow or blocked stderr (e.g. a full pipe) only slows down the second one.
+
+Usage:
+    python db/experiments/benchmark_logging.py [--num-records 100000] 2> /dev/null
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from db.experiments.benchmark_paper_search_index import percentiles
+from lib.logger import ColoredFormatter, flush_logs, get_log_stats, get_logger
+
+
+class UncachedColoredFormatter(ColoredFormatter):
+    """ColoredFormatter computing the module path for every record, as it used to."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        rel_path = os.path.relpath(record.pathname)
+        record.module_path = f"[{rel_path.replace(os.sep, '.').replace('.py', '')}]"
+        return logging.Formatter.format(self, record)
+
+
+def log_calls(logger: logging.Logger, num_records: int) -> list[float]:
+    latencies = []
+    for idx in range(num_records):
+        start = time.perf_counter()
+        logger.info(f"Fetched new update for user {idx}.", extra={"user_id": idx, "paper_id": idx % 1000})
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-records", type=int, default=100_000)
+    args = parser.parse_args()
+
+    sync_logger = logging.getLogger("benchmark.sync")
+    handler = logging.StreamHandler()
+    handler.setFormatter(UncachedColoredFormatter("%(module_path)s: %(message)s"))
+    sync_logger.addHandler(handler)
+    sync_logger.setLevel(logging.INFO)
+    sync_logger.propagate = False
+    start = time.perf_counter()
+    latencies = log_calls(sync_logger, args.num_records)
+    print(f"Synchronous handler: {percentiles(latencies)}, {time.perf_counter() - start:.2f}s total", file=sys.stdout)
+
+    queued_logger = get_logger("benchmark.queued")
+    start = time.perf_counter()
+    latencies = log_calls(queued_logger, args.num_records)
+    seconds = time.perf_counter() - start
+    stats = get_log_stats()
+    flush_logs()
+    print(
+        f"Background writer: {percentiles(latencies)}, {seconds:.2f}s total, "
+        f"{time.perf_counter() - start:.2f}s until written, {stats['dropped']} dropped",
+        file=sys.stdout,
+    )
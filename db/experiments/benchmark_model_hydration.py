@@ -0,0 +1,112 @@
+"""Benchmark building models from database rows, per hydration mode.
+
+Makes 100k update rows and 100k paper rows shaped like the storage
+backend's (papers with JSON metadata), and times:
+- `Model(**row)` per row, as the readers used to,
+- `hydrate` in "validate" mode (one call of a cached TypeAdapter),
+- `hydrate` in "trusted" mode (no validation),
+- lazy hydration, reading 1% of the rows, and then all of them.
+
+Checks that every mode builds models equal to `Model(**row)`.
+
+Usage:
+    python db/experiments/benchmark_model_hydration.py [num_rows]
+"""
+import random
+import sys
+import time
+
+from db.hydration import hydrate
+from db.models import Paper, Update
+
+reading_statuses = ["added to library", "want to read", "reading", "finished reading", "skipped", "archived"]
+
+
+def make_update_rows(num_rows: int, rng: random.Random) -> list[dict]:
+    return [
+        {
+            "update_id": idx,
+            "paper_id": rng.randint(1, 10_000),
+            "user_id": rng.randint(1, 1000),
+            "message": "User updated their reading progress.",
+            "reading_status": rng.choice(reading_statuses),
+            "reading_progress": rng.random(),
+            "created_at": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00",
+        }
+        for idx in range(num_rows)
+    ]
+
+
+def make_paper_rows(num_rows: int, rng: random.Random) -> list[dict]:
+    rows = []
+    for idx in range(num_rows):
+        arxiv_id = f"24{idx // 100_000:02d}.{idx % 100_000:05d}"
+        rows.append(
+            {
+                "paper_id": idx,
+                "title": f"Paper {idx}",
+                "authors": ["Ada Lovelace", "Alan Turing", "Grace Hopper"][: rng.randint(1, 3)],
+                "preview": "An abstract. " * 20,
+                "url": f"https://arxiv.org/abs/{arxiv_id}",
+                "source": "arxiv",
+                "source_id": arxiv_id,
+                "metadata": {
+                    "arxiv_id": f"{arxiv_id}v1",
+                    "arxiv_url": f"https://arxiv.org/abs/{arxiv_id}v1",
+                    "abstract": "An abstract. " * 20,
+                    "categories": ["cs.LG", "stat.ML"],
+                    "links": {"alternate": f"https://arxiv.org/abs/{arxiv_id}v1"},
+                    "published_date": "2024-01-01",
+                },
+                "metadata_str": None,
+                "created_at": "2024-01-01 12:00:00",
+            }
+        )
+    return rows
+
+
+def best_of(fn, rows: list[dict], repeat: int = 3) -> tuple[float, object]:
+    """Time fn on copies of the rows (trusted models take their rows over)."""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        rows_copy = [dict(row) for row in rows]
+        start = time.perf_counter()
+        result = fn(rows_copy)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def lazy_read(model, rows: list[dict], mode: str, fraction: float):
+    models = hydrate(model, rows, mode, lazy=True)
+    step = max(1, round(1 / fraction))
+    for idx in range(0, len(models), step):
+        models[idx]
+    return models
+
+
+def benchmark(model, rows: list[dict]) -> None:
+    print(f"{model.__name__}, {len(rows):,} rows:")
+    baseline_seconds, expected = best_of(lambda rows: [model(**row) for row in rows], rows)
+    results = {"Model(**row)": (baseline_seconds, expected)}
+    for mode in ("validate", "trusted"):
+        results[mode] = best_of(lambda rows: hydrate(model, rows, mode), rows)
+        results[f"lazy {mode}, 1% read"] = best_of(lambda rows: lazy_read(model, rows, mode, 0.01), rows)
+        results[f"lazy {mode}, all read"] = best_of(lambda rows: list(lazy_read(model, rows, mode, 1)), rows)
+    for label, (seconds, models) in results.items():
+        print(
+            f"  {label:>24}: {seconds * 1000:7.1f}ms, {seconds / len(rows) * 1e6:5.2f}us per row, "
+            f"{baseline_seconds / seconds:5.1f}x"
+        )
+        if "1% read" not in label:
+            assert list(models) == expected, label
+            assert [m.model_dump() for m in models[:100]] == [m.model_dump() for m in expected[:100]]
+
+
+if __name__ == "__main__":
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = random.Random(0)
+    benchmark(Update, make_update_rows(num_rows, rng))
+    benchmark(Paper, make_paper_rows(num_rows, rng))
+    papers = hydrate(Paper, make_paper_rows(10, rng), "trusted")
+    assert papers[0].arxiv_metadata is not None and papers[0].arxiv_metadata.categories == ["cs.LG", "stat.ML"]
+    print("trusted papers decode their arXiv metadata")
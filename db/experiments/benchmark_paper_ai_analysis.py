@@ -0,0 +1,90 @@
+"""Benchmark paper analyses with many users asking for overlapping papers.
+
+Uses in-memory SQLite and a stub model with a fixed latency per call, so the
+numbers show how many model calls the content-addressed cache, request
+coalescing and batching save, not a real model's speed. Each user asks for
+the analyses of a random set of popular papers at the same time, then again
+once all are stored.
+
+Usage:
+    python db/experiments/benchmark_paper_ai_analysis.py [--num-users 50] [--num-papers 500]
+"""
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_DB_PATH", ":memory:")
+
+from api.model_backends import StubModelBackend
+from db.fetch_records import iter_catalog_papers
+from db.insert_records_to_supabase import insert_new_papers
+from db.models import Paper
+from db.paper_ai_analysis import PaperAnalysisRunner, summary_prompt
+from lib.helper import generate_current_datetime_str
+
+
+def make_catalog(num_papers: int) -> list[Paper]:
+    created_at = generate_current_datetime_str()
+    insert_new_papers(
+        [
+            Paper(
+                paper_id=0,
+                title=f"Paper {idx}",
+                authors=["A. Author", "B. Author"],
+                preview=f"Abstract of paper {idx}.",
+                url=f"https://arxiv.org/abs/2410.{idx:05d}",
+                source="arxiv",
+                source_id=f"2410.{idx:05d}",
+                created_at=created_at,
+            )
+            for idx in range(num_papers)
+        ]
+    )
+    return [Paper(**row) for row in iter_catalog_papers(columns="*")]
+
+
+def run_users(runner: PaperAnalysisRunner, libraries: list[list[Paper]]) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(libraries)) as executor:
+        list(executor.map(lambda papers: runner.analyze(papers, summary_prompt), libraries))
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-users", type=int, default=50)
+    parser.add_argument("--num-papers", type=int, default=500)
+    parser.add_argument("--papers-per-user", type=int, default=40)
+    parser.add_argument("--latency-seconds", type=float, default=0.2)
+    parser.add_argument("--max-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    catalog = make_catalog(args.num_papers)
+    # popular papers (low indexes) are asked for more often.
+    weights = [1 / (rank + 1) for rank in range(len(catalog))]
+    libraries = [
+        list({paper.paper_id: paper for paper in rng.choices(catalog, weights, k=args.papers_per_user)}.values())
+        for _ in range(args.num_users)
+    ]
+    num_requested = sum(len(library) for library in libraries)
+    num_unique = len({paper.paper_id for library in libraries for paper in library})
+
+    backend = StubModelBackend(latency_seconds=args.latency_seconds)
+    runner = PaperAnalysisRunner(backend=backend, max_workers=args.max_workers)
+    seconds = run_users(runner, libraries)
+    print(
+        f"{args.num_users} users asked for {num_requested} analyses of {num_unique} papers: "
+        f"{backend.num_prompts} prompts in {backend.num_calls} model calls, {seconds:.2f}s"
+    )
+    print(f"Without reuse or batching: {num_requested} calls, "
+          f"~{num_requested * args.latency_seconds / args.max_workers:.0f}s with {args.max_workers} workers")
+    print(f"Runner stats: {runner.stats()}")
+
+    num_calls = backend.num_calls
+    seconds = run_users(runner, libraries)
+    print(f"Again, all stored: {backend.num_calls - num_calls} model calls, {seconds * 1000:.0f} ms")
+    runner.shutdown()
@@ -0,0 +1,119 @@
+"""Benchmark the paper search index on a synthetic catalog.
+
+Builds an index over synthetic papers (Zipf-distributed vocabulary, so a few
+terms are in most abstracts, like real text), saves and reloads it, then
+measures query latency for full-word and prefix queries, and the recall of
+the budgeted top 10 against the exact top 10.
+
+Usage:
+    python db/experiments/benchmark_paper_search_index.py [--num-papers 1000000]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from db.paper_search_index import PaperSearchIndex
+
+vocabulary_size = 50_000
+
+
+def make_vocabulary(rng: random.Random) -> list[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < vocabulary_size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+def make_word_pool(vocabulary: list[str], rng: random.Random) -> list[str]:
+    """Sample words to make papers from, up front, since that's much faster."""
+    # Zipf-like weights: the i-th word is ~1/i as frequent as the first.
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, len(vocabulary) + 1):
+        total += 1 / rank
+        cum_weights.append(total)
+    return rng.choices(vocabulary, cum_weights=cum_weights, k=2_000_000)
+
+
+def make_papers(paper_ids: range, pool: list[str], rng: random.Random):
+    for paper_id in paper_ids:
+        start = rng.randrange(len(pool) - 120)
+        yield (
+            paper_id,
+            " ".join(pool[start:start + 8]),
+            [f"{pool[start + 10].title()} {pool[start + 11].title()}"],
+            " ".join(pool[start + 20:start + 120]),
+        )
+
+
+def percentiles(latencies: list[float]) -> str:
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p95 = latencies[int(len(latencies) * 0.95)]
+    return f"p50 {p50 * 1000:.2f} ms, p95 {p95 * 1000:.2f} ms"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-papers", type=int, default=1_000_000)
+    parser.add_argument("--num-queries", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocabulary = make_vocabulary(rng)
+
+    pool = make_word_pool(vocabulary, rng)
+    start = time.perf_counter()
+    index = PaperSearchIndex.build(make_papers(range(1, args.num_papers + 1), pool, rng))
+    print(f"Built index over {len(index)} papers in {time.perf_counter() - start:.1f}s")
+
+    path = os.path.join(tempfile.mkdtemp(), "paper_search_index.bin")
+    start = time.perf_counter()
+    index.save(path)
+    print(f"Saved in {time.perf_counter() - start:.1f}s, {os.path.getsize(path) / 2**20:.1f} MiB")
+    start = time.perf_counter()
+    index = PaperSearchIndex.load(path)
+    print(f"Loaded in {time.perf_counter() - start:.2f}s")
+
+    # queries mix common and rare words, like real searches.
+    queries = [
+        " ".join(rng.choice(vocabulary[:rng.choice([100, 2_000, vocabulary_size])]) for _ in range(rng.randint(1, 3)))
+        for _ in range(args.num_queries)
+    ]
+    for label, search_kwargs in [("word queries", {}), ("prefix queries", {"prefix": True})]:
+        latencies = []
+        for query in queries:
+            if search_kwargs:
+                query = query[:max(2, len(query) - 3)]
+            start = time.perf_counter()
+            index.search(query, **search_kwargs)
+            latencies.append(time.perf_counter() - start)
+        print(f"{label}: {percentiles(latencies)}")
+
+    recalls = []
+    for query in queries[:100]:
+        budgeted = {paper_id for paper_id, _ in index.search(query)}
+        exact = {paper_id for paper_id, _ in index.search(query, max_postings=len(index) * 100)}
+        if exact:
+            recalls.append(len(budgeted & exact) / len(exact))
+    print(f"Recall@10 of the budgeted search vs exact: {statistics.mean(recalls):.3f}")
+
+    # incremental adds go to the delta and are searchable right away.
+    start = time.perf_counter()
+    for paper_id, title, authors, preview in make_papers(
+        range(args.num_papers + 1, args.num_papers + 1_001), pool, rng
+    ):
+        index.add(paper_id, title, authors, preview)
+    print(f"Added 1000 papers in {(time.perf_counter() - start) * 1000:.0f} ms")
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query)
+        latencies.append(time.perf_counter() - start)
+    print(f"word queries with a delta: {percentiles(latencies)}")
@@ -0,0 +1,90 @@
+"""Benchmark buffering reading progress reports, vs upserting each one.
+
+Simulates readers scrolling through papers in their libraries (one progress
+report per scroll event, and a status change when they finish a paper) on
+an in-memory SQLite database, and compares the number of database writes
+and the time spent in the reporting calls.
+
+Usage:
+    python db/experiments/benchmark_progress_buffer.py [--num-users 200] [--reports-per-user 200]
+"""
+import argparse
+import os
+import random
+import time
+
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_DB_PATH", ":memory:")
+
+from db.create_new_records import build_update
+from db.insert_records_to_supabase import (
+    get_progress_write_buffer,
+    insert_new_papers,
+    insert_new_update,
+    user_updates_reading_progress,
+)
+from db.models import Paper
+from db.storage_backends import storage_client
+from lib.helper import generate_current_datetime_str
+
+
+def make_reports(num_users: int, num_papers: int, reports_per_user: int, rng: random.Random) -> list[tuple]:
+    """Make (user_id, paper_id, reading_status, reading_progress) reports, interleaved across users."""
+    per_user = []
+    for user_id in range(1, num_users + 1):
+        reports = []
+        paper_id, progress = rng.randint(1, num_papers), 0.0
+        for _ in range(reports_per_user):
+            progress = min(1.0, progress + rng.uniform(0.0, 0.05))
+            if progress < 1.0:
+                reports.append((user_id, paper_id, "reading", progress))
+            else:
+                reports.append((user_id, paper_id, "finished reading", progress))
+                paper_id, progress = rng.randint(1, num_papers), 0.0
+        per_user.append(reports)
+    return [report for step in zip(*per_user) for report in step]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-users", type=int, default=200)
+    parser.add_argument("--num-papers", type=int, default=1000)
+    parser.add_argument("--reports-per-user", type=int, default=200)
+    args = parser.parse_args()
+
+    created_at = generate_current_datetime_str()
+    storage_client.table("users").insert(
+        [
+            {"email": f"user{idx}@example.com", "name": "User", "username": f"user{idx}", "created_at": created_at}
+            for idx in range(args.num_users)
+        ]
+    ).execute()
+    insert_new_papers(
+        [
+            Paper(paper_id=0, title=f"Paper {idx}", authors=["A. Author"], preview="Abstract.",
+                  url=f"https://arxiv.org/abs/2410.{idx:05d}", source="arxiv", source_id=f"2410.{idx:05d}",
+                  created_at=created_at)
+            for idx in range(args.num_papers)
+        ]
+    )
+    reports = make_reports(args.num_users, args.num_papers, args.reports_per_user, random.Random(0))
+
+    start = time.perf_counter()
+    for user_id, paper_id, reading_status, reading_progress in reports:
+        update = build_update(user_id, reading_status, reading_progress, paper_id)
+        insert_new_update(update, paper_id)
+    seconds = time.perf_counter() - start
+    print(f"Upserting each of {len(reports)} reports: {len(reports)} writes, {seconds:.2f}s")
+
+    buffer = get_progress_write_buffer()
+    start = time.perf_counter()
+    for report in reports:
+        user_updates_reading_progress(*report)
+    seconds = time.perf_counter() - start
+    buffer.flush()
+    stats = buffer.stats()
+    print(
+        f"Buffered: {stats['written_through']} status changes written immediately + "
+        f"{stats['flushes']} batches of {stats['flushed']} coalesced reports, {seconds:.2f}s in the reporting calls"
+    )
+    print(f"Buffer stats: {stats}")
@@ -0,0 +1,82 @@
+"""Benchmark building and serving the readers-also-read table on synthetic records.
+
+Makes synthetic libraries (each user reads papers from a few topics, popular
+papers more often, with random reading statuses), then measures a full build
+and its peak memory, incremental updates, and lookups from the saved table.
+
+Usage:
+    python db/experiments/benchmark_readers_also_read.py [--num-records 5000000]
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from db.experiments.benchmark_paper_search_index import percentiles
+from db.readers_also_read import ReadersAlsoReadBuilder, ReadersAlsoReadTable, reading_status_weights
+
+
+def make_records(
+    num_records: int, num_users: int, num_papers: int, rng: np.random.Generator, num_topics: int = 1000
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Make (user_id, paper_id, weight) records."""
+    users = rng.integers(1, num_users + 1, num_records)
+    # each user reads from 3 topics, and each topic's papers are a contiguous
+    # range of paper_ids, popular ones (Zipf-like) first.
+    user_topics = rng.integers(0, num_topics, (num_users + 1, 3))
+    topics = user_topics[users, rng.integers(0, 3, num_records)]
+    papers_per_topic = num_papers // num_topics
+    ranks = np.minimum(rng.zipf(1.3, num_records), papers_per_topic) - 1
+    papers = topics * papers_per_topic + ranks + 1
+    weights = rng.choice(np.array(list(reading_status_weights.values()), dtype=np.float32), num_records)
+    return users, papers, weights
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-records", type=int, default=5_000_000)
+    parser.add_argument("--num-users", type=int, default=300_000)
+    parser.add_argument("--num-papers", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    users, papers, weights = make_records(args.num_records, args.num_users, args.num_papers, rng)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    builder = ReadersAlsoReadBuilder()
+    start = time.perf_counter()
+    builder.set_records(users, papers, weights)
+    print(
+        f"Built from {len(builder)} records in {time.perf_counter() - start:.1f}s, "
+        f"peak RSS {rss_before:.0f} -> {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB"
+    )
+
+    path = os.path.join(tempfile.mkdtemp(), "readers_also_read.bin")
+    builder.save(path)
+    table = ReadersAlsoReadTable(path)
+    print(f"Saved table for {len(table)} papers, {os.path.getsize(path) / 2**20:.1f} MiB")
+
+    paper_ids = rng.choice(np.unique(papers), 1000).tolist()
+    latencies = []
+    for paper_id in paper_ids:
+        start = time.perf_counter()
+        table.neighbors(paper_id)
+        latencies.append(time.perf_counter() - start)
+    print(f"neighbors(): {percentiles(latencies)}")
+    latencies = []
+    for idx in range(0, 1000, 50):
+        start = time.perf_counter()
+        table.for_library(paper_ids[idx:idx + 50])
+        latencies.append(time.perf_counter() - start)
+    print(f"for_library() of 50 papers: {percentiles(latencies)}")
+
+    for num_new in (100, 1000):
+        new_users, new_papers, new_weights = make_records(num_new, args.num_users, args.num_papers, rng)
+        start = time.perf_counter()
+        num_affected = builder.add_records(new_users, new_papers, new_weights)
+        print(
+            f"add_records() of {num_new} records: {time.perf_counter() - start:.1f}s, "
+            f"recomputed {num_affected} papers"
+        )
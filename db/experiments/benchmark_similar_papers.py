@@ -0,0 +1,114 @@
+"""Benchmark the similar papers index on synthetic abstracts.
+
+Builds an index over synthetic papers (the same Zipf-distributed text as
+benchmark_paper_search_index.py, plus a random category), then measures:
+- single-paper "more like this" latency,
+- one batched `similar_to_each` over a 100-paper library, vs 100 single queries,
+- `recommend_for_library` for a 100-paper library,
+- appending papers,
+- worker processes querying the same file at once, and how much of each
+  one's memory is the shared, memory-mapped matrix (Linux only).
+
+Usage:
+    python db/experiments/benchmark_similar_papers.py [--num-papers 500000] [--num-workers 4]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from db.experiments.benchmark_paper_search_index import make_papers, make_vocabulary, make_word_pool, percentiles
+from db.similar_papers import SimilarPapersIndex
+
+categories = ["cs.LG", "cs.CL", "cs.CV", "cs.AI", "cs.IR", "stat.ML", "math.OC", "q-bio.NC"]
+
+
+def make_similar_papers(paper_ids: range, pool: list[str], rng: random.Random):
+    for paper_id, title, _, preview in make_papers(paper_ids, pool, rng):
+        yield paper_id, title, preview, [rng.choice(categories)]
+
+
+def memory_mib() -> dict[str, float]:
+    """Get this process's resident memory, split into shared and private, in MiB."""
+    memory = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("Rss", "Pss", "Shared_Clean", "Private_Clean", "Private_Dirty"):
+                memory[name] = int(value.split()[0]) / 1024
+    return memory
+
+
+def query_in_worker(path: str, paper_ids: list[int], start_event) -> tuple[float, dict[str, float]]:
+    index = SimilarPapersIndex.open(path)
+    start_event.wait()
+    start = time.perf_counter()
+    for paper_id in paper_ids:
+        index.similar(paper_id)
+    return (time.perf_counter() - start) / len(paper_ids), memory_mib()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-papers", type=int, default=500_000)
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--num-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    pool = make_word_pool(make_vocabulary(rng), rng)
+    path = os.path.join(tempfile.mkdtemp(), "similar_papers.bin")
+    start = time.perf_counter()
+    index = SimilarPapersIndex.build(path, make_similar_papers(range(1, args.num_papers + 1), pool, rng))
+    print(
+        f"Built index over {len(index)} papers in {time.perf_counter() - start:.1f}s, "
+        f"{index.dims} dims, {os.path.getsize(path) / 2**20:.1f} MiB"
+    )
+
+    start = time.perf_counter()
+    index = SimilarPapersIndex.open(path)
+    print(f"Opened in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    library = rng.sample(range(1, args.num_papers + 1), args.num_queries)
+    latencies = []
+    for paper_id in library:
+        start = time.perf_counter()
+        index.similar(paper_id)
+        latencies.append(time.perf_counter() - start)
+    print(f"similar(): {percentiles(latencies)}, {sum(latencies):.2f}s for {len(library)} papers")
+
+    start = time.perf_counter()
+    index.similar_to_each(library)
+    print(f"similar_to_each() for {len(library)} papers: {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    index.recommend_for_library(library)
+    print(f"recommend_for_library() for {len(library)} papers: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    writer = SimilarPapersIndex.open(path, writable=True)
+    start = time.perf_counter()
+    for paper in make_similar_papers(range(args.num_papers + 1, args.num_papers + 1_001), pool, rng):
+        writer.append(*paper)
+    writer.flush()
+    print(f"Appended 1000 papers in {(time.perf_counter() - start) * 1000:.0f} ms")
+    num_new = index.refresh()
+    print(f"Reader picked up {num_new} papers, similar() of a new one: {index.similar(args.num_papers + 1)[:3]}")
+
+    if os.path.exists("/proc/self/smaps_rollup"):
+        # spawned, so the workers don't inherit this process's mappings.
+        context = multiprocessing.get_context("spawn")
+        with context.Manager() as manager, context.Pool(args.num_workers) as pool_:
+            start_event = manager.Event()
+            results = [
+                pool_.apply_async(query_in_worker, (path, library[:20], start_event))
+                for _ in range(args.num_workers)
+            ]
+            time.sleep(2)
+            start_event.set()
+            for worker, result in enumerate(results):
+                seconds_per_query, memory = result.get()
+                print(
+                    f"worker {worker}: similar() {seconds_per_query * 1000:.1f} ms, "
+                    + ", ".join(f"{name} {mib:.0f} MiB" for name, mib in memory.items())
+                )
@@ -0,0 +1,78 @@
+"""Measure cold import time of our entry-point modules against a budget.
+
+Each module is imported in a fresh interpreter with `-X importtime`, a few
+times, and the best cumulative time is compared to its budget. Exits
+non-zero if any module is over budget.
+
+Importing these modules shouldn't create clients, read .env files, or import
+`supabase`/`urllib.request`; that all happens on first use.
+
+Usage:
+    python db/experiments/measure_import_time.py [--runs 5]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from lib.constants import PROJECT_ROOT_DIR
+
+# module -> budget in milliseconds. Most of the db modules' budget is
+# pydantic, which the models need.
+import_time_budgets_ms = {
+    "api.arxiv_fetch_api": 25,
+    "db.fetch_records": 350,
+    "db.insert_records_to_supabase": 350,
+}
+
+# modules that shouldn't be imported as a side effect of the ones above.
+deferred_modules = ["supabase", "dotenv", "urllib.request", "numpy"]
+
+
+def measure_import(module: str) -> tuple[float, set[str]]:
+    """Import a module in a fresh interpreter.
+
+    Returns:
+        Tuple of (cumulative import time in ms, names of all modules imported).
+    """
+    env = {**os.environ, "PYTHONPATH": PROJECT_ROOT_DIR}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    cumulative_us = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        imported.add(name)
+        if name == module:
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000, imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    over_budget = False
+    for module, budget_ms in import_time_budgets_ms.items():
+        timings = []
+        for _ in range(args.runs):
+            elapsed_ms, imported = measure_import(module)
+            timings.append(elapsed_ms)
+        best_ms = min(timings)
+        eagerly_imported = [m for m in deferred_modules if m in imported]
+        ok = best_ms <= budget_ms and not eagerly_imported
+        over_budget = over_budget or not ok
+        print(
+            f"{'OK  ' if ok else 'OVER'} {module}: {best_ms:.1f} ms (budget {budget_ms} ms)"
+            + (f", eagerly imports {eagerly_imported}" if eagerly_imported else "")
+        )
+    sys.exit(1 if over_budget else 0)
@@ -0,0 +1,135 @@
+"""Check that concurrent adds of the same paper share one fetch and one write.
+
+Many users add the same trending paper at once, from threads (through
+`user_inserts_new_paper`) and from coroutines (through `AsyncArxivClient`),
+against a slow local fake arXiv server and a SQLite database. Checks that
+each paper is fetched and inserted once, that every caller gets the same
+paper_id, and prints the coalescing ratios.
+
+Usage:
+    python db/experiments/test_coalesce_concurrent_paper_adds.py
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ["ARXIV_CACHE_PATH"] = ":memory:"
+
+import api.arxiv_fetch_api as arxiv_fetch_api
+import db.insert_records_to_supabase as insert_records_to_supabase
+from api.async_arxiv_fetch_api import AsyncArxivClient
+from api.experiments.fake_arxiv_server import FakeArxivServer, make_fake_catalog
+from db.create_new_records import create_new_user
+from db.storage_backends import SQLiteStorageBackend, set_storage_client
+from lib.single_flight import SingleFlight
+
+num_users = 32
+# each user adds the same paper under one of these URLs.
+paper_urls = [
+    "https://arxiv.org/abs/2410.00007",
+    "https://arxiv.org/pdf/2410.00007v1.pdf",
+    "arXiv:2410.00007v1",
+]
+
+
+def add_same_paper_from_threads(storage: SQLiteStorageBackend, server: FakeArxivServer) -> None:
+    user_ids = [
+        insert_records_to_supabase.insert_new_user(
+            create_new_user(f"user{idx}@test.com", f"User {idx}", f"user{idx}")
+        )
+        for idx in range(num_users)
+    ]
+    # count the actual writes to the papers table.
+    num_paper_writes = 0
+    insert_paper_for_user = insert_records_to_supabase.insert_paper_for_user
+    count_lock = threading.Lock()
+
+    def counting_insert_paper_for_user(user_id, update, paper_id=None, paper=None):
+        nonlocal num_paper_writes
+        if paper is not None:
+            with count_lock:
+                num_paper_writes += 1
+        return insert_paper_for_user(user_id, update, paper_id=paper_id, paper=paper)
+
+    insert_records_to_supabase.insert_paper_for_user = counting_insert_paper_for_user
+    barrier = threading.Barrier(num_users)
+
+    def add_paper(idx: int) -> int:
+        barrier.wait()
+        return insert_records_to_supabase.user_inserts_new_paper(
+            user_ids[idx], paper_urls[idx % len(paper_urls)], "arxiv", "want to read", 0.0
+        )["paper_id"]
+
+    num_requests = len(server.requests)
+    with ThreadPoolExecutor(max_workers=num_users) as executor:
+        paper_ids = list(executor.map(add_paper, range(num_users)))
+    insert_records_to_supabase.insert_paper_for_user = insert_paper_for_user
+
+    stats = insert_records_to_supabase.get_paper_single_flight().stats()
+    num_papers = len(storage.table("papers").select("paper_id").execute().data)
+    print(
+        f"threads: {num_users} adds, {len(server.requests) - num_requests} arXiv requests, "
+        f"{num_paper_writes} paper writes, {num_papers} papers, paper_ids {set(paper_ids)}, {stats}"
+    )
+    assert len(set(paper_ids)) == 1
+    assert len(server.requests) - num_requests == 1
+    assert num_paper_writes == 1 and num_papers == 1
+    num_library_rows = len(storage.table("user_paper_records").select("user_id").execute().data)
+    assert num_library_rows == num_users
+
+
+async def fetch_same_paper_from_coroutines(server: FakeArxivServer) -> None:
+    num_requests = len(server.requests)
+    async with AsyncArxivClient(base_url=server.url, request_interval_seconds=0) as client:
+        papers = await asyncio.gather(
+            *[client.fetch_paper_given_url(paper_urls[idx % len(paper_urls)]) for idx in range(num_users)],
+            *[client.fetch_paper_given_id("2410.00008") for _ in range(num_users)],
+        )
+        stats = client.single_flight.stats()
+    print(
+        f"asyncio: {len(papers)} fetches of 2 papers, "
+        f"{len(server.requests) - num_requests} arXiv requests, {stats}"
+    )
+    assert all(paper is not None for paper in papers)
+    assert len(server.requests) - num_requests == 2
+    assert stats["executions"] == 2
+
+
+def check_errors_are_shared() -> None:
+    flights = SingleFlight()
+    barrier = threading.Barrier(8)
+    release = threading.Event()
+
+    def fail():
+        release.wait()
+        raise ValueError("Failed to fetch paper from Arxiv")
+
+    def call(_):
+        barrier.wait()
+        try:
+            flights.do("2410.99999", fail)
+        except ValueError as e:
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(call, idx) for idx in range(8)]
+        # let every caller join the flight before it fails.
+        while flights.stats()["calls"] < 8:
+            pass
+        release.set()
+        errors = [future.result() for future in futures]
+    print(f"errors: {len(errors)} callers got {set(errors)}, {flights.stats()}")
+    assert errors == ["Failed to fetch paper from Arxiv"] * 8
+    assert flights.stats()["executions"] == 1
+
+
+if __name__ == "__main__":
+    storage = SQLiteStorageBackend(":memory:")
+    set_storage_client(storage)
+    # slow enough that all the adds overlap.
+    with FakeArxivServer(make_fake_catalog(10), delay_seconds=0.3) as server:
+        arxiv_fetch_api.ARXIV_API_URL = server.url
+        add_same_paper_from_threads(storage, server)
+        asyncio.run(fetch_same_paper_from_coroutines(server))
+    check_errors_are_shared()
@@ -1,4 +1,7 @@
-from db.insert_records_to_supabase import user_inserts_new_paper
+from db.insert_records_to_supabase import (
+    user_inserts_new_paper,
+    users_insert_new_papers_in_bulk,
+)
 
 user_id = [3, 4]
 arxiv_urls = [
@@ -49,5 +52,22 @@ def insert_mock_user_insert_arxiv_papers():
         )
         print(f"Inserted paper {arxiv_url} for user {user_id}")
 
+def insert_mock_user_insert_arxiv_papers_in_bulk():
+    items = [
+        (
+            user_insert_arxiv_paper["user_id"],
+            user_insert_arxiv_paper["arxiv_url"],
+            user_insert_arxiv_paper["reading_status"],
+            user_insert_arxiv_paper["reading_progress"],
+        )
+        for user_insert_arxiv_paper in mock_user_insert_arxiv_papers
+    ]
+    results = users_insert_new_papers_in_bulk(items)
+    for result in results:
+        if result["error"]:
+            print(f"Failed to insert paper {result['url']} for user {result['user_id']}: {result['error']}")
+        else:
+            print(f"Inserted paper {result['url']} for user {result['user_id']}")
+
 if __name__ == "__main__":
-    insert_mock_user_insert_arxiv_papers()
+    insert_mock_user_insert_arxiv_papers_in_bulk()
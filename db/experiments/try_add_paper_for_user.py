@@ -0,0 +1,189 @@
+"""Compare adding papers to libraries with add_paper_for_user vs one write per record.
+
+`insert_paper_for_user` upserts the paper, the update and the user paper
+record with one call of the add_paper_for_user database function, and
+falls back to three writes where storage doesn't have it. Checks that:
+- the function makes one storage round trip per add, vs three (two for a
+  paper already in the catalog), and both paths store the same rows,
+- with a simulated network round trip, adds take one round trip's time,
+- an add that fails midway (here, for a user that doesn't exist) leaves
+  nothing behind with the function, but an orphan paper without it.
+
+Runs on an in-memory SQLite database by default. To run it against a local
+Postgres, start a local Supabase stack (`supabase start`), apply the files
+in db/sql/ (including add_paper_for_user.sql), and set STORAGE_BACKEND,
+SUPABASE_URL and SUPABASE_KEY; the round trip simulation is skipped then.
+
+Usage:
+    python db/experiments/try_add_paper_for_user.py [--num-adds 200] [--rtt-ms 20]
+"""
+import argparse
+import os
+import time
+import uuid
+
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_DB_PATH", ":memory:")
+
+import db.insert_records_to_supabase as insert_records_to_supabase
+from db.create_new_records import build_update, create_new_user
+from db.models import Paper
+from db.storage_backends import SQLiteStorageBackend, set_storage_client, storage_client
+from lib import env_vars
+from lib.helper import generate_current_datetime_str
+from lib.metrics import get_metrics_registry
+
+
+class _DelayedCall:
+    def __init__(self, query, rtt_seconds: float):
+        self._query = query
+        self._rtt_seconds = rtt_seconds
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._query, name)
+        if name == "execute":
+            def execute():
+                time.sleep(self._rtt_seconds)
+                return attr()
+            return execute
+        if not callable(attr):
+            return attr
+        return lambda *args, **kwargs: _DelayedCall(attr(*args, **kwargs), self._rtt_seconds)
+
+
+class DelayedStorage:
+    """Storage whose requests each wait for a simulated network round trip.
+
+    Wraps the backend rather than subclassing it, so the queries a database
+    function runs (on the server) aren't delayed.
+    """
+
+    def __init__(self, backend: SQLiteStorageBackend, rtt_seconds: float):
+        self._backend = backend
+        self.rtt_seconds = rtt_seconds
+
+    def table(self, name: str):
+        return _DelayedCall(self._backend.table(name), self.rtt_seconds)
+
+    def rpc(self, name: str, params: dict):
+        return _DelayedCall(self._backend.rpc(name, params), self.rtt_seconds)
+
+
+def make_paper(run_id: str, idx: int) -> Paper:
+    arxiv_id = f"2411.{idx:05d}"
+    return Paper(
+        paper_id=-1,
+        title=f"Paper {idx} of run {run_id}",
+        authors=["Ada Lovelace", "Alan Turing"],
+        preview="An abstract.",
+        url=f"https://arxiv.org/abs/{arxiv_id}?run={run_id}",
+        source="arxiv",
+        source_id=f"{arxiv_id}-{run_id}",
+        metadata={"arxiv_id": arxiv_id, "arxiv_url": f"https://arxiv.org/abs/{arxiv_id}", "abstract": "An abstract."},
+        created_at=generate_current_datetime_str(),
+    )
+
+
+def count_round_trips() -> int:
+    return sum(
+        stats["count"]
+        for (operation, _), stats in get_metrics_registry().snapshot().items()
+        if operation.startswith("storage.")
+    )
+
+
+def add_papers(user_id: int, papers: list[Paper], use_rpc: bool) -> dict:
+    """Add new papers to a user's library, then re-add them as known papers."""
+    insert_records_to_supabase._add_paper_rpc_supported = use_rpc
+    results = {}
+    for label, known in (("new", False), ("known", True)):
+        get_metrics_registry().reset()
+        start = time.perf_counter()
+        for paper in papers:
+            update = build_update(user_id=user_id, reading_status="reading" if known else "want to read")
+            if known:
+                insert_records_to_supabase.insert_paper_for_user(user_id, update, paper_id=paper.paper_id)
+            else:
+                paper.paper_id = insert_records_to_supabase.insert_paper_for_user(user_id, update, paper=paper)[
+                    "paper_id"
+                ]
+        results[label] = (count_round_trips() / len(papers), (time.perf_counter() - start) / len(papers))
+    insert_records_to_supabase._add_paper_rpc_supported = True
+    return results
+
+
+def library_rows(user_id: int) -> list[tuple]:
+    updates = (
+        storage_client.table("updates").select("paper_id, reading_status, reading_progress")
+        .eq("user_id", user_id).order("paper_id").execute().data
+    )
+    records = storage_client.table("user_paper_records").select("paper_id").eq("user_id", user_id).execute().data
+    return sorted((row["paper_id"] - updates[0]["paper_id"], row["reading_status"]) for row in updates) + [
+        ("records", len(records))
+    ]
+
+
+def count_papers_with_url(url: str) -> int:
+    return len(storage_client.table("papers").select("paper_id").eq("url", url).execute().data)
+
+
+def check_atomicity(run_id: str) -> None:
+    missing_user_id = 2_000_000_000
+    for use_rpc, idx in ((True, 90_000), (False, 90_001)):
+        insert_records_to_supabase._add_paper_rpc_supported = use_rpc
+        paper = make_paper(run_id, idx)
+        try:
+            insert_records_to_supabase.insert_paper_for_user(
+                missing_user_id, build_update(user_id=missing_user_id), paper=paper
+            )
+            raise AssertionError("expected the add for a missing user to fail")
+        except AssertionError:
+            raise
+        except Exception as e:
+            error = type(e).__name__
+        orphans = count_papers_with_url(paper.url)
+        label = "add_paper_for_user" if use_rpc else "separate writes"
+        print(f"failed add, {label}: {error}, {orphans} orphan papers left")
+        assert orphans == (0 if use_rpc else 1)
+    insert_records_to_supabase._add_paper_rpc_supported = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-adds", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=20.0)
+    args = parser.parse_args()
+    run_id = uuid.uuid4().hex[:8]
+    on_sqlite = env_vars.STORAGE_BACKEND == "sqlite"
+
+    user_ids = [
+        insert_records_to_supabase.insert_new_user(create_new_user(f"{name}-{run_id}@test.com", name, f"{name}-{run_id}"))
+        for name in ("rpc", "steps")
+    ]
+    rows = {}
+    for user_id, use_rpc, offset in ((user_ids[0], True, 0), (user_ids[1], False, args.num_adds)):
+        papers = [make_paper(run_id, offset + idx) for idx in range(args.num_adds)]
+        results = add_papers(user_id, papers, use_rpc)
+        label = "add_paper_for_user" if use_rpc else "separate writes"
+        for kind, (round_trips, seconds) in results.items():
+            print(f"{label}, {kind} papers: {round_trips:.1f} round trips, {seconds * 1000:.2f}ms per add")
+        assert results["new"][0] == (1 if use_rpc else 3) and results["known"][0] == (1 if use_rpc else 2)
+        rows[use_rpc] = library_rows(user_id)
+    assert rows[True] == rows[False]
+    print("both paths store the same updates and user paper records")
+
+    check_atomicity(run_id)
+
+    if on_sqlite:
+        rtt_seconds = args.rtt_ms / 1000
+        set_storage_client(DelayedStorage(SQLiteStorageBackend(":memory:"), rtt_seconds))
+        user_id = insert_records_to_supabase.insert_new_user(create_new_user("rtt@test.com", "RTT", "rtt"))
+        num_adds = min(args.num_adds, 50)
+        for use_rpc in (True, False):
+            papers = [make_paper(run_id, (0 if use_rpc else num_adds) + idx) for idx in range(num_adds)]
+            results = add_papers(user_id, papers, use_rpc)
+            label = "add_paper_for_user" if use_rpc else "separate writes"
+            print(
+                f"{args.rtt_ms:.0f}ms round trips, {label}: new papers {results['new'][1] * 1000:.1f}ms, "
+                f"known papers {results['known'][1] * 1000:.1f}ms per add"
+            )
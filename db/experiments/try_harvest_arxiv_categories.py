@@ -0,0 +1,115 @@
+"""Harvest from a local fake arXiv server into a SQLite database.
+
+Simulates a crash part-way through a sweep, checks that the next run
+resumes from the checkpoint rather than starting over, and that a later
+run only picks up papers updated since the watermark. Before resuming,
+papers already written are revised (which moves them past the window's
+end, and the results after them down): a few, which the resumed sweep
+catches up with, and then more than a page, which makes it start over.
+Either way, no paper is skipped.
+
+Usage:
+    python db/experiments/try_harvest_arxiv_categories.py
+"""
+import os
+import tempfile
+from datetime import datetime, timezone
+
+os.environ["ARXIV_CACHE_PATH"] = ":memory:"
+
+import api.arxiv_fetch_api as arxiv_fetch_api
+import db.harvest_arxiv_papers as harvest_arxiv_papers
+from api.experiments.fake_arxiv_server import FakeArxivServer, make_fake_paper
+from db.storage_backends import SQLiteStorageBackend, set_storage_client
+
+
+def revise_written_papers(catalog: dict[str, dict], storage: SQLiteStorageBackend, num_papers: int) -> None:
+    """Revise the first papers written, dating the new versions after the window."""
+    written = {row["source_id"] for row in storage.table("papers").select("source_id").execute().data}
+    by_updated = sorted(
+        (paper for paper in catalog.values() if paper["arxiv_id"].split("v")[0] in written),
+        key=lambda paper: (paper["updated"], paper["arxiv_id"]),
+    )
+    for paper in by_updated[:num_papers]:
+        del catalog[paper["arxiv_id"]]
+        revised = make_fake_paper(
+            paper["arxiv_id"].replace("v1", "v2"), categories=paper["categories"], updated="2024-10-13T00:00:00Z"
+        )
+        catalog[revised["arxiv_id"]] = revised
+
+
+def crash_and_resume(storage: SQLiteStorageBackend, server: FakeArxivServer, num_revised: int, kwargs: dict) -> None:
+    """Crash a sweep after 2 batches, revise papers, and resume it."""
+    write_batch = harvest_arxiv_papers._write_batch
+    num_writes = 0
+
+    def crashing_write_batch(*args, **kwargs):
+        nonlocal num_writes
+        num_writes += 1
+        if num_writes > 2:
+            raise RuntimeError("simulated crash")
+        return write_batch(*args, **kwargs)
+
+    harvest_arxiv_papers._write_batch = crashing_write_batch
+    try:
+        harvest_arxiv_papers.harvest_arxiv_categories(["cs.LG"], **kwargs)
+    except RuntimeError as e:
+        print(f"First run: {e}, checkpoint: {harvest_arxiv_papers.load_checkpoint(kwargs['checkpoint_path'])}")
+    harvest_arxiv_papers._write_batch = write_batch
+
+    expected = sum(
+        1 for paper in server.catalog.values()
+        if "cs.LG" in paper["categories"] and paper["updated"] < "2024-10-12"
+    )
+    revise_written_papers(server.catalog, storage, num_revised)
+    num_requests = len(server.requests)
+    result = harvest_arxiv_papers.harvest_arxiv_categories(["cs.LG"], **kwargs)
+    print(
+        f"Second run, {num_revised} papers revised before it: {result}, "
+        f"{len(server.requests) - num_requests} requests"
+    )
+    num_papers = len(storage.table("papers").select("paper_id").execute().data)
+    print(f"Papers in database: {num_papers} (expected {expected})")
+    assert num_papers == expected
+
+
+def make_catalog() -> dict[str, dict]:
+    catalog = {}
+    for idx in range(450):
+        categories = ["cs.LG"] if idx % 3 else ["math.CO"]
+        updated = f"2024-10-{10 + idx % 3:02d}T{idx % 24:02d}:{idx % 60:02d}:00Z"
+        paper = make_fake_paper(f"2410.{idx:05d}v1", categories=categories, updated=updated)
+        catalog[paper["arxiv_id"]] = paper
+    return catalog
+
+
+if __name__ == "__main__":
+    # fewer papers revised than a page, then more.
+    for num_revised in (3, 60):
+        storage = SQLiteStorageBackend(":memory:")
+        set_storage_client(storage)
+        catalog = make_catalog()
+        kwargs = dict(
+            checkpoint_path=os.path.join(tempfile.mkdtemp(), "checkpoint.json"),
+            since=datetime(2024, 10, 10, tzinfo=timezone.utc),
+            until=datetime(2024, 10, 11, 23, 59, tzinfo=timezone.utc),
+            write_batch_size=50,
+            page_size=40,
+            request_interval_seconds=0,
+        )
+        with FakeArxivServer(catalog) as server:
+            arxiv_fetch_api.ARXIV_API_URL = server.url
+            crash_and_resume(storage, server, num_revised, kwargs)
+
+    with FakeArxivServer(catalog) as server:
+        arxiv_fetch_api.ARXIV_API_URL = server.url
+        # a new paper shows up after the watermark.
+        new_paper = make_fake_paper("2410.99999v1", categories=["cs.LG"], updated="2024-10-12T09:00:00Z")
+        catalog[new_paper["arxiv_id"]] = new_paper
+        kwargs.update(until=datetime(2024, 10, 12, 23, 59, tzinfo=timezone.utc))
+        result = harvest_arxiv_papers.harvest_arxiv_categories(["cs.LG"], **kwargs)
+        expected = sum(
+            1 for paper in catalog.values()
+            if "cs.LG" in paper["categories"] and paper["updated"].startswith("2024-10-12")
+        )
+        print(f"Third run: {result} (expected {expected})")
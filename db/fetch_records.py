@@ -1,9 +1,42 @@
 """Fetch records from the database."""
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Sequence
 
-from db.models import Paper, User, Update, UserPaperRecord
-from db.supabase_db import supabase_client
+from db.hydration import hydrate, hydrate_one
+from db.models import Paper, PaperAIAnalysis, User, Update, UserPaperRecord
+from db.record_cache import get_record_cache
+from db.storage_backends import storage_client
+from lib.logger import get_logger
+
+logger = get_logger(__name__)
+
+# max number of values in a single `in_` filter, to keep request URLs short.
+DEFAULT_IN_FILTER_BATCH_SIZE = 500
+DEFAULT_UPDATES_PAGE_SIZE = 50
+
+# (created_at, update_id) of the last update on a page of update history.
+UpdatesCursor = tuple[str, int]
+
+
+def _select_in(
+    table: str,
+    column: str,
+    values: list,
+    columns: str = "*",
+    batch_size: int = DEFAULT_IN_FILTER_BATCH_SIZE,
+) -> list[dict]:
+    """Select rows where `column` is in `values`, one query per `batch_size` values."""
+    values = list(dict.fromkeys(values))
+    rows = []
+    for start in range(0, len(values), batch_size):
+        response = (
+            storage_client.table(table)
+            .select(columns)
+            .in_(column, values[start:start + batch_size])
+            .execute()
+        )
+        rows.extend(response.data)
+    return rows
 
 
 def get_user_by_id(user_id: int) -> Optional[User]:
@@ -15,15 +48,22 @@ def get_user_by_id(user_id: int) -> Optional[User]:
     Returns:
         User object if found, None otherwise
     """
+    cache = get_record_cache()
+    user = cache.get("users", user_id)
+    if user is not None:
+        return user
+
     response = (
-        supabase_client.table("users")
+        storage_client.table("users")
         .select("*")
         .eq("user_id", user_id)
         .execute()
     )
     
     if response.data:
-        return User(**response.data[0])
+        user = hydrate_one(User, response.data[0])
+        cache.set("users", user_id, user)
+        return user
     return None
 
 
@@ -36,18 +76,87 @@ def get_paper_by_id(paper_id: int) -> Optional[Paper]:
     Returns:
         Paper object if found, None otherwise
     """
+    cache = get_record_cache()
+    paper = cache.get("papers", paper_id)
+    if paper is not None:
+        return paper
+
     response = (
-        supabase_client.table("papers")
+        storage_client.table("papers")
         .select("*")
         .eq("paper_id", paper_id)
         .execute()
     )
     
     if response.data:
-        return Paper(**response.data[0])
+        paper = hydrate_one(Paper, response.data[0])
+        cache.set("papers", paper_id, paper)
+        return paper
     return None
 
 
+def get_paper_ids_by_source_ids(source: str, source_ids: List[str]) -> Dict[str, int]:
+    """Look up papers already in the catalog by their canonical source ID.
+
+    Uses the (source, source_id) index on papers.
+
+    Args:
+        source: The source of the papers, e.g. "arxiv"
+        source_ids: Canonical IDs in that source, e.g. normalized arXiv IDs
+
+    Returns:
+        Dictionary of source_id -> paper_id, for the papers that exist
+    """
+    cache = get_record_cache()
+    paper_ids = {}
+    missing_source_ids = []
+    for source_id in dict.fromkeys(source_ids):
+        paper_id = cache.get("paper_ids_by_source_id", (source, source_id))
+        if paper_id is None:
+            missing_source_ids.append(source_id)
+        else:
+            paper_ids[source_id] = paper_id
+    if not missing_source_ids:
+        return paper_ids
+
+    for start in range(0, len(missing_source_ids), DEFAULT_IN_FILTER_BATCH_SIZE):
+        response = (
+            storage_client.table("papers")
+            .select("paper_id, source_id")
+            .eq("source", source)
+            .in_("source_id", missing_source_ids[start:start + DEFAULT_IN_FILTER_BATCH_SIZE])
+            .execute()
+        )
+        for row in response.data:
+            # if there are duplicate legacy rows, consistently use the oldest.
+            if row["source_id"] not in paper_ids or row["paper_id"] < paper_ids[row["source_id"]]:
+                paper_ids[row["source_id"]] = row["paper_id"]
+    for source_id in missing_source_ids:
+        if source_id in paper_ids:
+            cache.set("paper_ids_by_source_id", (source, source_id), paper_ids[source_id])
+    return paper_ids
+
+
+def get_papers_in_category(category: str) -> List[Paper]:
+    """Get all papers in an arXiv category, e.g. "cs.LG".
+
+    The filter runs server-side on the papers' JSON metadata.
+
+    Args:
+        category: The arXiv category
+
+    Returns:
+        List of Paper objects in the category
+    """
+    response = (
+        storage_client.table("papers")
+        .select("*")
+        .contains("metadata", {"categories": [category]})
+        .execute()
+    )
+    return hydrate(Paper, response.data)
+
+
 def get_papers_for_user(user_id: int) -> List[Paper]:
     """Get all papers for a user.
     
@@ -57,66 +166,314 @@ def get_papers_for_user(user_id: int) -> List[Paper]:
     Returns:
         List of Paper objects belonging to the user
     """
+    cache = get_record_cache()
+
     # First get all paper_ids for this user
-    paper_ids_response = (
-        supabase_client.table("user_paper_records")
-        .select("paper_id")
-        .eq("user_id", user_id)
-        .execute()
-    )
-    
-    if not paper_ids_response.data:
+    paper_ids = cache.get("user_paper_ids", user_id)
+    if paper_ids is None:
+        paper_ids_response = (
+            storage_client.table("user_paper_records")
+            .select("paper_id")
+            .eq("user_id", user_id)
+            .execute()
+        )
+        paper_ids = [record["paper_id"] for record in paper_ids_response.data]
+        cache.set("user_paper_ids", user_id, paper_ids)
+
+    if not paper_ids:
         return []
-    
-    paper_ids = [record["paper_id"] for record in paper_ids_response.data]
-    
-    # Then fetch all papers with those IDs
-    papers_response = (
-        supabase_client.table("papers")
+
+    # Then fetch the papers with those IDs
+    return _get_papers_by_ids(paper_ids)
+
+
+def _get_papers_by_ids(paper_ids: List[int]) -> List[Paper]:
+    """Get papers by ID, in order, fetching the ones that aren't cached in one query."""
+    cache = get_record_cache()
+    papers = cache.get_many("papers", paper_ids)
+    missing_paper_ids = [paper_id for paper_id in paper_ids if paper_id not in papers]
+    if missing_paper_ids:
+        papers_response = (
+            storage_client.table("papers")
+            .select("*")
+            .in_("paper_id", missing_paper_ids)
+            .execute()
+        )
+        for paper in hydrate(Paper, papers_response.data):
+            cache.set("papers", paper.paper_id, paper)
+            papers[paper.paper_id] = paper
+
+    return [papers[paper_id] for paper_id in paper_ids if paper_id in papers]
+
+
+def iter_catalog_papers(
+    after_paper_id: Optional[int] = None,
+    page_size: int = 1000,
+    columns: str = "paper_id, title, authors, preview",
+) -> Iterator[Dict[str, Any]]:
+    """Iterate over the papers in the catalog, in paper_id order.
+
+    By default only the searchable columns are fetched. `columns` must
+    include paper_id.
+    """
+    while True:
+        query = storage_client.table("papers").select(columns)
+        if after_paper_id is not None:
+            query = query.gt("paper_id", after_paper_id)
+        rows = query.order("paper_id").limit(page_size).execute().data
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after_paper_id = rows[-1]["paper_id"]
+
+
+def search_papers(query: str, limit: int = 10, prefix: bool = False) -> List[Paper]:
+    """Full-text search over the paper catalog, ranked with BM25.
+
+    Args:
+        query: Free text, matched against titles, authors and previews
+        limit: Max number of papers to return
+        prefix: Treat the last query term as a prefix, for autocomplete
+
+    Returns:
+        List of matching Paper objects, best match first
+    """
+    from db.paper_search_index import get_paper_search_index # imports numpy
+
+    results = get_paper_search_index().search(query, limit=limit, prefix=prefix)
+    return _get_papers_by_ids([paper_id for paper_id, _ in results])
+
+
+def get_similar_papers(paper_id: int, limit: int = 10) -> List[Paper]:
+    """Get the papers most similar to a paper ("more like this").
+
+    Args:
+        paper_id: The ID of the paper
+        limit: Max number of papers to return
+
+    Returns:
+        List of Paper objects, most similar first. Empty if the paper isn't
+        in the catalog, or the similar papers index hasn't been built.
+    """
+    from db.similar_papers import get_similar_papers_index # imports numpy
+
+    try:
+        results = get_similar_papers_index().similar(paper_id, k=limit)
+    except FileNotFoundError as e:
+        logger.warning(str(e))
+        return []
+    return _get_papers_by_ids([similar_paper_id for similar_paper_id, _ in results])
+
+
+def get_recommended_papers_for_user(user_id: int, limit: int = 10) -> List[Paper]:
+    """Get the papers most similar to any paper in a user's library.
+
+    Args:
+        user_id: The ID of the user
+        limit: Max number of papers to return
+
+    Returns:
+        List of Paper objects not in the user's library, most similar first.
+        Empty if the similar papers index hasn't been built.
+    """
+    from db.similar_papers import get_similar_papers_index # imports numpy
+
+    try:
+        index = get_similar_papers_index()
+    except FileNotFoundError as e:
+        logger.warning(str(e))
+        return []
+    paper_ids = [paper.paper_id for paper in get_papers_for_user(user_id)]
+    results = index.recommend_for_library(paper_ids, k=limit)
+    return _get_papers_by_ids([paper_id for paper_id, _ in results])
+
+
+def get_readers_also_read(paper_id: int, limit: int = 10) -> List[Paper]:
+    """Get the papers most often in the libraries of a paper's readers.
+
+    Args:
+        paper_id: The ID of the paper
+        limit: Max number of papers to return
+
+    Returns:
+        List of Paper objects, most related first. Empty if the paper has no
+        readers, or the precomputed table doesn't have it yet (or hasn't been
+        built).
+    """
+    from db.readers_also_read import get_readers_also_read_table # imports numpy
+
+    try:
+        results = get_readers_also_read_table().neighbors(paper_id, k=limit)
+    except FileNotFoundError as e:
+        logger.warning(str(e))
+        return []
+    return _get_papers_by_ids([related_paper_id for related_paper_id, _ in results])
+
+
+def get_paper_ai_analyses_by_hashes(content_hashes: List[str]) -> Dict[str, PaperAIAnalysis]:
+    """Get stored analyses by their content hash (see db/paper_ai_analysis.py).
+
+    Args:
+        content_hashes: Hashes of the paper content, prompt and model
+
+    Returns:
+        Dictionary of content_hash -> PaperAIAnalysis, for the ones that exist
+    """
+    cache = get_record_cache()
+    analyses = cache.get_many("paper_ai_analyses", content_hashes)
+    missing_hashes = [content_hash for content_hash in content_hashes if content_hash not in analyses]
+    rows = _select_in("paper_ai_analyses", "content_hash", missing_hashes) if missing_hashes else []
+    for analysis in hydrate(PaperAIAnalysis, rows):
+        cache.set("paper_ai_analyses", analysis.content_hash, analysis)
+        analyses[analysis.content_hash] = analysis
+    return analyses
+
+
+def get_paper_ai_analyses_for_paper(paper_id: int) -> List[PaperAIAnalysis]:
+    """Get all stored analyses of a paper, for any prompt and model, oldest first."""
+    response = (
+        storage_client.table("paper_ai_analyses")
         .select("*")
-        .in_("paper_id", paper_ids)
+        .eq("paper_id", paper_id)
+        .order("analysis_id")
         .execute()
     )
-    
-    return [Paper(**paper) for paper in papers_response.data]
+    return hydrate(PaperAIAnalysis, response.data)
 
 
-def get_updates_for_user(user_id: int) -> List[Update]:
+def get_updates_for_user(user_id: int, lazy: bool = False) -> Sequence[Update]:
     """Get all updates made by a user.
+
+    Loads the whole history; use `get_updates_page_for_user` to page through
+    it, or `get_latest_updates_for_users` for the current reading state.
     
     Args:
         user_id: The ID of the user to fetch updates for
+        lazy: Build each Update on first access (see db/hydration.py)
         
     Returns:
         List of Update objects created by the user
     """
     response = (
-        supabase_client.table("updates")
+        storage_client.table("updates")
         .select("*")
         .eq("user_id", user_id)
         .execute()
     )
     
-    return [Update(**update) for update in response.data]
+    return hydrate(Update, response.data, lazy=lazy)
 
 
-def get_updates_for_paper(paper_id: int) -> List[Update]:
+def get_updates_for_paper(paper_id: int, lazy: bool = False) -> Sequence[Update]:
     """Get all updates for a specific paper.
+
+    Loads the whole history; use `get_updates_page_for_paper` to page through it.
     
     Args:
         paper_id: The ID of the paper to fetch updates for
+        lazy: Build each Update on first access (see db/hydration.py)
         
     Returns:
         List of Update objects for the paper
     """
     response = (
-        supabase_client.table("updates")
+        storage_client.table("updates")
         .select("*")
         .eq("paper_id", paper_id)
         .execute()
     )
     
-    return [Update(**update) for update in response.data]
+    return hydrate(Update, response.data, lazy=lazy)
+
+
+def _get_updates_page(
+    column: str, value: int, limit: int, cursor: Optional[UpdatesCursor]
+) -> tuple[List[Update], Optional[UpdatesCursor]]:
+    """Get a page of the updates where `column` is `value`, newest first.
+
+    Keyset pagination on (created_at, update_id), so each page is an index
+    range scan however deep it is. The "before the cursor" condition is
+    split into two queries (same created_at with a smaller update_id, then
+    an older created_at), since the query builder has no OR of ANDs.
+    """
+    rows = []
+    if cursor is not None:
+        created_at, update_id = cursor
+        rows = (
+            storage_client.table("updates")
+            .select("*")
+            .eq(column, value)
+            .eq("created_at", created_at)
+            .lt("update_id", update_id)
+            .order("update_id", desc=True)
+            .limit(limit)
+            .execute()
+        ).data
+    if len(rows) < limit:
+        query = storage_client.table("updates").select("*").eq(column, value)
+        if cursor is not None:
+            query = query.lt("created_at", cursor[0])
+        rows += (
+            query.order("created_at", desc=True)
+            .order("update_id", desc=True)
+            .limit(limit - len(rows))
+            .execute()
+        ).data
+    updates = hydrate(Update, rows)
+    next_cursor = (updates[-1].created_at, updates[-1].update_id) if len(updates) == limit else None
+    return updates, next_cursor
+
+
+def get_updates_page_for_user(
+    user_id: int, limit: int = DEFAULT_UPDATES_PAGE_SIZE, cursor: Optional[UpdatesCursor] = None
+) -> tuple[List[Update], Optional[UpdatesCursor]]:
+    """Get a page of a user's update history, newest first.
+
+    Args:
+        user_id: The ID of the user to fetch updates for
+        limit: Max number of updates on the page
+        cursor: The cursor returned with the previous page, or None for the first page
+
+    Returns:
+        (updates, cursor for the next page), the cursor being None on the last page
+    """
+    return _get_updates_page("user_id", user_id, limit, cursor)
+
+
+def get_updates_page_for_paper(
+    paper_id: int, limit: int = DEFAULT_UPDATES_PAGE_SIZE, cursor: Optional[UpdatesCursor] = None
+) -> tuple[List[Update], Optional[UpdatesCursor]]:
+    """Get a page of the updates for a paper, newest first. See `get_updates_page_for_user`."""
+    return _get_updates_page("paper_id", paper_id, limit, cursor)
+
+
+def get_latest_updates_for_users(user_ids: List[int]) -> Dict[int, Dict[int, Update]]:
+    """Get each user's current reading state: their latest update per paper.
+
+    Read from the `latest_updates` view, so it's one row per paper in the
+    library however long the update history is.
+
+    Returns:
+        Dictionary of user_id -> {paper_id: Update}, for every user in `user_ids`
+    """
+    latest_updates: Dict[int, Dict[int, Update]] = {user_id: {} for user_id in user_ids}
+    for update in hydrate(Update, _select_in("latest_updates", "user_id", user_ids)):
+        latest_updates[update.user_id][update.paper_id] = update
+    return latest_updates
+
+
+def get_latest_update(user_id: int, paper_id: int) -> Optional[Update]:
+    """Get a user's latest update for a paper, or None if there isn't one."""
+    response = (
+        storage_client.table("latest_updates")
+        .select("*")
+        .eq("user_id", user_id)
+        .eq("paper_id", paper_id)
+        .execute()
+    )
+    if response.data:
+        return hydrate_one(Update, response.data[0])
+    return None
 
 
 def get_user_paper_record(user_id: int, paper_id: int) -> Optional[UserPaperRecord]:
@@ -130,7 +487,7 @@ def get_user_paper_record(user_id: int, paper_id: int) -> Optional[UserPaperReco
         UserPaperRecord if found, None otherwise
     """
     response = (
-        supabase_client.table("user_paper_records")
+        storage_client.table("user_paper_records")
         .select("*")
         .eq("user_id", user_id)
         .eq("paper_id", paper_id)
@@ -138,5 +495,54 @@ def get_user_paper_record(user_id: int, paper_id: int) -> Optional[UserPaperReco
     )
     
     if response.data:
-        return UserPaperRecord(**response.data[0])
-    return None
\ No newline at end of file
+        return hydrate_one(UserPaperRecord, response.data[0])
+    return None
+
+
+def get_libraries_for_users(user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Get the profile, papers and updates for many users at once.
+
+    Uses 4 queries in total (one each for users, user_paper_records, papers
+    and updates), rather than 4 queries per user. Papers are shared: a
+    paper in several users' libraries is the same Paper object in each.
+    Only each paper's latest update is loaded (see `latest_updates`), so
+    this doesn't slow down as update histories grow; page through the full
+    history with `get_updates_page_for_user`.
+
+    Args:
+        user_ids: The IDs of the users to fetch
+
+    Returns:
+        Dictionary of user_id -> {"user": User, "papers": List[Paper],
+        "updates": List[Update]}, in the order of `user_ids`, with at most
+        one update per paper. Users that don't exist are skipped.
+    """
+    users = {user.user_id: user for user in hydrate(User, _select_in("users", "user_id", user_ids))}
+    if not users:
+        return {}
+    found_user_ids = [user_id for user_id in dict.fromkeys(user_ids) if user_id in users]
+
+    records = _select_in("user_paper_records", "user_id", found_user_ids)
+    paper_ids_by_user: Dict[int, List[int]] = {user_id: [] for user_id in found_user_ids}
+    for record in records:
+        paper_ids_by_user[record["user_id"]].append(record["paper_id"])
+
+    papers = {
+        paper.paper_id: paper
+        for paper in hydrate(Paper, _select_in("papers", "paper_id", [record["paper_id"] for record in records]))
+    }
+
+    latest_updates = get_latest_updates_for_users(found_user_ids)
+
+    return {
+        user_id: {
+            "user": users[user_id],
+            "papers": [
+                papers[paper_id]
+                for paper_id in paper_ids_by_user[user_id]
+                if paper_id in papers
+            ],
+            "updates": list(latest_updates[user_id].values()),
+        }
+        for user_id in found_user_ids
+    }
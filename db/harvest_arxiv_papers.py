@@ -0,0 +1,244 @@
+"""Incrementally harvest new and updated arXiv papers for a set of categories.
+
+Each run sweeps a fixed window of arXiv's `lastUpdatedDate`, from the
+previous run's watermark up to the time the sweep started, sorted oldest
+first. The sweep checkpoints its offset (and the last paper written) after
+every batch it writes, and a crashed sweep resumes from the last checkpoint
+rather than starting over. When a sweep finishes, the end of its window
+becomes the new watermark.
+
+The offsets aren't stable: a paper revised during the sweep moves past the
+window's end, so the results after it shift down. A resumed sweep starts a
+page before its checkpoint, skips ahead to the last paper it wrote, and
+writes from there; papers written twice are upserted again, which is
+harmless. If the last paper isn't in that page (more than a page of papers
+moved, or the paper itself did), the sweep starts over from the window's
+start. The papers that moved are picked up by the next sweep.
+
+Harvested papers are upserted as `Paper` records (with `ArxivPaper`
+metadata) in batches, and their metadata is put in the arXiv cache, so that
+users adding these papers don't need to call arXiv.
+
+Usage:
+    python db/harvest_arxiv_papers.py cs.LG cs.AI
+"""
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, Optional
+
+from api.arxiv_fetch_api import (
+    DEFAULT_PAGE_SIZE,
+    DEFAULT_REQUEST_INTERVAL_SECONDS,
+    _strip_arxiv_version,
+    iter_papers_from_arxiv_given_query,
+)
+from api.arxiv_ids import canonical_arxiv_url
+from db.create_new_records import build_arxiv_paper
+from db.insert_records_to_supabase import insert_new_papers
+from lib import env_vars
+from lib.logger import get_logger
+
+logger = get_logger(__name__)
+
+# how far back the first sweep for a set of categories goes.
+DEFAULT_INITIAL_LOOKBACK = timedelta(days=1)
+DEFAULT_WRITE_BATCH_SIZE = 100
+
+# date format for arXiv's `lastUpdatedDate:[... TO ...]` ranges (GMT).
+arxiv_query_date_format = "%Y%m%d%H%M"
+
+
+def _default_checkpoint_path(categories: list[str]) -> str:
+    return os.path.join(
+        env_vars.ARXIV_HARVEST_CHECKPOINT_DIR, f"{'+'.join(sorted(categories))}.json"
+    )
+
+
+def load_checkpoint(checkpoint_path: str) -> Optional[dict[str, Any]]:
+    """Load a harvest checkpoint, or None if there isn't one yet."""
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint_path: str, checkpoint: dict[str, Any]) -> None:
+    """Save a harvest checkpoint atomically (write to a temp file, then rename)."""
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def build_harvest_query(categories: list[str], window_start: str, window_end: str) -> str:
+    categories_query = " OR ".join(f"cat:{category}" for category in categories)
+    return f"({categories_query}) AND lastUpdatedDate:[{window_start} TO {window_end}]"
+
+
+def iter_harvested_papers(
+    categories: list[str],
+    checkpoint: dict[str, Any],
+    start: Optional[int] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    request_interval_seconds: float = DEFAULT_REQUEST_INTERVAL_SECONDS,
+) -> Iterator[tuple[int, Dict[str, Any]]]:
+    """Stream (offset, paper) for the checkpoint's current window, from `start`
+    (by default, its offset)."""
+    search_query = build_harvest_query(
+        categories, checkpoint["window_start"], checkpoint["window_end"]
+    )
+    yield from iter_papers_from_arxiv_given_query(
+        search_query,
+        start=checkpoint["next_start"] if start is None else start,
+        page_size=page_size,
+        sort_by="lastUpdatedDate",
+        sort_order="ascending",
+        request_interval_seconds=request_interval_seconds,
+    )
+
+
+def _write_batch(batch: list[Dict[str, Any]], use_cache: bool) -> int:
+    papers = [
+        build_arxiv_paper(canonical_arxiv_url(paper_data["arxiv_id"]), paper_data)
+        for paper_data in batch
+    ]
+    paper_ids_by_url = insert_new_papers(papers)
+    if use_cache:
+        from api.arxiv_cache import get_arxiv_cache
+
+        cache = get_arxiv_cache()
+        for paper_data in batch:
+            cache.put(paper_data["arxiv_id"], paper_data)
+            cache.put(_strip_arxiv_version(paper_data["arxiv_id"]), paper_data)
+    return len(paper_ids_by_url)
+
+
+def _sweep(
+    categories: list[str],
+    checkpoint: dict[str, Any],
+    checkpoint_path: str,
+    write_batch_size: int,
+    page_size: int,
+    request_interval_seconds: float,
+    use_cache: bool,
+) -> tuple[int, bool]:
+    """Write the checkpoint's window from its offset, checkpointing after each batch.
+
+    Returns:
+        (papers written, whether the sweep got past the checkpoint). False
+        if the last paper written wasn't found within a page before the
+        checkpoint's offset, so papers may have been skipped.
+    """
+    resume_at = checkpoint["next_start"]
+    last_arxiv_id = checkpoint.get("last_arxiv_id")
+    # results shift down when papers before the offset are revised, so look
+    # for the last paper written from a page before it.
+    caught_up = last_arxiv_id is None
+    start = resume_at if caught_up else max(0, resume_at - page_size)
+    harvested = 0
+    batch: list[Dict[str, Any]] = []
+    for offset, paper_data in iter_harvested_papers(
+        categories, checkpoint, start=start, page_size=page_size, request_interval_seconds=request_interval_seconds
+    ):
+        if not caught_up:
+            if paper_data["arxiv_id"] == last_arxiv_id:
+                caught_up = True
+            elif offset >= resume_at:
+                return harvested, False
+            continue
+        batch.append(paper_data)
+        if len(batch) >= write_batch_size:
+            harvested += _write_batch(batch, use_cache)
+            checkpoint.update(next_start=offset + 1, last_arxiv_id=batch[-1]["arxiv_id"])
+            save_checkpoint(checkpoint_path, checkpoint)
+            batch = []
+    if batch:
+        harvested += _write_batch(batch, use_cache)
+    return harvested, caught_up
+
+
+def harvest_arxiv_categories(
+    categories: list[str],
+    checkpoint_path: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    request_interval_seconds: float = DEFAULT_REQUEST_INTERVAL_SECONDS,
+    use_cache: bool = True,
+) -> dict[str, Any]:
+    """Harvest papers in `categories` updated since the saved watermark.
+
+    Args:
+        categories: arXiv categories, e.g. ["cs.LG", "cs.AI"].
+        checkpoint_path: Where to keep the watermark and sweep progress.
+            Defaults to a file per set of categories under
+            ARXIV_HARVEST_CHECKPOINT_DIR.
+        since: Start of the first sweep, if there's no watermark yet.
+            Defaults to DEFAULT_INITIAL_LOOKBACK ago.
+        until: End of a new sweep's window. Defaults to now.
+        write_batch_size: Number of papers to upsert per write (and per
+            checkpoint).
+
+    Returns:
+        Dictionary with "harvested" (papers written by this run), "resumed"
+        (whether it resumed an interrupted sweep) and "watermark".
+    """
+    categories = sorted(set(categories))
+    checkpoint_path = checkpoint_path or _default_checkpoint_path(categories)
+    checkpoint = load_checkpoint(checkpoint_path) or {"categories": categories, "watermark": None}
+    if checkpoint["categories"] != categories:
+        raise ValueError(
+            f"Checkpoint {checkpoint_path} is for categories {checkpoint['categories']}, "
+            f"not {categories}."
+        )
+
+    resumed = checkpoint.get("window_end") is not None
+    if not resumed:
+        now = datetime.now(timezone.utc)
+        watermark = checkpoint["watermark"] or (since or now - DEFAULT_INITIAL_LOOKBACK).strftime(
+            arxiv_query_date_format
+        )
+        checkpoint.update(
+            window_start=watermark,
+            window_end=(until or now).strftime(arxiv_query_date_format),
+            next_start=0,
+            last_arxiv_id=None,
+        )
+        save_checkpoint(checkpoint_path, checkpoint)
+    logger.info(
+        f"{'Resuming' if resumed else 'Starting'} harvest of {categories} for "
+        f"[{checkpoint['window_start']} TO {checkpoint['window_end']}] "
+        f"from offset {checkpoint['next_start']}."
+    )
+
+    harvested = 0
+    while True:
+        num_written, caught_up = _sweep(
+            categories, checkpoint, checkpoint_path, write_batch_size, page_size, request_interval_seconds, use_cache
+        )
+        harvested += num_written
+        if caught_up:
+            break
+        logger.warning(
+            f"Last harvested paper {checkpoint['last_arxiv_id']} wasn't within a page of offset "
+            f"{checkpoint['next_start']}, restarting the sweep of {categories} from its start."
+        )
+        checkpoint.update(next_start=0, last_arxiv_id=None)
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    # the sweep is done, so its window's end is the new watermark.
+    checkpoint.update(
+        watermark=checkpoint["window_end"], window_start=None, window_end=None, next_start=0, last_arxiv_id=None
+    )
+    save_checkpoint(checkpoint_path, checkpoint)
+    logger.info(f"Harvested {harvested} papers for {categories}, watermark {checkpoint['watermark']}.")
+    return {"harvested": harvested, "resumed": resumed, "watermark": checkpoint["watermark"]}
+
+
+if __name__ == "__main__":
+    import sys
+
+    harvest_arxiv_categories(sys.argv[1:] or ["cs.LG"])
@@ -0,0 +1,192 @@
+"""Build models from database rows, a whole result set at a time.
+
+`hydrate(Update, rows)` replaces `[Update(**row) for row in rows]` in the
+readers, with a mode set by the MODEL_HYDRATION env var (or
+`set_hydration_mode`):
+- "validate" (the default): validate the rows in one call of a cached
+  TypeAdapter, so the result is the same as building each model.
+- "trusted": don't validate. The rows come from our own schema, so they
+  already have the fields' types; each row becomes its model's `__dict__`
+  (don't reuse the rows afterwards), with missing fields set to their
+  defaults and extra columns dropped. Only for flat models (no nested
+  models), like the ones in db/models.py.
+
+With `lazy=True`, rows are only made into models when they're accessed,
+see `LazyModels`. Useful for long result sets of which callers only look
+at a few, e.g. a user's whole update history.
+
+The garbage collector is paused while hydrating large result sets, since
+the models it would scan for cycles have none.
+"""
+import contextlib
+import functools
+import gc
+import threading
+from typing import Any, Callable, Generic, Iterator, Optional, Sequence, TypeVar
+
+from pydantic import BaseModel
+
+from lib import env_vars
+
+M = TypeVar("M", bound=BaseModel)
+
+HYDRATION_MODES = ("validate", "trusted")
+# pause the garbage collector while hydrating at least this many rows.
+GC_PAUSE_MIN_ROWS = 10_000
+
+_mode: Optional[str] = None
+_mode_lock = threading.Lock()
+
+_new_object = object.__new__
+_set_attr = object.__setattr__
+
+
+def get_hydration_mode() -> str:
+    """Get the hydration mode, read from MODEL_HYDRATION on first use."""
+    global _mode
+    if _mode is None:
+        with _mode_lock:
+            if _mode is None:
+                _mode = _check_mode(env_vars.MODEL_HYDRATION)
+    return _mode
+
+
+def set_hydration_mode(mode: str) -> None:
+    """Set the hydration mode, "validate" or "trusted"."""
+    global _mode
+    with _mode_lock:
+        _mode = _check_mode(mode)
+
+
+def _check_mode(mode: str) -> str:
+    if mode not in HYDRATION_MODES:
+        raise ValueError(f"Invalid hydration mode: {mode}, expected one of {HYDRATION_MODES}")
+    return mode
+
+
+@contextlib.contextmanager
+def _gc_paused(num_rows: int):
+    # building many objects triggers collections that find nothing to free.
+    paused = num_rows >= GC_PAUSE_MIN_ROWS and gc.isenabled()
+    if paused:
+        gc.disable()
+    try:
+        yield
+    finally:
+        if paused:
+            gc.enable()
+
+
+@functools.lru_cache(maxsize=None)
+def _list_adapter(model: type[BaseModel]) -> Any:
+    # imported here, since building an adapter's schema is only needed on first use.
+    from pydantic import TypeAdapter
+
+    return TypeAdapter(list[model])
+
+
+class _TrustedBuilder:
+    """Builds a model from a row without validating it."""
+
+    __slots__ = ("_model", "_fields", "_defaults", "_private")
+
+    def __init__(self, model: type[BaseModel]):
+        self._model = model
+        self._fields = frozenset(model.model_fields)
+        # fields with a default that's safe to share between models.
+        self._defaults = {
+            name: field.default
+            for name, field in model.model_fields.items()
+            if not field.is_required() and field.default_factory is None
+        }
+        self._private = {name: attr.get_default() for name, attr in model.__private_attributes__.items()}
+
+    def __call__(self, row: dict[str, Any]) -> BaseModel:
+        fields_set = set(row)
+        if fields_set != self._fields:
+            fields_set &= self._fields
+            row = {**self._defaults, **{name: row[name] for name in fields_set}}
+        model = _new_object(self._model)
+        _set_attr(model, "__dict__", row)
+        _set_attr(model, "__pydantic_fields_set__", fields_set)
+        _set_attr(model, "__pydantic_extra__", None)
+        _set_attr(model, "__pydantic_private__", dict(self._private) if self._private else None)
+        return model
+
+
+@functools.lru_cache(maxsize=None)
+def _trusted_builder(model: type[BaseModel]) -> _TrustedBuilder:
+    return _TrustedBuilder(model)
+
+
+def _row_builder(model: type[M], mode: str) -> Callable[[dict[str, Any]], M]:
+    return _trusted_builder(model) if mode == "trusted" else model.model_validate
+
+
+class LazyModels(Sequence[M], Generic[M]):
+    """A read-only list of models, each built from its row on first access.
+
+    Safe to share between threads: two threads reading the same row at
+    once may both build it, and one of the models is kept.
+    """
+
+    __slots__ = ("_rows", "_build", "_models")
+
+    def __init__(self, rows: list[dict[str, Any]], build: Callable[[dict[str, Any]], M]):
+        self._rows = rows
+        self._build = build
+        self._models: list[Optional[M]] = [None] * len(rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __getitem__(self, idx: int | slice) -> M | list[M]:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self._rows)))]
+        model = self._models[idx]
+        if model is None:
+            model = self._models[idx] = self._build(self._rows[idx])
+        return model
+
+    def __iter__(self) -> Iterator[M]:
+        for idx in range(len(self._rows)):
+            yield self[idx]
+
+    def num_hydrated(self) -> int:
+        """Get the number of rows built into models so far."""
+        return sum(model is not None for model in self._models)
+
+    def __repr__(self) -> str:
+        return f"<LazyModels: {self.num_hydrated()}/{len(self)} hydrated>"
+
+
+def hydrate(
+    model: type[M], rows: list[dict[str, Any]], mode: Optional[str] = None, lazy: bool = False
+) -> list[M] | LazyModels[M]:
+    """Build models from database rows.
+
+    Args:
+        model: The model, e.g. Update
+        rows: The rows, e.g. the `.data` of a storage response
+        mode: "validate" or "trusted", the hydration mode by default
+        lazy: Build each model on first access, see `LazyModels`
+
+    Returns:
+        The models, in the order of the rows: a list, or a LazyModels if lazy.
+
+    Raises:
+        pydantic.ValidationError: In "validate" mode, if a row isn't valid.
+    """
+    mode = get_hydration_mode() if mode is None else _check_mode(mode)
+    if lazy:
+        return LazyModels(rows, _row_builder(model, mode))
+    with _gc_paused(len(rows)):
+        if mode == "trusted":
+            return list(map(_trusted_builder(model), rows))
+        return _list_adapter(model).validate_python(rows)
+
+
+def hydrate_one(model: type[M], row: dict[str, Any], mode: Optional[str] = None) -> M:
+    """Build a model from a database row. See `hydrate`."""
+    mode = get_hydration_mode() if mode is None else _check_mode(mode)
+    return _row_builder(model, mode)(row)
@@ -1,44 +1,187 @@
 """Manages actual logic for inserting records into the Supabase database."""
 
-from typing import Literal
+import time
+from typing import Literal, Optional
 
-from db.create_new_records import user_adds_new_arxiv_paper
-from db.models import Paper, Update, UserPaperRecord, User
-from db.supabase_db import supabase_client
+from api.arxiv_fetch_api import ArxivUnavailableError
+from api.arxiv_ids import normalize_arxiv_id
+from db.create_new_records import (
+    build_update,
+    fetch_new_arxiv_paper,
+    users_add_new_arxiv_papers,
+)
+from db.fetch_records import get_paper_ids_by_source_ids
+from db.hydration import hydrate, hydrate_one
+from db.models import Paper, PaperAIAnalysis, Update, UserPaperRecord, User
+from db.record_cache import get_record_cache
+from db.storage_backends import storage_client
 from lib.logger import get_logger
+from lib.metrics import traced
+from lib.single_flight import SingleFlight
+from lib.write_behind import WriteBehindBuffer
 
 logger = get_logger(__name__)
 
+# max number of rows to send in a single bulk upsert.
+DEFAULT_UPSERT_BATCH_SIZE = 500
+# buffered reading progress is written once this many (paper, user) pairs are
+# pending, or the oldest has waited this long.
+PROGRESS_FLUSH_SIZE = 500
+PROGRESS_FLUSH_INTERVAL_SECONDS = 2.0
+
+
+def _batched(rows: list, batch_size: int):
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+
+def _bulk_upsert(
+    table: str, rows: list[dict], on_conflict: str, batch_size: int
+) -> list[dict]:
+    """Upsert rows into a table, one request per `batch_size` rows."""
+    returned_rows = []
+    for batch in _batched(rows, batch_size):
+        response = (
+            storage_client.table(table)
+            .upsert(batch, on_conflict=on_conflict)
+            .execute()
+        )
+        returned_rows.extend(response.data)
+    return returned_rows
+
+
+# coalesces concurrent fetch-and-inserts of the same paper, e.g. when a paper
+# is trending and many users add it at once.
+_paper_flights = SingleFlight()
+
+
+def get_paper_single_flight() -> SingleFlight:
+    """Get the single-flight group for paper inserts, e.g. for its stats()."""
+    return _paper_flights
+
+
+def _after_paper_written(paper: Paper) -> None:
+    """Keep the record cache, search index and similar papers up to date with a written paper."""
+    cache = get_record_cache()
+    cache.set("papers", paper.paper_id, paper)
+    if paper.source_id is not None:
+        cache.set("paper_ids_by_source_id", (paper.source, paper.source_id), paper.paper_id)
+    # imported here since they import numpy.
+    from db.paper_search_index import index_new_paper
+    from db.similar_papers import embed_new_paper
+    index_new_paper(paper)
+    embed_new_paper(paper)
+
 
 def insert_new_paper(paper: Paper) -> int:
     """Inserts a new paper into the database."""
     paper_dict = paper.model_dump()
     paper_dict.pop("paper_id") # remove the stub paper_id, get the actual ID from the database
     response = (
-        supabase_client.table("papers")
+        storage_client.table("papers")
         .upsert(paper_dict, on_conflict="url") # for papers, the URL is unique.
         .execute()
     )
+    _after_paper_written(hydrate_one(Paper, response.data[0]))
     return response.data[0]["paper_id"]
 
 
+def insert_new_papers(
+    papers: list[Paper], batch_size: int = DEFAULT_UPSERT_BATCH_SIZE
+) -> dict[str, int]:
+    """Inserts many papers into the database, one request per `batch_size` papers.
+
+    Returns:
+        Dictionary of url -> paper_id.
+    """
+    papers_by_url: dict[str, dict] = {}
+    for paper in papers:
+        paper_dict = paper.model_dump()
+        paper_dict.pop("paper_id") # remove the stub paper_id, get the actual ID from the database
+        # a paper can only appear once per upsert.
+        papers_by_url[paper.url] = paper_dict
+    returned_papers = _bulk_upsert(
+        "papers", list(papers_by_url.values()), on_conflict="url", batch_size=batch_size
+    )
+    for paper in hydrate(Paper, returned_papers):
+        _after_paper_written(paper)
+    return {row["url"]: row["paper_id"] for row in returned_papers}
+
+
 def insert_new_update(update: Update, paper_id: int) -> int:
     """Inserts a new update into the database."""
     update_dict = update.model_dump()
     update_dict.pop("update_id") # remove the stub update_id, get the actual ID from the database
     update_dict["paper_id"] = paper_id # assign the paper_id to the update
     response = (
-        supabase_client.table("updates")
+        storage_client.table("updates")
         .upsert(update_dict, on_conflict="paper_id, user_id") # so we get the ID if the record exists, we just upsert.
         .execute()
     )
+    get_record_cache().set("reading_statuses", (paper_id, update.user_id), update.reading_status)
     return response.data[0]["update_id"]
 
 
+def _write_progress_updates(rows: list[dict]) -> None:
+    _bulk_upsert("updates", rows, on_conflict="paper_id, user_id", batch_size=DEFAULT_UPSERT_BATCH_SIZE)
+    logger.info(f"Wrote {len(rows)} buffered reading progress updates.")
+
+
+# reading progress reports, coalesced per (paper_id, user_id).
+_progress_buffer = WriteBehindBuffer(
+    _write_progress_updates,
+    max_pending=PROGRESS_FLUSH_SIZE,
+    flush_interval_seconds=PROGRESS_FLUSH_INTERVAL_SECONDS,
+    name="reading-progress",
+)
+
+
+def get_progress_write_buffer() -> WriteBehindBuffer:
+    """Get the write-behind buffer for reading progress, e.g. for its stats() or to flush() it."""
+    return _progress_buffer
+
+
+def user_updates_reading_progress(
+    user_id: int,
+    paper_id: int,
+    reading_status: Literal["want to read", "reading", "finished reading", "skipped", "archived"],
+    reading_progress: float,
+) -> Optional[int]:
+    """User reports their reading status and progress on a paper in their library.
+
+    The reader reports progress often (e.g. as the user scrolls), so reports
+    that only change the progress are buffered: later reports for the same
+    paper replace earlier ones, and the latest ones are upserted in batches
+    (see `get_progress_write_buffer`). A change of reading status (or a
+    status this process hasn't seen for the paper) is written immediately.
+
+    Returns:
+        The update_id if the update was written immediately, None if it was buffered.
+    """
+    key = (paper_id, user_id)
+    update = build_update(
+        user_id=user_id,
+        reading_status=reading_status,
+        reading_progress=reading_progress,
+        paper_id=paper_id,
+        message="User updated their reading progress.",
+    )
+    if get_record_cache().get("reading_statuses", key) == reading_status:
+        update_dict = update.model_dump()
+        update_dict.pop("update_id") # remove the stub update_id, get the actual ID from the database
+        _progress_buffer.put(key, update_dict)
+        return None
+    logger.info(
+        f"User {user_id} changed their reading status for paper {paper_id} to {reading_status}.",
+        extra={"user_id": user_id, "paper_id": paper_id},
+    )
+    return _progress_buffer.write_through(key, lambda: insert_new_update(update, paper_id))
+
+
 def insert_new_user_paper_record(user_paper_record: UserPaperRecord) -> dict[str, int]:
     """Inserts a new user paper record into the database."""
     response = (
-        supabase_client.table("user_paper_records")
+        storage_client.table("user_paper_records")
         .upsert(user_paper_record.model_dump(), on_conflict="user_id, paper_id")
         .execute()
     )
@@ -46,10 +189,119 @@ def insert_new_user_paper_record(user_paper_record: UserPaperRecord) -> dict[str
         "user_id": response.data[0]["user_id"],
         "paper_id": response.data[0]["paper_id"],
     }
-    logger.info(f"Inserted new user paper record into the database.")
+    get_record_cache().invalidate("user_paper_ids", res["user_id"])
+    logger.info(f"Inserted new user paper record into the database.", extra=res)
     return res
 
 
+def insert_paper_ai_analyses(
+    analyses: list[PaperAIAnalysis], batch_size: int = DEFAULT_UPSERT_BATCH_SIZE
+) -> list[PaperAIAnalysis]:
+    """Inserts analyses into the database, one request per `batch_size` analyses.
+
+    Analyses are keyed by content_hash, so inserting one that already exists
+    (e.g. computed by another process at the same time) keeps a single row.
+
+    Returns:
+        The stored analyses.
+    """
+    rows = [analysis.model_dump() for analysis in analyses]
+    returned_rows = _bulk_upsert("paper_ai_analyses", rows, on_conflict="content_hash", batch_size=batch_size)
+    cache = get_record_cache()
+    stored = []
+    for analysis in hydrate(PaperAIAnalysis, returned_rows):
+        cache.set("paper_ai_analyses", analysis.content_hash, analysis)
+        stored.append(analysis)
+    logger.info(f"Inserted {len(stored)} paper analyses into the database.")
+    return stored
+
+
+# whether storage has the add_paper_for_user function (db/sql/add_paper_for_user.sql),
+# set to False the first time it doesn't.
+_add_paper_rpc_supported = True
+# PostgREST's and Postgres's error codes for a function that doesn't exist.
+_missing_function_codes = {"PGRST202", "42883"}
+
+
+def _insert_paper_for_user_in_steps(
+    user_id: int, update: Update, paper_id: Optional[int], paper: Optional[Paper]
+) -> dict[str, int]:
+    if paper_id is None:
+        paper_id = insert_new_paper(paper)
+    update_id = insert_new_update(update, paper_id)
+    insert_new_user_paper_record(UserPaperRecord(user_id=user_id, paper_id=paper_id))
+    return {"paper_id": paper_id, "update_id": update_id}
+
+
+def insert_paper_for_user(
+    user_id: int,
+    update: Update,
+    paper_id: Optional[int] = None,
+    paper: Optional[Paper] = None,
+) -> dict[str, int]:
+    """Adds a paper to a user's library, with their update for it, in one round trip.
+
+    The paper (unless `paper_id` is given), the update and the user paper
+    record are upserted in one transaction by the add_paper_for_user
+    database function (db/sql/add_paper_for_user.sql). If storage doesn't
+    have the function, they're upserted with one request each, as before,
+    which isn't atomic.
+
+    Args:
+        user_id: The user adding the paper
+        update: The user's update for the paper
+        paper_id: The paper, if it's already in the database
+        paper: The paper to insert otherwise
+
+    Returns:
+        Dictionary with "paper_id" and "update_id".
+    """
+    global _add_paper_rpc_supported
+    if (paper_id is None) == (paper is None):
+        raise ValueError("Pass either paper_id or paper.")
+    if not _add_paper_rpc_supported:
+        return _insert_paper_for_user_in_steps(user_id, update, paper_id, paper)
+
+    params = {
+        "p_user_id": user_id,
+        "p_update": update.model_dump(include={"message", "reading_status", "reading_progress", "created_at"}),
+        "p_paper_id": paper_id,
+        "p_paper": None,
+    }
+    if paper is not None:
+        params["p_paper"] = paper.model_dump(exclude={"paper_id"}) # get the actual ID from the database
+    try:
+        # every write is an upsert, so a call that failed midway can be retried.
+        result = storage_client.rpc("add_paper_for_user", params, idempotent=True).execute().data
+    except Exception as e:
+        if not isinstance(e, NotImplementedError) and getattr(e, "code", None) not in _missing_function_codes:
+            raise
+        _add_paper_rpc_supported = False
+        logger.warning(f"Storage can't run add_paper_for_user, inserting papers for users in steps: {e}")
+        return _insert_paper_for_user_in_steps(user_id, update, paper_id, paper)
+
+    if result["paper"] is not None:
+        _after_paper_written(hydrate_one(Paper, result["paper"]))
+    cache = get_record_cache()
+    cache.set("reading_statuses", (result["paper_id"], user_id), update.reading_status)
+    cache.invalidate("user_paper_ids", user_id)
+    return {"paper_id": result["paper_id"], "update_id": result["update_id"]}
+
+
+def _fetch_and_add_arxiv_paper(url: str, arxiv_id: str, user_id: int, update: Update, added: dict) -> int:
+    """Fetch a paper that isn't in the catalog, and add it to the user's
+    library in the same round trip as inserting it, filling in `added`."""
+    # a flight for this paper may have finished since the caller looked it up.
+    paper_id = get_record_cache().get("paper_ids_by_source_id", ("arxiv", arxiv_id))
+    if paper_id is not None:
+        return paper_id
+    paper = fetch_new_arxiv_paper(url)
+    logger.info(f"Fetched new paper from arxiv: {paper.title}")
+    added.update(insert_paper_for_user(user_id, update, paper=paper))
+    return added["paper_id"]
+
+
+@traced()
 def user_inserts_new_paper(
     user_id: int,
     url: str,
@@ -60,49 +312,212 @@ def user_inserts_new_paper(
     """User inserts a new paper into their library.
     
     Steps:
-    1. Add the paper to the database.
-    2. Add the Update record to the database.
-    3. Add the UserPaperRecord to the User's personal library.
+    1. Look the paper up in the catalog by its canonical ID. If it's not
+       there, fetch it. Concurrent calls for the same paper share one fetch
+       and insert.
+    2. Add the paper (if it's new), the Update record and the
+       UserPaperRecord to the database, in one round trip and one
+       transaction (see `insert_paper_for_user`).
     """
-    # Create record for ArXiV paper and Update record.
-    if source == "arxiv":
-        res = user_adds_new_arxiv_paper(
-            user_id=user_id,
-            arxiv_url=url,
-            reading_status=reading_status,
-            reading_progress=reading_progress,
-        )
-    else:
+    start = time.perf_counter()
+    if source != "arxiv":
         raise ValueError(f"Invalid source: {source}")
-    paper: Paper = res["paper"]
-    update: Update = res["update"]
-    logger.info(f"Fetched new paper from {source}: {paper.title}")
-    logger.info(f"Fetched new update for user {user_id}.")
-
-    # insert the records into the database.
-    paper_id = insert_new_paper(paper)
-    update_id = insert_new_update(update, paper_id)
+    arxiv_id = normalize_arxiv_id(url)
+    if arxiv_id is None:
+        raise ValueError(f"Invalid arXiv URL: {url}")
 
-    # add to user's library.
-    user_paper_record = UserPaperRecord(
-        user_id=user_id, paper_id=paper_id
+    update = build_update(
+        user_id=user_id,
+        reading_status=reading_status,
+        reading_progress=reading_progress,
     )
-    insert_new_user_paper_record(user_paper_record)
+    # set if this call inserted the paper, along with the update and user paper record.
+    added: dict[str, int] = {}
+    paper_id = get_paper_ids_by_source_ids(source, [arxiv_id]).get(arxiv_id)
+    if paper_id is not None:
+        logger.info(f"Paper {arxiv_id} is already in the catalog.", extra={"paper_id": paper_id})
+    else:
+        # concurrent adds of the same paper share one fetch and one insert.
+        paper_id = _paper_flights.do(
+            (source, arxiv_id), lambda: _fetch_and_add_arxiv_paper(url, arxiv_id, user_id, update, added)
+        )
+
+    if added:
+        update_id = added["update_id"]
+    else:
+        # add to user's library, after any buffered progress for the paper.
+        update_id = _progress_buffer.write_through(
+            (paper_id, user_id), lambda: insert_paper_for_user(user_id, update, paper_id=paper_id)["update_id"]
+        )
 
-    logger.info(f"Inserted new paper and update into the database.")
+    logger.info(
+        f"Inserted new paper and update into the database.",
+        extra={
+            "user_id": user_id,
+            "paper_id": paper_id,
+            "update_id": update_id,
+            "duration_seconds": time.perf_counter() - start,
+        },
+    )
     return {
         "paper_id": paper_id,
         "update_id": update_id,
     }
 
 
+@traced()
+def users_insert_new_papers_in_bulk(
+    items: list[tuple[int, str, Literal["want to read", "reading", "finished reading", "skipped", "archived"], float]],
+    source: str = "arxiv",
+    batch_size: int = DEFAULT_UPSERT_BATCH_SIZE,
+) -> list[dict]:
+    """Users insert many papers into their libraries at once.
+
+    Same steps as `user_inserts_new_paper`, but batched: papers already in
+    the catalog are looked up together, metadata for the rest is fetched in
+    bulk, and then the new papers, updates and user paper records are each
+    upserted with one request (per `batch_size` rows), rather than one
+    request each per paper.
+
+    Args:
+        items: (user_id, url, reading_status, reading_progress) tuples.
+
+    Returns:
+        For each item, in order, a dictionary with "user_id", "url",
+        "paper_id", "update_id" and "error" (None if the item succeeded).
+    """
+    if source != "arxiv":
+        raise ValueError(f"Invalid source: {source}")
+    results = [
+        {"user_id": user_id, "url": url, "paper_id": None, "update_id": None, "error": None}
+        for user_id, url, _, _ in items
+    ]
+
+    # Papers already in the catalog only need an Update record.
+    arxiv_ids = [normalize_arxiv_id(url) for _, url, _, _ in items]
+    known_paper_ids = get_paper_ids_by_source_ids(
+        source, [arxiv_id for arxiv_id in arxiv_ids if arxiv_id is not None]
+    )
+    updates: dict[int, Update] = {}
+    new_idxs: list[int] = []
+    for idx, ((user_id, url, reading_status, reading_progress), arxiv_id) in enumerate(zip(items, arxiv_ids)):
+        if arxiv_id is None:
+            results[idx]["error"] = f"Invalid arXiv URL: {url}"
+        elif arxiv_id in known_paper_ids:
+            results[idx]["paper_id"] = known_paper_ids[arxiv_id]
+            updates[idx] = build_update(
+                user_id=user_id,
+                reading_status=reading_status,
+                reading_progress=reading_progress,
+            )
+        else:
+            new_idxs.append(idx)
+
+    num_known = len(updates)
+
+    # Create records for new ArXiV papers and Update records.
+    new_papers: dict[int, Paper] = {}
+    try:
+        new_records = users_add_new_arxiv_papers([items[idx] for idx in new_idxs])
+    except (ArxivUnavailableError, TimeoutError) as e:
+        # the papers already in the catalog can still be added.
+        new_records = [ArxivUnavailableError(f"arXiv couldn't be reached: {e}")] * len(new_idxs)
+    for idx, record in zip(new_idxs, new_records):
+        if isinstance(record, Exception):
+            results[idx]["error"] = str(record)
+        else:
+            new_papers[idx] = record["paper"]
+            updates[idx] = record["update"]
+    logger.info(
+        f"{num_known}/{len(items)} papers already in the catalog, "
+        f"fetched {len(new_papers)}/{len(new_idxs)} new papers from {source}."
+    )
+
+    # insert the new papers. The same paper can be added by many users.
+    if new_papers:
+        unique_new_papers = {paper.url: paper for paper in new_papers.values()}
+        try:
+            paper_ids_by_url = insert_new_papers(list(unique_new_papers.values()), batch_size=batch_size)
+        except Exception as e:
+            paper_ids_by_url = {}
+            for idx in new_papers:
+                results[idx]["error"] = f"Failed to insert paper: {e}"
+        for idx, paper in new_papers.items():
+            results[idx]["paper_id"] = paper_ids_by_url.get(paper.url)
+            if results[idx]["paper_id"] is None and results[idx]["error"] is None:
+                results[idx]["error"] = "Paper was not returned by the upsert."
+    succeeded = [
+        idx for idx in updates
+        if results[idx]["paper_id"] is not None and results[idx]["error"] is None
+    ]
+
+    # insert the updates. Later items win if a user adds the same paper twice.
+    updates_by_key: dict[tuple[int, int], dict] = {}
+    for idx in sorted(succeeded):
+        update_dict = updates[idx].model_dump()
+        update_dict.pop("update_id") # remove the stub update_id, get the actual ID from the database
+        update_dict["paper_id"] = results[idx]["paper_id"]
+        key = (update_dict["paper_id"], update_dict["user_id"])
+        updates_by_key.pop(key, None)
+        updates_by_key[key] = update_dict
+    try:
+        # after any buffered progress for the same papers, which it replaces.
+        returned_updates = _progress_buffer.write_through_many(
+            list(updates_by_key),
+            lambda: _bulk_upsert(
+                "updates", list(updates_by_key.values()), on_conflict="paper_id, user_id", batch_size=batch_size
+            ),
+        )
+    except Exception as e:
+        for idx in succeeded:
+            results[idx]["error"] = f"Failed to insert update: {e}"
+        return results
+    update_ids_by_key = {
+        (row["paper_id"], row["user_id"]): row["update_id"] for row in returned_updates
+    }
+    cache = get_record_cache()
+    for key, update_dict in updates_by_key.items():
+        cache.set("reading_statuses", key, update_dict["reading_status"])
+    for idx in succeeded:
+        results[idx]["update_id"] = update_ids_by_key.get(
+            (results[idx]["paper_id"], results[idx]["user_id"])
+        )
+        if results[idx]["update_id"] is None:
+            results[idx]["error"] = "Update was not returned by the upsert."
+    succeeded = [idx for idx in succeeded if results[idx]["error"] is None]
+
+    # add to users' libraries.
+    user_paper_records = {
+        (results[idx]["user_id"], results[idx]["paper_id"]): UserPaperRecord(
+            user_id=results[idx]["user_id"], paper_id=results[idx]["paper_id"]
+        ).model_dump()
+        for idx in succeeded
+    }
+    try:
+        _bulk_upsert(
+            "user_paper_records", list(user_paper_records.values()), on_conflict="user_id, paper_id", batch_size=batch_size
+        )
+    except Exception as e:
+        for idx in succeeded:
+            results[idx]["error"] = f"Failed to insert user paper record: {e}"
+        return results
+    finally:
+        for user_id, _ in user_paper_records:
+            cache.invalidate("user_paper_ids", user_id)
+
+    num_failed = sum(1 for result in results if result["error"] is not None)
+    logger.info(f"Inserted {len(items) - num_failed} papers into libraries ({num_failed} failed).")
+    return results
+
+
 def insert_new_user(user: User) -> int:
     """Inserts a new user into the database."""
     user_dict = user.model_dump()
     user_dict.pop("user_id") # remove the stub user_id, get the actual ID from the database
     response = (
-        supabase_client.table("users")
+        storage_client.table("users")
         .upsert(user_dict, on_conflict="email")
         .execute()
     )
+    get_record_cache().set("users", response.data[0]["user_id"], hydrate_one(User, response.data[0]))
     return response.data[0]["user_id"]
@@ -1,14 +1,19 @@
 """Pydantic models for the database."""
 
-from typing import Literal, Optional
+import json
+from typing import Any, Literal, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 
 class Paper(BaseModel):
     """Pydantic model for a paper.
     
     Added to base database of all papers. Shared across all users.
+
+    Source-specific metadata (e.g. ArxivPaper) is stored as native JSON in
+    `metadata`. `metadata_str` is the legacy JSON-encoded string, only set on
+    rows that haven't been migrated (see db/sql/migrate_metadata_str.sql).
     """
     paper_id: int
     title: str
@@ -16,9 +21,23 @@ class Paper(BaseModel):
     preview: str
     url: str
     source: str
+    source_id: Optional[str] = None # canonical ID in the source, e.g. the arXiv ID.
+    metadata: Optional[dict[str, Any]] = None
     metadata_str: Optional[str] = None
     created_at: str
 
+    _arxiv_metadata: Optional["ArxivPaper"] = PrivateAttr(default=None)
+
+    @property
+    def arxiv_metadata(self) -> Optional["ArxivPaper"]:
+        """The paper's ArxivPaper metadata, decoded on first access."""
+        if self._arxiv_metadata is None and self.source == "arxiv":
+            if self.metadata is not None:
+                self._arxiv_metadata = ArxivPaper.model_validate(self.metadata)
+            elif self.metadata_str is not None:
+                self._arxiv_metadata = ArxivPaper.model_validate(json.loads(self.metadata_str))
+        return self._arxiv_metadata
+
 
 class ArxivPaper(BaseModel):
     """Pydantic model for a paper from Arxiv.
@@ -86,9 +105,13 @@ class UserPaperCustomizations(BaseModel):
 class PaperAIAnalysis(BaseModel):
     """Pydantic model for AI analysis of a paper.
     
-    Not user-specific, shared across all users for a given paper.
+    Not user-specific, shared across all users for a given paper. Keyed by
+    `content_hash`, the hash of the paper content, prompt and model (see
+    db/paper_ai_analysis.py), so each is computed once.
     """
     paper_id: int
     prompt: str
     response: str
     created_at: str
+    content_hash: Optional[str] = None
+    model: Optional[str] = None
@@ -0,0 +1,248 @@
+"""AI analyses of papers, computed once and shared across users.
+
+An analysis is keyed by `analysis_key(paper, prompt, model)`, a hash of the
+paper's content (title, authors, preview), the prompt and the model. So a
+paper is analyzed once per prompt version and model, however many users add
+it, and editing a prompt or switching models makes new analyses instead of
+serving stale ones.
+
+`PaperAnalysisRunner.analyze` looks analyses up in the record cache, then in
+the database, and only runs the missing ones:
+- identical pending requests, from any thread, share one run,
+- runs are grouped into batches of prompts for the model backend
+  (`api.model_backends`), executed on a bounded worker pool,
+- each batch's results are written back in one bulk upsert.
+
+Usage:
+    set_model_backend(...)
+    runner = get_paper_analysis_runner()
+    runner.analyze(papers, summary_prompt)  # {paper_id: PaperAIAnalysis}
+"""
+import hashlib
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from api.model_backends import ModelBackend, get_model_backend
+from db.fetch_records import get_paper_ai_analyses_by_hashes, iter_catalog_papers
+from db.hydration import hydrate
+from db.insert_records_to_supabase import insert_paper_ai_analyses
+from db.models import Paper, PaperAIAnalysis
+from lib.helper import generate_current_datetime_str
+from lib.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+# bumped if the key's inputs change, so old analyses aren't reused.
+_key_version = 1
+
+# prompts are templates, filled in with the paper's title, authors and preview.
+summary_prompt = (
+    "Summarize this paper in 3 sentences for a researcher deciding whether to read it: "
+    "the problem, the approach, and the main result.\n\n"
+    "Title: {title}\nAuthors: {authors}\nAbstract: {preview}"
+)
+
+
+def analysis_key(paper: Paper, prompt: str, model: str) -> str:
+    """Get the content hash an analysis of `paper` with `prompt` and `model` is stored under."""
+    content = json.dumps(
+        {
+            "version": _key_version,
+            "title": paper.title,
+            "authors": paper.authors,
+            "preview": paper.preview,
+            "prompt": prompt,
+            "model": model,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def render_prompt(prompt: str, paper: Paper) -> str:
+    return prompt.format(title=paper.title, authors=", ".join(paper.authors), preview=paper.preview)
+
+
+class PaperAnalysisRunner:
+    """Runs missing paper analyses in batches, on a bounded worker pool."""
+
+    def __init__(
+        self,
+        backend: Optional[ModelBackend] = None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        batch_size: Optional[int] = None,
+    ):
+        """
+        Args:
+            backend: The model, or None for the process-wide one
+                (`api.model_backends.get_model_backend`)
+            max_workers: Max number of batches running at once
+            batch_size: Max prompts per model call, by default the backend's
+                `max_batch_size`
+        """
+        self._backend = backend
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="paper-analysis")
+        # content_hash -> the pending run's result.
+        self._pending: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"requested": 0, "stored": 0, "coalesced": 0, "analyzed": 0, "model_calls": 0, "failed": 0}
+
+    @property
+    def backend(self) -> ModelBackend:
+        return self._backend if self._backend is not None else get_model_backend()
+
+    def analyze(
+        self, papers: list[Paper], prompt: str, timeout: Optional[float] = None
+    ) -> dict[int, PaperAIAnalysis]:
+        """Get the analysis of each paper with a prompt, running the missing ones.
+
+        Papers with identical content share one analysis (with the paper_id
+        of the first one analyzed).
+
+        Args:
+            papers: The papers to analyze
+            prompt: Template with {title}, {authors} and {preview} fields
+            timeout: Max seconds to wait for the missing analyses
+
+        Returns:
+            Dictionary of paper_id -> PaperAIAnalysis. Raises if an analysis
+            fails, after the others have finished.
+        """
+        backend = self.backend
+        keys = {paper.paper_id: analysis_key(paper, prompt, backend.name) for paper in papers}
+        papers_by_key: dict[str, Paper] = {}
+        for paper in papers:
+            papers_by_key.setdefault(keys[paper.paper_id], paper)
+        analyses = get_paper_ai_analyses_by_hashes(list(papers_by_key))
+
+        futures: dict[str, Future] = {}
+        to_run = []
+        with self._lock:
+            self._stats["requested"] += len(papers_by_key)
+            self._stats["stored"] += len(analyses)
+            for key in papers_by_key:
+                if key in analyses:
+                    continue
+                future = self._pending.get(key)
+                if future is None:
+                    future = self._pending[key] = Future()
+                    to_run.append(key)
+                else:
+                    self._stats["coalesced"] += 1
+                futures[key] = future
+        batch_size = self.batch_size or backend.max_batch_size
+        for start in range(0, len(to_run), batch_size):
+            batch = [(key, papers_by_key[key]) for key in to_run[start:start + batch_size]]
+            self._executor.submit(self._run_batch, backend, batch, prompt)
+
+        error = None
+        for key, future in futures.items():
+            try:
+                analyses[key] = future.result(timeout=timeout)
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return {paper_id: analyses[key] for paper_id, key in keys.items()}
+
+    def _run_batch(self, backend: ModelBackend, batch: list[tuple[str, Paper]], prompt: str) -> None:
+        """Analyze a batch of papers, store the results, and resolve their futures."""
+        keys = [key for key, _ in batch]
+        try:
+            # another process (or a run that finished since) may have stored some,
+            # and storage is cheap next to a model call.
+            analyses = get_paper_ai_analyses_by_hashes(keys)
+            to_run = [(key, paper) for key, paper in batch if key not in analyses]
+            if to_run:
+                responses = backend.complete([render_prompt(prompt, paper) for _, paper in to_run])
+                if len(responses) != len(to_run):
+                    raise RuntimeError(f"Model returned {len(responses)} responses for {len(to_run)} prompts.")
+                created_at = generate_current_datetime_str()
+                stored = insert_paper_ai_analyses(
+                    [
+                        PaperAIAnalysis(
+                            paper_id=paper.paper_id,
+                            prompt=prompt,
+                            response=response,
+                            created_at=created_at,
+                            content_hash=key,
+                            model=backend.name,
+                        )
+                        for (key, paper), response in zip(to_run, responses)
+                    ]
+                )
+                analyses.update((analysis.content_hash, analysis) for analysis in stored)
+            with self._lock:
+                self._stats["model_calls"] += bool(to_run)
+                self._stats["analyzed"] += len(to_run)
+            for key in keys:
+                self._pending[key].set_result(analyses[key])
+        except Exception as e:
+            logger.error(f"Failed to analyze {len(batch)} papers: {e}")
+            with self._lock:
+                self._stats["failed"] += len(batch)
+            for key in keys:
+                if not self._pending[key].done():
+                    self._pending[key].set_exception(e)
+        finally:
+            with self._lock:
+                for key in keys:
+                    del self._pending[key]
+
+    def stats(self) -> dict[str, int]:
+        """Get counts of analyses requested, found stored, coalesced with pending ones,
+        analyzed, failed, and of model calls."""
+        with self._lock:
+            return dict(self._stats)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+def analyze_catalog(prompt: str, after_paper_id: Optional[int] = None, chunk_size: int = 500) -> int:
+    """Analyze every paper in the catalog with a prompt, e.g. from a batch job.
+
+    Papers that already have the analysis are skipped, so this can be rerun,
+    e.g. after a new prompt version.
+
+    Returns:
+        Number of papers analyzed by the model.
+    """
+    runner = get_paper_analysis_runner()
+    num_analyzed = runner.stats()["analyzed"]
+    rows = []
+    for row in iter_catalog_papers(after_paper_id=after_paper_id, columns="*"):
+        rows.append(row)
+        if len(rows) == chunk_size:
+            runner.analyze(hydrate(Paper, rows), prompt)
+            rows = []
+    if rows:
+        runner.analyze(hydrate(Paper, rows), prompt)
+    return runner.stats()["analyzed"] - num_analyzed
+
+
+_runner: Optional[PaperAnalysisRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_paper_analysis_runner() -> PaperAnalysisRunner:
+    """Get the process-wide runner, using the process-wide model backend."""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = PaperAnalysisRunner()
+    return _runner
+
+
+def set_paper_analysis_runner(runner: Optional[PaperAnalysisRunner]) -> None:
+    """Replace the process-wide runner. Pass None to create a default one on next use."""
+    global _runner
+    with _runner_lock:
+        _runner = runner
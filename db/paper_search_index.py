@@ -0,0 +1,545 @@
+"""Full-text search over the paper catalog.
+
+`PaperSearchIndex` is an in-process inverted index over each paper's title,
+authors and preview (abstract), ranked with BM25. It has two parts:
+- a base segment: for each term, its postings (document, term frequency,
+  quantized BM25 impact) in flat NumPy arrays, sorted by impact, so that a
+  query for common terms scores their highest-impact postings and can skip
+  the long tail. It's saved to disk as raw arrays and memory-mapped on load.
+- a small in-memory delta of papers added since, e.g. by `insert_new_paper`,
+  which is scored in full. `merge` folds it into the base segment.
+
+The process-wide index (`get_paper_search_index`) is loaded from
+PAPER_SEARCH_INDEX_PATH, caught up with papers inserted since it was saved,
+and kept up to date by `db.insert_records_to_supabase`.
+
+Usage:
+    index = get_paper_search_index()
+    index.search("diffusion models", limit=10)  # [(paper_id, score), ...]
+    index.search("diffu", prefix=True)  # autocomplete
+"""
+import array
+import bisect
+import heapq
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+from collections import Counter, defaultdict
+from typing import Iterable, Optional
+
+import numpy as np
+
+from db.fetch_records import iter_catalog_papers
+from db.models import Paper
+from lib import env_vars
+from lib.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+# max base postings scored per query, split between its terms. Queries whose
+# terms have fewer postings than this are exact.
+DEFAULT_MAX_POSTINGS = 100_000
+# autocomplete needs to be fast more than exact.
+DEFAULT_MAX_PREFIX_POSTINGS = 50_000
+# max terms a prefix query expands to (the most frequent ones).
+DEFAULT_MAX_PREFIX_TERMS = 10
+_MAX_TF = 2**16 - 1
+
+# term frequency weight of each field, e.g. a word in the title counts 3 times.
+field_weights = {"title": 3, "authors": 2, "preview": 1}
+
+stop_words = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the this to was we were with".split()
+)
+_token_pattern = re.compile(r"\w+")
+
+_file_magic = b"GPSEARCH"
+_file_version = 1
+# (name, dtype) of each array saved after the terms, in order.
+_array_sections = [
+    ("offsets", np.int64),
+    ("posting_docs", np.uint32),
+    ("posting_tfs", np.uint16),
+    ("posting_impacts", np.uint8),
+    ("paper_ids", np.int64),
+    ("doc_lens", np.uint32),
+]
+# arrays start at a multiple of this in the file, so they can be memory-mapped.
+_alignment = 8
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase word tokens, without stop words."""
+    return [token for token in _token_pattern.findall(text.lower()) if token not in stop_words]
+
+
+def _term_freqs(title: str, authors: list[str], preview: str) -> tuple[Counter, int]:
+    """Get a paper's weighted term frequencies, and its length in weighted terms."""
+    tokens = (
+        tokenize(title) * field_weights["title"]
+        + tokenize(" ".join(authors)) * field_weights["authors"]
+        + tokenize(preview) * field_weights["preview"]
+    )
+    return Counter(tokens), len(tokens)
+
+
+class PaperSearchIndex:
+    """BM25 inverted index over paper titles, authors and previews."""
+
+    def __init__(self, k1: float = DEFAULT_K1, b: float = DEFAULT_B):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        # base segment. Documents are numbered in paper_id order.
+        self._terms: list[str] = []
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._posting_docs = np.zeros(0, dtype=np.uint32)
+        self._posting_tfs = np.zeros(0, dtype=np.uint16)
+        # BM25's tf component, tf / (tf + norm), quantized to 1..255.
+        self._posting_impacts = np.zeros(0, dtype=np.uint8)
+        self._paper_ids = np.zeros(0, dtype=np.int64)
+        self._doc_lens = np.zeros(0, dtype=np.uint32)
+        self._norms = np.zeros(0, dtype=np.float64)
+        self._base_avg_doc_len = 1.0
+        # delta. Its documents are numbered after the base segment's.
+        self._delta_postings: dict[str, tuple[array.array, array.array]] = {}
+        self._delta_paper_ids = array.array("q")
+        self._delta_doc_lens = array.array("I")
+        self._delta_docs_by_paper_id: dict[int, int] = {}
+        self._deleted: set[int] = set()
+        self._total_len = 0
+        self._scores_by_doc = np.zeros(0, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self._paper_ids) + len(self._delta_paper_ids) - len(self._deleted)
+
+    @property
+    def max_paper_id(self) -> Optional[int]:
+        """The largest paper_id indexed, used to catch up with new papers."""
+        with self._lock:
+            paper_ids = [int(self._paper_ids[-1])] if len(self._paper_ids) else []
+            paper_ids.extend(self._delta_paper_ids)
+            return max(paper_ids) if paper_ids else None
+
+    def _avg_doc_len(self) -> float:
+        return max(self._total_len / len(self), 1.0) if len(self) else 1.0
+
+    def _find_doc(self, paper_id: int) -> Optional[int]:
+        doc = self._delta_docs_by_paper_id.get(paper_id)
+        if doc is None:
+            idx = int(np.searchsorted(self._paper_ids, paper_id))
+            if idx < len(self._paper_ids) and self._paper_ids[idx] == paper_id:
+                doc = idx
+        return doc if doc is not None and doc not in self._deleted else None
+
+    def _doc_len(self, doc: int) -> int:
+        num_base_docs = len(self._paper_ids)
+        return int(self._doc_lens[doc] if doc < num_base_docs else self._delta_doc_lens[doc - num_base_docs])
+
+    def add(self, paper_id: int, title: str, authors: list[str], preview: str) -> None:
+        """Index a paper, replacing it if it's already indexed."""
+        term_freqs, doc_len = _term_freqs(title, authors, preview)
+        with self._lock:
+            self.remove(paper_id)
+            doc = len(self._paper_ids) + len(self._delta_paper_ids)
+            self._delta_paper_ids.append(paper_id)
+            self._delta_doc_lens.append(doc_len)
+            self._delta_docs_by_paper_id[paper_id] = doc
+            self._total_len += doc_len
+            delta_postings = self._delta_postings
+            for term, tf in term_freqs.items():
+                postings = delta_postings.get(term)
+                if postings is None:
+                    postings = delta_postings[term] = (array.array("I"), array.array("H"))
+                postings[0].append(doc)
+                postings[1].append(tf if tf <= _MAX_TF else _MAX_TF)
+
+    def add_paper(self, paper: Paper) -> None:
+        self.add(paper.paper_id, paper.title, paper.authors, paper.preview)
+
+    def remove(self, paper_id: int) -> None:
+        """Remove a paper from the index, if it's indexed."""
+        with self._lock:
+            doc = self._find_doc(paper_id)
+            if doc is not None:
+                self._deleted.add(doc)
+                self._total_len -= self._doc_len(doc)
+                self._delta_docs_by_paper_id.pop(paper_id, None)
+
+    def _base_range(self, term: str) -> tuple[int, int]:
+        idx = bisect.bisect_left(self._terms, term)
+        if idx < len(self._terms) and self._terms[idx] == term:
+            return int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return 0, 0
+
+    def _expand_prefix(self, prefix: str, max_terms: int) -> list[str]:
+        """Get the most frequent terms starting with `prefix`."""
+        lo = bisect.bisect_left(self._terms, prefix)
+        hi = bisect.bisect_left(self._terms, prefix + "\U0010ffff", lo)
+        doc_freqs_in_range = np.diff(self._offsets[lo:hi + 1])
+        most_frequent = np.argsort(-doc_freqs_in_range, kind="stable")[:max_terms]
+        doc_freqs = {self._terms[lo + idx]: int(doc_freqs_in_range[idx]) for idx in most_frequent}
+        for term, postings in self._delta_postings.items():
+            if term.startswith(prefix):
+                doc_freqs[term] = doc_freqs.get(term, 0) + len(postings[0])
+        return heapq.nlargest(max_terms, doc_freqs, key=doc_freqs.__getitem__)
+
+    def _delta_norms(self, docs: np.ndarray) -> np.ndarray:
+        num_base_docs = len(self._paper_ids)
+        doc_lens = np.frombuffer(self._delta_doc_lens, dtype=np.uint32)[docs - num_base_docs]
+        # the base segment's normalization, so scores are comparable.
+        avg_doc_len = self._base_avg_doc_len if num_base_docs else self._avg_doc_len()
+        return self.k1 * (1 - self.b + self.b * doc_lens / avg_doc_len)
+
+    def search(
+        self,
+        query: str,
+        limit: int = 10,
+        prefix: bool = False,
+        max_postings: Optional[int] = None,
+        max_prefix_terms: int = DEFAULT_MAX_PREFIX_TERMS,
+    ) -> list[tuple[int, float]]:
+        """Search for papers matching any of the query's terms.
+
+        Args:
+            query: Free text, e.g. "sparse attention transformers"
+            limit: Max number of results
+            prefix: Treat the last query term as a prefix, for autocomplete
+            max_postings: Max number of base postings to score (by default
+                DEFAULT_MAX_POSTINGS, or DEFAULT_MAX_PREFIX_POSTINGS for
+                prefix queries). Each term's highest-impact postings are
+                scored first, so results are exact unless the query's terms
+                have more postings than this, and close to exact otherwise.
+            max_prefix_terms: Max number of terms the prefix expands to
+
+        Returns:
+            List of (paper_id, BM25 score), best first.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        if max_postings is None:
+            max_postings = DEFAULT_MAX_PREFIX_POSTINGS if prefix else DEFAULT_MAX_POSTINGS
+        with self._lock:
+            terms = tokens[:-1] if prefix else tokens
+            if prefix:
+                terms = list(dict.fromkeys(terms + self._expand_prefix(tokens[-1], max_prefix_terms)))
+
+            num_docs = len(self)
+            term_postings = []
+            for term in terms:
+                lo, hi = self._base_range(term)
+                delta = self._delta_postings.get(term)
+                doc_freq = hi - lo + (len(delta[0]) if delta is not None else 0)
+                if doc_freq:
+                    term_postings.append((doc_freq, lo, hi, delta))
+
+            # split the budget between the terms, rarest first, so a rare term
+            # leaves what it doesn't use to the common ones.
+            term_postings.sort(key=lambda postings: postings[0])
+            # sum the scores of each document over the terms, in a buffer
+            # indexed by document (each term has a document at most once).
+            scores_by_doc = self._scores_buffer()
+            all_docs = []
+            for idx, (doc_freq, lo, hi, delta) in enumerate(term_postings):
+                idf = np.log(1 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+                budget = max_postings // (len(term_postings) - idx)
+                hi = min(hi, lo + budget)
+                max_postings -= hi - lo
+                docs = self._posting_docs[lo:hi]
+                scores_by_doc[docs] += self._posting_impacts[lo:hi] * (idf * (self.k1 + 1) / 255)
+                all_docs.append(docs)
+                # the delta is small, so score all of it.
+                if delta is not None:
+                    docs = np.frombuffer(delta[0], dtype=np.uint32)
+                    tfs = np.frombuffer(delta[1], dtype=np.uint16).astype(np.float64)
+                    scores_by_doc[docs] += idf * tfs * (self.k1 + 1) / (tfs + self._delta_norms(docs))
+                    all_docs.append(docs)
+            if not all_docs:
+                return []
+            docs = np.concatenate(all_docs) if len(all_docs) > 1 else all_docs[0]
+            scores = scores_by_doc[docs]
+            scores_by_doc[docs] = 0
+
+            if self._deleted:
+                keep = ~np.isin(docs, np.fromiter(self._deleted, dtype=np.int64))
+                docs, scores = docs[keep], scores[keep]
+            # a document is in `docs` at most once per term, so the top
+            # `limit * len(all_docs)` entries have the top `limit` documents.
+            num_candidates = limit * len(all_docs)
+            if len(docs) > num_candidates:
+                # keep ties with the last one, so ties break by paper_id.
+                threshold = np.partition(scores, len(scores) - num_candidates)[len(scores) - num_candidates]
+                keep = scores >= threshold
+                docs, scores = docs[keep], scores[keep]
+            if len(all_docs) > 1:
+                docs, first = np.unique(docs, return_index=True)
+                scores = scores[first]
+            order = np.lexsort((docs, -scores))[:limit]
+            return [(self._paper_id(int(docs[idx])), float(scores[idx])) for idx in order]
+
+    def _scores_buffer(self) -> np.ndarray:
+        """Zeroed scratch space for a search, with a score per document."""
+        num_docs = len(self._paper_ids) + len(self._delta_paper_ids)
+        if len(self._scores_by_doc) < num_docs:
+            self._scores_by_doc = np.zeros(max(num_docs, 2 * len(self._scores_by_doc)), dtype=np.float64)
+        return self._scores_by_doc
+
+    def _paper_id(self, doc: int) -> int:
+        num_base_docs = len(self._paper_ids)
+        return int(self._paper_ids[doc]) if doc < num_base_docs else self._delta_paper_ids[doc - num_base_docs]
+
+    def merge(self) -> None:
+        """Fold the delta (and removals) into the base segment."""
+        with self._lock:
+            if not self._delta_paper_ids and not self._deleted:
+                return
+            paper_ids = np.concatenate([self._paper_ids, np.frombuffer(self._delta_paper_ids, dtype=np.int64)])
+            doc_lens = np.concatenate([self._doc_lens, np.frombuffer(self._delta_doc_lens, dtype=np.uint32)])
+
+            # (term, document, tf) for every posting, base and delta. Terms
+            # only in the delta go after the base segment's.
+            terms = list(self._terms)
+            posting_terms = [np.repeat(np.arange(len(terms), dtype=np.uint32), np.diff(self._offsets))]
+            posting_docs = [self._posting_docs]
+            posting_tfs = [self._posting_tfs]
+            for term, (delta_docs, delta_tfs) in self._delta_postings.items():
+                term_id = bisect.bisect_left(self._terms, term)
+                if term_id == len(self._terms) or self._terms[term_id] != term:
+                    term_id = len(terms)
+                    terms.append(term)
+                posting_terms.append(np.full(len(delta_docs), term_id, dtype=np.uint32))
+                posting_docs.append(np.frombuffer(delta_docs, dtype=np.uint32))
+                posting_tfs.append(np.frombuffer(delta_tfs, dtype=np.uint16))
+            posting_terms = np.concatenate(posting_terms)
+            posting_docs = np.concatenate(posting_docs)
+            posting_tfs = np.concatenate(posting_tfs)
+
+            # drop removed documents.
+            if self._deleted:
+                live = np.ones(len(paper_ids), dtype=bool)
+                live[list(self._deleted)] = False
+                new_docs = np.cumsum(live) - 1
+                keep = live[posting_docs]
+                posting_terms, posting_tfs = posting_terms[keep], posting_tfs[keep]
+                posting_docs = new_docs[posting_docs[keep]]
+                paper_ids, doc_lens = paper_ids[live], doc_lens[live]
+            self._set_base(terms, posting_terms, posting_docs, posting_tfs, paper_ids, doc_lens)
+
+    def _set_base(
+        self,
+        terms: list[str],
+        posting_terms: np.ndarray,
+        posting_docs: np.ndarray,
+        posting_tfs: np.ndarray,
+        paper_ids: np.ndarray,
+        doc_lens: np.ndarray,
+    ) -> None:
+        """Replace the base segment (and clear the delta) with the given postings.
+
+        `posting_terms` and `posting_docs` index into `terms` and `paper_ids`,
+        which don't need to be sorted.
+        """
+        # number documents in paper_id order.
+        doc_order = np.argsort(paper_ids, kind="stable")
+        new_docs = np.empty(len(doc_order), dtype=np.uint32)
+        new_docs[doc_order] = np.arange(len(doc_order))
+        posting_docs = new_docs[posting_docs]
+        paper_ids, doc_lens = paper_ids[doc_order], doc_lens[doc_order]
+        avg_doc_len = max(float(doc_lens.mean()), 1.0) if len(doc_lens) else 1.0
+        norms = self.k1 * (1 - self.b + self.b * doc_lens / avg_doc_len)
+
+        # number terms in sorted order.
+        term_order = sorted(range(len(terms)), key=terms.__getitem__)
+        new_term_ids = np.empty(len(terms), dtype=np.uint32)
+        new_term_ids[term_order] = np.arange(len(terms))
+        posting_terms = new_term_ids[posting_terms]
+        terms = [terms[term_id] for term_id in term_order]
+
+        # by term, then highest impact first, then by document. (in float32,
+        # since there can be a lot of postings.)
+        tfs = posting_tfs.astype(np.float32)
+        impacts = tfs / (tfs + norms.astype(np.float32)[posting_docs])
+        del tfs
+        order = np.lexsort((posting_docs, -impacts, posting_terms))
+        impacts = np.clip(np.rint(impacts[order] * 255), 1, 255).astype(np.uint8)
+        doc_freqs = np.bincount(posting_terms, minlength=len(terms))
+        # drop terms whose postings were all removed.
+        self._terms = [term for term, doc_freq in zip(terms, doc_freqs) if doc_freq]
+        self._offsets = np.concatenate([[0], np.cumsum(doc_freqs[doc_freqs > 0])]).astype(np.int64)
+        self._posting_docs = posting_docs[order].astype(np.uint32)
+        self._posting_tfs = posting_tfs[order].astype(np.uint16)
+        self._posting_impacts = impacts
+        self._paper_ids = paper_ids.astype(np.int64)
+        self._doc_lens = doc_lens.astype(np.uint32)
+        self._norms = norms
+        self._base_avg_doc_len = avg_doc_len
+        self._total_len = int(doc_lens.sum())
+        self._deleted = set()
+        self._delta_postings = {}
+        self._delta_paper_ids = array.array("q")
+        self._delta_doc_lens = array.array("I")
+        self._delta_docs_by_paper_id = {}
+
+    @classmethod
+    def build(
+        cls,
+        papers: Iterable[tuple[int, str, list[str], str]],
+        k1: float = DEFAULT_K1,
+        b: float = DEFAULT_B,
+    ) -> "PaperSearchIndex":
+        """Build an index from (paper_id, title, authors, preview) tuples.
+
+        Much faster than `add`ing the papers one at a time. paper_ids must be
+        unique.
+        """
+        term_ids: defaultdict[str, int] = defaultdict(itertools.count().__next__)
+        paper_ids, doc_lens, num_terms = array.array("q"), array.array("I"), array.array("I")
+        posting_terms, posting_tfs = array.array("I"), array.array("I")
+        for paper_id, title, authors, preview in papers:
+            term_freqs, doc_len = _term_freqs(title, authors, preview)
+            paper_ids.append(paper_id)
+            doc_lens.append(doc_len)
+            num_terms.append(len(term_freqs))
+            posting_terms.extend(map(term_ids.__getitem__, term_freqs))
+            posting_tfs.extend(term_freqs.values())
+
+        index = cls(k1=k1, b=b)
+        num_docs = len(paper_ids)
+        index._set_base(
+            list(term_ids),
+            np.frombuffer(posting_terms, dtype=np.uint32),
+            np.repeat(np.arange(num_docs, dtype=np.uint32), np.frombuffer(num_terms, dtype=np.uint32)),
+            np.minimum(np.frombuffer(posting_tfs, dtype=np.uint32), _MAX_TF),
+            np.frombuffer(paper_ids, dtype=np.int64),
+            np.frombuffer(doc_lens, dtype=np.uint32),
+        )
+        return index
+
+    def save(self, path: str) -> None:
+        """Merge, then save the index atomically (write to a temp file, then rename).
+
+        Format: magic, a length-prefixed JSON header, the newline-separated
+        terms, then the raw arrays in `_array_sections` order, each aligned
+        to 8 bytes.
+        """
+        with self._lock:
+            self.merge()
+            terms = "\n".join(self._terms).encode("utf-8")
+            sections = [getattr(self, f"_{name}") for name, _ in _array_sections]
+            header = json.dumps(
+                {
+                    "version": _file_version,
+                    "byteorder": sys.byteorder,
+                    "k1": self.k1,
+                    "b": self.b,
+                    "num_terms": len(self._terms),
+                    "terms_size": len(terms),
+                    "section_lengths": [len(section) for section in sections],
+                }
+            ).encode("utf-8")
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(_file_magic)
+                f.write(len(header).to_bytes(4, "little"))
+                f.write(header)
+                f.write(terms)
+                for section in sections:
+                    f.write(b"\0" * (-f.tell() % _alignment))
+                    f.write(np.ascontiguousarray(section).tobytes())
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "PaperSearchIndex":
+        """Load an index saved with `save`. The postings are memory-mapped."""
+        with open(path, "rb") as f:
+            if f.read(len(_file_magic)) != _file_magic:
+                raise ValueError(f"Not a paper search index: {path}")
+            header = json.loads(f.read(int.from_bytes(f.read(4), "little")))
+            if header["version"] != _file_version:
+                raise ValueError(f"Unsupported paper search index version: {header['version']}")
+            terms = f.read(header["terms_size"]).decode("utf-8")
+            pos = f.tell()
+
+        index = cls(k1=header["k1"], b=header["b"])
+        index._terms = terms.split("\n") if header["num_terms"] else []
+        for (name, dtype), length in zip(_array_sections, header["section_lengths"]):
+            pos += -pos % _alignment
+            section = (
+                np.memmap(path, dtype=dtype, mode="r", offset=pos, shape=(length,))
+                if length
+                else np.zeros(0, dtype=dtype)
+            )
+            if header["byteorder"] != sys.byteorder:
+                section = section.byteswap()
+            setattr(index, f"_{name}", section)
+            pos += length * np.dtype(dtype).itemsize
+        index._total_len = int(index._doc_lens.sum())
+        index._base_avg_doc_len = index._avg_doc_len()
+        index._norms = index.k1 * (1 - index.b + index.b * index._doc_lens / index._base_avg_doc_len)
+        return index
+
+
+def catch_up_paper_search_index(index: PaperSearchIndex) -> int:
+    """Index papers inserted since the index was last updated.
+
+    Returns:
+        Number of papers added.
+    """
+    num_added = 0
+    for row in iter_catalog_papers(after_paper_id=index.max_paper_id):
+        index.add(row["paper_id"], row["title"], row["authors"], row["preview"])
+        num_added += 1
+    return num_added
+
+
+_search_index: Optional[PaperSearchIndex] = None
+_search_index_lock = threading.Lock()
+
+
+def get_paper_search_index() -> PaperSearchIndex:
+    """Get the process-wide index, loading or building it on first use."""
+    global _search_index
+    if _search_index is None:
+        with _search_index_lock:
+            if _search_index is None:
+                path = env_vars.PAPER_SEARCH_INDEX_PATH
+                if os.path.exists(path):
+                    index = PaperSearchIndex.load(path)
+                    num_added = catch_up_paper_search_index(index)
+                    logger.info(f"Loaded paper search index with {len(index)} papers ({num_added} new).")
+                else:
+                    index = PaperSearchIndex.build(
+                        (row["paper_id"], row["title"], row["authors"], row["preview"])
+                        for row in iter_catalog_papers()
+                    )
+                    logger.info(f"Built paper search index with {len(index)} papers.")
+                _search_index = index
+    return _search_index
+
+
+def set_paper_search_index(index: Optional[PaperSearchIndex]) -> None:
+    """Replace the process-wide index. Pass None to load it again on next use."""
+    global _search_index
+    with _search_index_lock:
+        _search_index = index
+
+
+def save_paper_search_index() -> None:
+    """Save the process-wide index to PAPER_SEARCH_INDEX_PATH."""
+    get_paper_search_index().save(env_vars.PAPER_SEARCH_INDEX_PATH)
+
+
+def index_new_paper(paper: Paper) -> None:
+    """Add a newly inserted paper to the process-wide index, if it's loaded.
+
+    If it isn't, the paper is picked up when the index is loaded.
+    """
+    if _search_index is not None:
+        _search_index.add_paper(paper)
@@ -0,0 +1,613 @@
+""""Readers also read" recommendations, from who has which papers in their library.
+
+`user_paper_records` is a user x paper graph. Each edge is weighted by the
+user's latest reading status for the paper (`reading_status_weights`, e.g. a
+finished paper counts more than one they want to read), and two papers are
+related by how many readers they share: the cosine similarity of their
+columns of the weighted user x paper matrix, shrunk towards 0 for papers with
+few readers in common.
+
+`ReadersAlsoReadBuilder` holds that matrix in CSR form (by user) and CSC form
+(by paper) and computes the top-k neighbors of papers in blocks, with NumPy
+only, so memory stays bounded by `max_pairs` however many records there are.
+It can catch up with new records incrementally. The result is saved as a
+compact table (CSR arrays of neighbors per paper), which
+`ReadersAlsoReadTable` memory-maps to serve lookups.
+
+One process builds and updates the table (e.g. a batch job running
+`python db/readers_also_read.py`, see db/README.md), the others serve it, and
+pick up new versions of the file on their next lookup. Lookups never build it.
+
+Usage:
+    table = get_readers_also_read_table()
+    table.neighbors(paper_id, k=10)  # [(paper_id, score), ...]
+    table.for_library(library_paper_ids, k=10)
+"""
+import json
+import os
+import sys
+import threading
+from typing import Iterator, Optional
+
+import numpy as np
+
+from db.storage_backends import storage_client
+from lib import env_vars
+from lib.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_K = 20
+# co-reader counts are multiplied by n / (n + shrinkage), so a pair of papers
+# that happen to share one reader don't look as related as ones sharing many.
+DEFAULT_SHRINKAGE = 2.0
+# only a user's highest-weighted papers count, so one huge library doesn't
+# make (and cost) millions of pairs.
+DEFAULT_MAX_USER_PAPERS = 1000
+# max (paper, co-read paper) pairs in memory at once while building.
+DEFAULT_MAX_PAIRS = 8_000_000
+# records loaded as Python objects at a time, before moving them to arrays.
+DEFAULT_LOAD_CHUNK_ROWS = 65_536
+
+# weight of a user's paper by its latest reading status. Skipped papers
+# aren't a sign the user liked them, so they don't count.
+reading_status_weights = {
+    "finished reading": 1.0,
+    "reading": 0.75,
+    "want to read": 0.5,
+    "added to library": 0.5,
+    "archived": 0.25,
+    "skipped": 0.0,
+}
+
+_file_magic = b"GPCOREAD"
+_file_version = 1
+# (name, dtype) of each array saved after the header, in order.
+_array_sections = [
+    ("paper_ids", np.int64),
+    ("indptr", np.int64),
+    # paper_id is an int4 column.
+    ("neighbor_ids", np.int32),
+    ("scores", np.float32),
+]
+_alignment = 8
+
+
+def _ragged_range(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Concatenate arange(start, start + length) for each start and length."""
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(int(lengths.sum()), dtype=np.int64) - np.repeat(offsets - starts, lengths)
+
+
+class _Interactions:
+    """Weighted user x paper matrix, in CSR (by user) and CSC (by paper) form.
+
+    Users and papers are numbered densely: `paper_ids[item]` is the paper_id
+    of item `item`.
+    """
+
+    def __init__(self, users: np.ndarray, papers: np.ndarray, weights: np.ndarray, max_user_papers: int):
+        """Records must be sorted by user."""
+        keep = weights > 0
+        users, papers, weights = users[keep], papers[keep], weights[keep]
+        is_first = np.concatenate([[True], users[1:] != users[:-1]]) if len(users) else np.zeros(0, dtype=bool)
+        user_idxs = np.cumsum(is_first) - 1
+        if len(users) and np.bincount(user_idxs).max() > max_user_papers:
+            # keep each user's highest-weighted papers.
+            order = np.lexsort((papers, -weights, user_idxs))
+            user_idxs, papers, weights = user_idxs[order], papers[order], weights[order]
+            keep = np.arange(len(user_idxs)) - np.searchsorted(user_idxs, user_idxs) < max_user_papers
+            user_idxs, papers, weights = user_idxs[keep], papers[keep], weights[keep]
+
+        self.paper_ids, items = np.unique(papers, return_inverse=True)
+        self.num_items = len(self.paper_ids)
+        num_users = int(user_idxs[-1]) + 1 if len(user_idxs) else 0
+
+        # already sorted by user.
+        self.user_indptr = np.concatenate([[0], np.cumsum(np.bincount(user_idxs, minlength=num_users))])
+        self.user_items = items.astype(np.int32)
+        self.user_weights = weights.astype(np.float32)
+
+        order = np.argsort(items, kind="stable")
+        self.item_indptr = np.concatenate([[0], np.cumsum(np.bincount(items, minlength=self.num_items))])
+        self.item_users = user_idxs[order].astype(np.int32)
+        self.item_weights = self.user_weights[order]
+        self.norms = np.sqrt(np.bincount(items, weights=weights.astype(np.float64) ** 2, minlength=self.num_items))
+
+        user_lens = np.diff(self.user_indptr)
+        # number of (item, co-read item) pairs each item expands to.
+        self.item_pairs = np.bincount(
+            np.repeat(np.arange(self.num_items), np.diff(self.item_indptr)),
+            weights=user_lens[self.item_users],
+            minlength=self.num_items,
+        ).astype(np.int64)
+
+    def _expand(self, items: np.ndarray, item_ranges: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get (row, co-read item, weight product) for the readers in `item_ranges` of each item."""
+        starts, lengths = item_ranges
+        idx = _ragged_range(starts, lengths)
+        rows = np.repeat(np.arange(len(items), dtype=np.int64), lengths)
+        users = self.item_users[idx]
+        user_lens = self.user_indptr[users + 1] - self.user_indptr[users]
+        jdx = _ragged_range(self.user_indptr[users], user_lens)
+        rows = np.repeat(rows, user_lens)
+        values = np.repeat(self.item_weights[idx], user_lens) * self.user_weights[jdx]
+        co_items = self.user_items[jdx].astype(np.int64)
+        keep = co_items != items[rows]
+        return rows[keep], co_items[keep], values[keep]
+
+    def _scores(
+        self,
+        items: np.ndarray,
+        rows: np.ndarray,
+        co_items: np.ndarray,
+        dots: np.ndarray,
+        counts: np.ndarray,
+        shrinkage: float,
+    ) -> np.ndarray:
+        """Shrunk cosine similarity of each (items[row], co-read item) pair."""
+        cosines = dots / (self.norms[items[rows]] * self.norms[co_items])
+        return cosines * (counts / (counts + shrinkage))
+
+    def top_k(
+        self, items: np.ndarray, k: int, shrinkage: float, max_pairs: int
+    ) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Compute the top `k` co-read items of each item, a block of items at a time.
+
+        Yields:
+            (item, co-read item, score) arrays, by item, then best first.
+        """
+        items = np.asarray(items, dtype=np.int64)
+        cum_pairs = np.cumsum(self.item_pairs[items])
+        start = 0
+        while start < len(items):
+            done = int(cum_pairs[start - 1]) if start else 0
+            end = int(np.searchsorted(cum_pairs, done + max_pairs, side="right"))
+            if end > start:
+                yield self._top_k_sparse(items[start:end], k, shrinkage)
+            else:
+                # one item with too many pairs, so accumulate it densely.
+                end = start + 1
+                yield self._top_k_dense(int(items[start]), k, shrinkage, max_pairs)
+            start = end
+
+    def _top_k_sparse(self, items: np.ndarray, k: int, shrinkage: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        starts = self.item_indptr[items]
+        rows, co_items, values = self._expand(items, (starts, self.item_indptr[items + 1] - starts))
+        if not len(rows):
+            return items[:0], co_items, values.astype(np.float64)
+        # sum the weight products of each (row, co-read item) pair.
+        keys = rows * self.num_items + co_items
+        order = np.argsort(keys)
+        keys, values = keys[order], values[order]
+        del rows, co_items, order
+        firsts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        dots = np.add.reduceat(values, firsts).astype(np.float64)
+        counts = np.diff(np.append(firsts, len(keys)))
+        keys = keys[firsts]
+        rows, co_items = keys // self.num_items, keys % self.num_items
+        scores = self._scores(items, rows, co_items, dots, counts, shrinkage)
+
+        # best `k` per row, ties broken by paper_id (co-read items are in paper_id order).
+        order = np.lexsort((co_items, -scores, rows))
+        rows, co_items, scores = rows[order], co_items[order], scores[order]
+        keep = np.arange(len(rows)) - np.searchsorted(rows, rows) < k
+        return items[rows[keep]], co_items[keep], scores[keep]
+
+    def _top_k_dense(self, item: int, k: int, shrinkage: float, max_pairs: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        dots = np.zeros(self.num_items)
+        counts = np.zeros(self.num_items)
+        items = np.array([item])
+        first, num_readers = int(self.item_indptr[item]), int(self.item_indptr[item + 1] - self.item_indptr[item])
+        cum_pairs = np.cumsum(np.diff(self.user_indptr)[self.item_users[first:first + num_readers]])
+        start = 0
+        while start < num_readers:
+            # a chunk of the item's readers with at most `max_pairs` pairs (or one reader).
+            done = int(cum_pairs[start - 1]) if start else 0
+            end = max(int(np.searchsorted(cum_pairs, done + max_pairs, side="right")), start + 1)
+            _, co_items, values = self._expand(items, (np.array([first + start]), np.array([end - start])))
+            dots += np.bincount(co_items, weights=values, minlength=self.num_items)
+            counts += np.bincount(co_items, minlength=self.num_items)
+            start = end
+        co_items = np.flatnonzero(counts)
+        rows = np.zeros(len(co_items), dtype=np.int64)
+        scores = self._scores(items, rows, co_items, dots[co_items], counts[co_items], shrinkage)
+        order = np.lexsort((co_items, -scores))[:k]
+        return np.full(len(order), item), co_items[order], scores[order]
+
+
+class ReadersAlsoReadBuilder:
+    """Builds, and incrementally updates, the readers-also-read table.
+
+    Holds every (user, paper, weight) record in memory, so run it in one
+    process, e.g. a batch job.
+    """
+
+    def __init__(
+        self,
+        k: int = DEFAULT_K,
+        shrinkage: float = DEFAULT_SHRINKAGE,
+        max_user_papers: int = DEFAULT_MAX_USER_PAPERS,
+        max_pairs: int = DEFAULT_MAX_PAIRS,
+    ):
+        self.k = k
+        self.shrinkage = shrinkage
+        self.max_user_papers = max_user_papers
+        self.max_pairs = max_pairs
+        # one entry per (user, paper), sorted by user then paper.
+        self._users = np.zeros(0, dtype=np.int64)
+        self._papers = np.zeros(0, dtype=np.int64)
+        self._weights = np.zeros(0, dtype=np.float32)
+        self._interactions: Optional[_Interactions] = None
+        # the table, as (paper, neighbor, score) entries, by paper then best first.
+        self._table_papers = np.zeros(0, dtype=np.int64)
+        self._table_neighbors = np.zeros(0, dtype=np.int64)
+        self._table_scores = np.zeros(0, dtype=np.float32)
+        # the last update seen, to catch up from.
+        self.max_update_id = 0
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def set_records(self, users: np.ndarray, papers: np.ndarray, weights: np.ndarray) -> None:
+        """Replace all the records (one per user and paper) and rebuild the table."""
+        self._users, self._papers, self._weights = self._dedupe(
+            np.asarray(users, dtype=np.int64), np.asarray(papers, dtype=np.int64), np.asarray(weights, dtype=np.float32)
+        )
+        self._interactions = None
+        self._table_papers, self._table_neighbors, self._table_scores = self._compute(None)
+
+    def add_records(self, users: np.ndarray, papers: np.ndarray, weights: np.ndarray) -> int:
+        """Add or replace records, and recompute the neighbors of the affected papers.
+
+        A record changes the co-reader counts of its paper and the other
+        papers in the user's library, so their neighbors are recomputed.
+        Other papers' scores for them drift slightly (by the change in their
+        norms) until the next full build.
+
+        Returns:
+            Number of papers whose neighbors were recomputed.
+        """
+        users, papers, weights = self._dedupe(
+            np.asarray(users, dtype=np.int64), np.asarray(papers, dtype=np.int64), np.asarray(weights, dtype=np.float32)
+        )
+        if not len(users):
+            return 0
+        # merge them into the sorted records, without sorting them again.
+        keys = self._users << 32 | self._papers
+        new_keys = users << 32 | papers
+        positions = np.searchsorted(keys, new_keys)
+        exists = positions < len(keys)
+        exists[exists] = keys[positions[exists]] == new_keys[exists]
+        self._weights[positions[exists]] = weights[exists]
+        is_new = ~exists
+        self._users = np.insert(self._users, positions[is_new], users[is_new])
+        self._papers = np.insert(self._papers, positions[is_new], papers[is_new])
+        self._weights = np.insert(self._weights, positions[is_new], weights[is_new])
+        self._interactions = None
+
+        user_ids = np.unique(users)
+        starts = np.searchsorted(self._users, user_ids)
+        ends = np.searchsorted(self._users, user_ids, side="right")
+        library_papers = self._papers[_ragged_range(starts, ends - starts)]
+        affected = np.unique(np.concatenate([papers, library_papers]))
+        new_papers, new_neighbors, new_scores = self._compute(affected)
+        keep = ~np.isin(self._table_papers, affected)
+        table_papers = np.concatenate([self._table_papers[keep], new_papers])
+        order = np.argsort(table_papers, kind="stable")
+        self._table_papers = table_papers[order]
+        self._table_neighbors = np.concatenate([self._table_neighbors[keep], new_neighbors])[order]
+        self._table_scores = np.concatenate([self._table_scores[keep], new_scores])[order]
+        return len(affected)
+
+    @staticmethod
+    def _dedupe(users: np.ndarray, papers: np.ndarray, weights: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Keep the last record of each (user, paper), sorted by user then paper."""
+        if not len(users):
+            return users, papers, weights
+        # reversed, so the (stable) sort puts the last record of each first.
+        order = np.lexsort((papers[::-1], users[::-1]))
+        users, papers, weights = users[::-1][order], papers[::-1][order], weights[::-1][order]
+        first = np.concatenate([[True], (users[1:] != users[:-1]) | (papers[1:] != papers[:-1])])
+        return users[first], papers[first], weights[first]
+
+    def _compute(self, paper_ids: Optional[np.ndarray]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Compute the neighbors of `paper_ids` (None for all papers), as table entries."""
+        if self._interactions is None:
+            self._interactions = _Interactions(self._users, self._papers, self._weights, self.max_user_papers)
+        interactions = self._interactions
+        if paper_ids is None:
+            items = np.arange(interactions.num_items)
+        else:
+            idxs = np.searchsorted(interactions.paper_ids, paper_ids)
+            idxs = np.minimum(idxs, max(interactions.num_items - 1, 0))
+            items = idxs[interactions.paper_ids[idxs] == paper_ids] if interactions.num_items else idxs[:0]
+        blocks = list(interactions.top_k(items, self.k, self.shrinkage, self.max_pairs))
+        if not blocks:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows, co_items, scores = (np.concatenate(arrays) for arrays in zip(*blocks))
+        return interactions.paper_ids[rows], interactions.paper_ids[co_items], scores.astype(np.float32)
+
+    def neighbors(self, paper_id: int) -> list[tuple[int, float]]:
+        lo, hi = np.searchsorted(self._table_papers, [paper_id, paper_id + 1])
+        return list(zip(self._table_neighbors[lo:hi].tolist(), self._table_scores[lo:hi].astype(np.float64).tolist()))
+
+    def save(self, path: str) -> None:
+        """Save the table atomically (write to a temp file, then rename)."""
+        paper_ids, counts = np.unique(self._table_papers, return_counts=True)
+        sections = {
+            "paper_ids": paper_ids,
+            "indptr": np.concatenate([[0], np.cumsum(counts)]),
+            "neighbor_ids": self._table_neighbors,
+            "scores": self._table_scores,
+        }
+        header = json.dumps(
+            {
+                "version": _file_version,
+                "byteorder": sys.byteorder,
+                "k": self.k,
+                "max_update_id": self.max_update_id,
+                "section_lengths": [len(sections[name]) for name, _ in _array_sections],
+            }
+        ).encode("utf-8")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_file_magic)
+            f.write(len(header).to_bytes(4, "little"))
+            f.write(header)
+            for name, dtype in _array_sections:
+                f.write(b"\0" * (-f.tell() % _alignment))
+                f.write(np.ascontiguousarray(sections[name], dtype=dtype).tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_storage(cls, **kwargs) -> "ReadersAlsoReadBuilder":
+        """Build from every record in the database."""
+        builder = cls(**kwargs)
+        users, papers, weights, builder.max_update_id = load_weighted_records()
+        builder.set_records(users, papers, weights)
+        logger.info(f"Built readers-also-read table from {len(builder)} records.")
+        return builder
+
+    def catch_up(self) -> int:
+        """Add the updates made since the last one seen.
+
+        Papers are added to libraries with an update (see
+        `user_inserts_new_paper`), so new updates cover new records. An
+        update upserted in place keeps its update_id, so status changes are
+        picked up by the next full build.
+
+        Returns:
+            Number of updates added.
+        """
+        users, papers, statuses = [], [], []
+        for row in iter_table_rows("updates", "update_id, user_id, paper_id, reading_status", "update_id", self.max_update_id):
+            users.append(row["user_id"])
+            papers.append(row["paper_id"])
+            statuses.append(row["reading_status"])
+            self.max_update_id = row["update_id"]
+        self.add_records(np.array(users), np.array(papers), np.array([reading_status_weights.get(s, 0.0) for s in statuses]))
+        return len(users)
+
+
+def iter_table_rows(table: str, columns: str, key: str, after: Optional[int] = None, page_size: int = 10_000) -> Iterator[dict]:
+    """Iterate over a table's rows in order of an integer key column, a page at a time."""
+    while True:
+        query = storage_client.table(table).select(columns)
+        if after is not None:
+            query = query.gt(key, after)
+        rows = query.order(key).limit(page_size).execute().data
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = rows[-1][key]
+
+
+def iter_rows_by_user_and_paper(table: str, columns: str, page_size: int = 10_000) -> Iterator[dict]:
+    """Iterate over a table's rows by user_id then paper_id, a page at a time."""
+    last_user_id = None
+    while True:
+        query = storage_client.table(table).select(columns)
+        if last_user_id is not None:
+            query = query.gt("user_id", last_user_id)
+        rows = query.order("user_id").order("paper_id").limit(page_size).execute().data
+        if len(rows) < page_size:
+            yield from rows
+            return
+        # the page may end partway through a user's rows, so finish that
+        # user separately.
+        last_user_id = rows[-1]["user_id"]
+        yield from (row for row in rows if row["user_id"] != last_user_id)
+        last_paper_id = None
+        while True:
+            query = storage_client.table(table).select(columns).eq("user_id", last_user_id)
+            if last_paper_id is not None:
+                query = query.gt("paper_id", last_paper_id)
+            user_rows = query.order("paper_id").limit(page_size).execute().data
+            yield from user_rows
+            if len(user_rows) < page_size:
+                break
+            last_paper_id = user_rows[-1]["paper_id"]
+
+
+def iter_user_paper_records(page_size: int = 10_000) -> Iterator[dict]:
+    """Iterate over user_paper_records, by user_id then paper_id, a page at a time."""
+    return iter_rows_by_user_and_paper("user_paper_records", "user_id, paper_id", page_size)
+
+
+def _get_max_update_id() -> int:
+    rows = storage_client.table("updates").select("update_id").order("update_id", desc=True).limit(1).execute().data
+    return rows[0]["update_id"] if rows else 0
+
+
+def load_weighted_records(chunk_rows: int = DEFAULT_LOAD_CHUNK_ROWS) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """Load every user_paper_record, weighted by the user's latest reading status for the paper.
+
+    Records without an update count as "added to library". The records and
+    the `latest_updates` view are both read by (user_id, paper_id) and
+    merged, and the records are gathered in NumPy arrays `chunk_rows` at a
+    time, so only a chunk of them is held as Python objects.
+
+    Returns:
+        (user_ids, paper_ids, weights, max update_id) arrays.
+    """
+    # read first, so updates made while loading are caught up with later.
+    max_update_id = _get_max_update_id()
+    default_weight = reading_status_weights["added to library"]
+    statuses = iter_rows_by_user_and_paper("latest_updates", "user_id, paper_id, reading_status")
+    status_row = next(statuses, None)
+    user_chunks, paper_chunks, weight_chunks = [], [], []
+    users, papers, weights = [], [], []
+    for row in iter_user_paper_records():
+        key = (row["user_id"], row["paper_id"])
+        while status_row is not None and (status_row["user_id"], status_row["paper_id"]) < key:
+            status_row = next(statuses, None)
+        if status_row is not None and (status_row["user_id"], status_row["paper_id"]) == key:
+            weights.append(reading_status_weights.get(status_row["reading_status"], 0.0))
+        else:
+            weights.append(default_weight)
+        users.append(key[0])
+        papers.append(key[1])
+        if len(users) == chunk_rows:
+            user_chunks.append(np.array(users, dtype=np.int64))
+            paper_chunks.append(np.array(papers, dtype=np.int64))
+            weight_chunks.append(np.array(weights, dtype=np.float32))
+            users.clear()
+            papers.clear()
+            weights.clear()
+    user_chunks.append(np.array(users, dtype=np.int64))
+    paper_chunks.append(np.array(papers, dtype=np.int64))
+    weight_chunks.append(np.array(weights, dtype=np.float32))
+    return np.concatenate(user_chunks), np.concatenate(paper_chunks), np.concatenate(weight_chunks), max_update_id
+
+
+class ReadersAlsoReadTable:
+    """Memory-mapped readers-also-read table, for lookups."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._inode = None
+        self.max_update_id = 0
+        self._paper_ids = np.zeros(0, dtype=np.int64)
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._neighbor_ids = np.zeros(0, dtype=np.int32)
+        self._scores = np.zeros(0, dtype=np.float32)
+        if path is not None:
+            self._map()
+
+    def _map(self) -> None:
+        with open(self.path, "rb") as f:
+            if f.read(len(_file_magic)) != _file_magic:
+                raise ValueError(f"Not a readers-also-read table: {self.path}")
+            header = json.loads(f.read(int.from_bytes(f.read(4), "little")))
+            pos = f.tell()
+            self._inode = os.fstat(f.fileno()).st_ino
+        if header["version"] != _file_version:
+            raise ValueError(f"Unsupported readers-also-read table version: {header['version']}")
+        self.max_update_id = header["max_update_id"]
+        for (name, dtype), length in zip(_array_sections, header["section_lengths"]):
+            pos += -pos % _alignment
+            section = (
+                np.memmap(self.path, dtype=dtype, mode="r", offset=pos, shape=(length,))
+                if length
+                else np.zeros(0, dtype=dtype)
+            )
+            if header["byteorder"] != sys.byteorder:
+                section = section.byteswap()
+            setattr(self, f"_{name}", section)
+            pos += length * np.dtype(dtype).itemsize
+
+    def __len__(self) -> int:
+        return len(self._paper_ids)
+
+    def refresh(self) -> bool:
+        """Load the file again if it's been replaced. Returns whether it was."""
+        try:
+            inode = os.stat(self.path).st_ino
+        except (FileNotFoundError, TypeError):
+            return False
+        if inode == self._inode:
+            return False
+        self._map()
+        return True
+
+    def _row(self, paper_id: int) -> tuple[int, int]:
+        idx = int(np.searchsorted(self._paper_ids, paper_id))
+        if idx < len(self._paper_ids) and self._paper_ids[idx] == paper_id:
+            return int(self._indptr[idx]), int(self._indptr[idx + 1])
+        return 0, 0
+
+    def neighbors(self, paper_id: int, k: int = 10) -> list[tuple[int, float]]:
+        """Get the papers most read by readers of a paper, best first."""
+        lo, hi = self._row(paper_id)
+        hi = min(hi, lo + k)
+        return list(zip(self._neighbor_ids[lo:hi].tolist(), self._scores[lo:hi].astype(np.float64).tolist()))
+
+    def for_library(self, paper_ids: list[int], k: int = 10) -> list[tuple[int, float]]:
+        """Get the papers most read by readers of the papers in a library.
+
+        Sums each paper's scores as a neighbor of the library's papers, and
+        leaves out the library's papers.
+        """
+        library = np.asarray(paper_ids, dtype=np.int64)
+        idxs = np.searchsorted(self._paper_ids, library)
+        found = idxs < len(self._paper_ids)
+        idxs = idxs[found]
+        idxs = idxs[self._paper_ids[idxs] == library[found]]
+        if not len(idxs):
+            return []
+        starts = self._indptr[idxs]
+        entries = _ragged_range(starts, self._indptr[idxs + 1] - starts)
+        neighbor_ids, inverse = np.unique(self._neighbor_ids[entries], return_inverse=True)
+        scores = np.bincount(inverse, weights=self._scores[entries], minlength=len(neighbor_ids))
+        scores[np.isin(neighbor_ids, library)] = -np.inf
+        order = np.lexsort((neighbor_ids, -scores))[:k]
+        return [(int(neighbor_ids[idx]), float(scores[idx])) for idx in order if scores[idx] > -np.inf]
+
+
+def rebuild_readers_also_read_table(path: Optional[str] = None) -> ReadersAlsoReadBuilder:
+    """Build the table from every record in the database, and save it."""
+    builder = ReadersAlsoReadBuilder.from_storage()
+    builder.save(path or env_vars.READERS_ALSO_READ_PATH)
+    return builder
+
+
+_table: Optional[ReadersAlsoReadTable] = None
+_table_lock = threading.Lock()
+
+
+def get_readers_also_read_table() -> ReadersAlsoReadTable:
+    """Get the process-wide table, up to date with the file.
+
+    The file isn't built here, since that reads every record; build it with
+    `rebuild_readers_also_read_table`.
+
+    Raises:
+        FileNotFoundError: If the file hasn't been built yet.
+    """
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                path = env_vars.READERS_ALSO_READ_PATH
+                if not os.path.exists(path):
+                    raise FileNotFoundError(
+                        f"Readers-also-read table not built yet: {path}. "
+                        "Build it with rebuild_readers_also_read_table()."
+                    )
+                _table = ReadersAlsoReadTable(path)
+                logger.info(f"Loaded readers-also-read table with {len(_table)} papers.")
+    _table.refresh()
+    return _table
+
+
+def set_readers_also_read_table(table: Optional[ReadersAlsoReadTable]) -> None:
+    """Replace the process-wide table. Pass None to load it again on next use."""
+    global _table
+    with _table_lock:
+        _table = table
+
+
+if __name__ == "__main__":
+    rebuild_readers_also_read_table(sys.argv[1] if len(sys.argv) > 1 else None)
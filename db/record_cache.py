@@ -0,0 +1,144 @@
+"""In-process read-through cache for database records.
+
+Used by the readers in `db.fetch_records`, and kept consistent with our own
+writes by `db.insert_records_to_supabase`, which updates or invalidates the
+affected entries whenever it writes.
+
+Each table gets its own bounded LRU with its own TTL. The cache can be
+swapped out (or disabled) with `set_record_cache`.
+
+Cached records are shared between callers, so treat them as read-only.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# (ttl_seconds, max_entries) per cached table. Paper rows almost never change
+# after they're inserted, so they can live the longest.
+DEFAULT_TABLE_SETTINGS: dict[str, tuple[float, int]] = {
+    "papers": (60 * 60, 50_000),
+    # (source, source_id) -> paper_id. Never changes once a paper exists.
+    "paper_ids_by_source_id": (24 * 60 * 60, 200_000),
+    "users": (5 * 60, 10_000),
+    "user_paper_ids": (60, 10_000),
+    # (paper_id, user_id) -> latest reading status written by this process.
+    "reading_statuses": (60 * 60, 100_000),
+    # content_hash -> PaperAIAnalysis. Never changes once it exists.
+    "paper_ai_analyses": (24 * 60 * 60, 20_000),
+}
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a TTL and a max number of entries."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.stats["misses"] += 1
+                return default
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RecordCache:
+    """Per-table LRU caches for database records."""
+
+    def __init__(self, table_settings: Optional[dict[str, tuple[float, int]]] = None):
+        if table_settings is None:
+            table_settings = DEFAULT_TABLE_SETTINGS
+        self._tables = {
+            table: LRUCache(ttl_seconds=ttl_seconds, max_entries=max_entries)
+            for table, (ttl_seconds, max_entries) in table_settings.items()
+        }
+
+    def get(self, table: str, key: Hashable) -> Any:
+        """Get a cached record, or None if it isn't cached."""
+        cache = self._tables.get(table)
+        return cache.get(key) if cache is not None else None
+
+    def get_many(self, table: str, keys: list[Hashable]) -> dict[Hashable, Any]:
+        """Get the cached records for the keys that are cached."""
+        cache = self._tables.get(table)
+        if cache is None:
+            return {}
+        found = {}
+        for key in keys:
+            value = cache.get(key, _MISSING)
+            if value is not _MISSING:
+                found[key] = value
+        return found
+
+    def set(self, table: str, key: Hashable, value: Any) -> None:
+        cache = self._tables.get(table)
+        if cache is not None:
+            cache.set(key, value)
+
+    def invalidate(self, table: str, key: Hashable) -> None:
+        cache = self._tables.get(table)
+        if cache is not None:
+            cache.invalidate(key)
+
+    def clear(self) -> None:
+        for cache in self._tables.values():
+            cache.clear()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Get hit/miss/eviction/invalidation counts and size, per table."""
+        return {
+            table: {**cache.stats, "size": len(cache)}
+            for table, cache in self._tables.items()
+        }
+
+
+class NullRecordCache(RecordCache):
+    """A cache that never stores anything, i.e. caching is disabled."""
+
+    def __init__(self):
+        super().__init__(table_settings={})
+
+
+_record_cache: RecordCache = RecordCache()
+
+
+def get_record_cache() -> RecordCache:
+    return _record_cache
+
+
+def set_record_cache(cache: Optional[RecordCache]) -> None:
+    """Replace the process-wide record cache. Pass None to disable caching."""
+    global _record_cache
+    _record_cache = cache if cache is not None else NullRecordCache()
@@ -0,0 +1,621 @@
+""""More like this" recommendations over the paper catalog.
+
+Each paper is embedded as a hashed TF-IDF vector of its title, abstract
+(preview) and arXiv categories: every feature is hashed to one of `dims`
+dimensions with a random sign, weighted by sublinear term frequency times
+inverse document frequency, and the vector is L2-normalized, so the dot
+product of two vectors is their cosine similarity. Hashing means there's no
+vocabulary to keep in sync, so new papers can be appended at any time.
+
+The vectors are stored in one file as a float32 matrix, memory-mapped, and
+similar papers are found by multiplying chunks of it with the query vectors
+(exact, brute-force cosine top-k, CPU only). Worker processes that open the
+same file share the matrix through the OS page cache instead of each loading
+its own copy.
+
+One process builds and appends to the file (`sync_similar_papers_index`,
+e.g. from a batch job running `python db/similar_papers.py`), the others open
+it read-only and pick up new rows with `refresh`. Papers inserted since are
+kept in memory by the process that inserted them (`embed_new_paper`) until
+they're in the file.
+
+Usage:
+    index = get_similar_papers_index()
+    index.similar(paper_id, k=10)  # [(paper_id, cosine similarity), ...]
+    index.similar_to_each(library_paper_ids, k=10)  # {paper_id: [...], ...}
+    index.recommend_for_library(library_paper_ids, k=10)
+"""
+import array
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from db.fetch_records import iter_catalog_papers
+from db.models import Paper
+from db.paper_search_index import tokenize
+from lib import env_vars
+from lib.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_DIMS = 256
+# document frequencies are counted per hash bucket, not per feature.
+DEFAULT_NUM_BUCKETS = 2**20
+# rows of the matrix multiplied with the queries at a time.
+DEFAULT_CHUNK_ROWS = 65_536
+
+# term frequency weight of each field, e.g. a word in the title counts 2 times.
+field_weights = {"title": 2, "preview": 1, "categories": 2}
+
+_file_magic = b"GPSIMILR"
+_file_version = 1
+# the number of papers is an int64 at this offset, updated in place by appends.
+_num_papers_offset = 8
+_header_offset = 16
+# sections start at multiples of this, so the matrix rows are page-aligned.
+_alignment = 4096
+
+
+def paper_features(title: str, preview: str, categories: Optional[list[str]] = None) -> Counter:
+    """Get a paper's weighted feature frequencies, e.g. {"attention": 3, "category:cs.lg": 2}."""
+    features = (
+        tokenize(title) * field_weights["title"]
+        + tokenize(preview) * field_weights["preview"]
+        + [f"category:{category.lower()}" for category in categories or []] * field_weights["categories"]
+    )
+    return Counter(features)
+
+
+def row_categories(row: dict) -> list[str]:
+    """Get the arXiv categories of a papers row, if it has any."""
+    metadata = row.get("metadata")
+    if metadata is None and row.get("metadata_str"):
+        metadata = json.loads(row["metadata_str"])
+    return (metadata or {}).get("categories") or []
+
+
+@lru_cache(maxsize=200_000)
+def _hash_feature(feature: str, dims: int, num_buckets: int) -> tuple[int, float, int]:
+    """Get a feature's (dimension, sign, document frequency bucket)."""
+    # not hash(), since that's salted per process.
+    h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return h % dims, 1.0 if (h >> 32) & 1 else -1.0, (h >> 40) % num_buckets
+
+
+def _idf(doc_freqs: np.ndarray, num_docs: int) -> np.ndarray:
+    return np.log((1 + num_docs) / (1 + doc_freqs)) + 1
+
+
+def _section_layout(dims: int, num_buckets: int, capacity: int) -> dict[str, tuple[int, np.dtype, tuple]]:
+    """Get the (offset, dtype, shape) of each section of the file."""
+    layout = {}
+    pos = _alignment
+    for name, dtype, shape in [
+        ("doc_freqs", np.uint32, (num_buckets,)),
+        ("paper_ids", np.int64, (capacity,)),
+        ("vectors", np.float32, (capacity, dims)),
+    ]:
+        layout[name] = (pos, np.dtype(dtype), shape)
+        pos += math.prod(shape) * np.dtype(dtype).itemsize
+        pos += -pos % _alignment
+    return layout
+
+
+def _write_empty_file(path: str, dims: int, num_buckets: int, capacity: int) -> None:
+    """Write a file with room for `capacity` papers, and no papers."""
+    header = json.dumps(
+        {
+            "version": _file_version,
+            "byteorder": sys.byteorder,
+            "dims": dims,
+            "num_buckets": num_buckets,
+            "capacity": capacity,
+        }
+    ).encode("utf-8")
+    if _header_offset + 4 + len(header) > _alignment:
+        raise ValueError("Similar papers index header is too large")
+    layout = _section_layout(dims, num_buckets, capacity)
+    offset, dtype, shape = layout["vectors"]
+    size = offset + math.prod(shape) * dtype.itemsize
+    with open(path, "wb") as f:
+        f.write(_file_magic)
+        f.write((0).to_bytes(8, sys.byteorder))
+        f.write(len(header).to_bytes(4, "little"))
+        f.write(header)
+        # sparse, the sections are zero until written.
+        f.truncate(size)
+
+
+class SimilarPapersIndex:
+    """Memory-mapped matrix of paper vectors, for cosine top-k queries.
+
+    Open one with `open` (read-only, the default, or writable), or build one
+    with `build`. Only one process should have a file open writable.
+    """
+
+    def __init__(self, path: str, writable: bool = False):
+        self.path = path
+        self.writable = writable
+        self._lock = threading.RLock()
+        self._map()
+        # papers not in the file (yet), when it's read-only.
+        self._pending: dict[int, np.ndarray] = {}
+        self._pending_matrix: Optional[tuple[np.ndarray, np.ndarray]] = None
+
+    def _map(self) -> None:
+        """Memory-map the file's sections."""
+        with open(self.path, "rb") as f:
+            if f.read(len(_file_magic)) != _file_magic:
+                raise ValueError(f"Not a similar papers index: {self.path}")
+            f.seek(_header_offset)
+            header = json.loads(f.read(int.from_bytes(f.read(4), "little")))
+            self._inode = os.fstat(f.fileno()).st_ino
+        if header["version"] != _file_version:
+            raise ValueError(f"Unsupported similar papers index version: {header['version']}")
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"Similar papers index was built on a {header['byteorder']}-endian machine: {self.path}")
+        self.dims = header["dims"]
+        self.num_buckets = header["num_buckets"]
+        self.capacity = header["capacity"]
+
+        mode = "r+" if self.writable else "r"
+        self._num_papers = np.memmap(self.path, dtype=np.int64, mode=mode, offset=_num_papers_offset, shape=(1,))
+        for name, (offset, dtype, shape) in _section_layout(self.dims, self.num_buckets, self.capacity).items():
+            setattr(self, f"_{name}", np.memmap(self.path, dtype=dtype, mode=mode, offset=offset, shape=shape))
+        self._num_rows = int(self._num_papers[0])
+        self._rows_by_paper_id = dict(zip(self._paper_ids[:self._num_rows].tolist(), range(self._num_rows)))
+
+    @classmethod
+    def open(cls, path: str, writable: bool = False) -> "SimilarPapersIndex":
+        return cls(path, writable=writable)
+
+    @classmethod
+    def create(
+        cls,
+        path: str,
+        dims: int = DEFAULT_DIMS,
+        num_buckets: int = DEFAULT_NUM_BUCKETS,
+        capacity: int = 1024,
+    ) -> "SimilarPapersIndex":
+        """Create an empty index file, and open it writable."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        _write_empty_file(tmp_path, dims, num_buckets, capacity)
+        os.replace(tmp_path, path)
+        return cls(path, writable=True)
+
+    def __len__(self) -> int:
+        return self._num_rows + len(self._pending)
+
+    def __contains__(self, paper_id: int) -> bool:
+        return paper_id in self._rows_by_paper_id or paper_id in self._pending
+
+    @property
+    def max_paper_id(self) -> Optional[int]:
+        """The largest paper_id in the index, used to catch up with new papers."""
+        with self._lock:
+            paper_ids = list(self._pending)
+            if self._num_rows:
+                paper_ids.append(int(self._paper_ids[:self._num_rows].max()))
+            return max(paper_ids) if paper_ids else None
+
+    def refresh(self) -> int:
+        """Pick up papers appended to the file by another process.
+
+        Returns:
+            Number of new papers in the file.
+        """
+        with self._lock:
+            try:
+                inode = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                return 0
+            num_rows = self._num_rows
+            if inode != self._inode:
+                # the writer grew the file, which replaces it.
+                self._map()
+            else:
+                self._num_rows = int(self._num_papers[0])
+                new_paper_ids = self._paper_ids[num_rows:self._num_rows].tolist()
+                self._rows_by_paper_id.update(zip(new_paper_ids, range(num_rows, self._num_rows)))
+            if self._pending:
+                for paper_id in [paper_id for paper_id in self._pending if paper_id in self._rows_by_paper_id]:
+                    del self._pending[paper_id]
+                self._pending_matrix = None
+            return self._num_rows - num_rows
+
+    def embed(self, title: str, preview: str, categories: Optional[list[str]] = None) -> np.ndarray:
+        """Get the unit vector of a paper, with the index's document frequencies."""
+        return self._embed(paper_features(title, preview, categories), len(self))
+
+    def _embed(self, features: Counter, num_docs: int) -> np.ndarray:
+        vector = np.zeros(self.dims, dtype=np.float64)
+        if not features:
+            return vector.astype(np.float32)
+        hashes = [_hash_feature(feature, self.dims, self.num_buckets) for feature in features]
+        dims, signs, buckets = (np.array(values) for values in zip(*hashes))
+        tfs = np.fromiter(features.values(), dtype=np.float64, count=len(features))
+        weights = (1 + np.log(tfs)) * _idf(self._doc_freqs[buckets], num_docs) * signs
+        np.add.at(vector, dims, weights)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).astype(np.float32)
+
+    def append(self, paper_id: int, title: str, preview: str, categories: Optional[list[str]] = None) -> None:
+        """Add a paper, replacing its vector if it's already in the index.
+
+        Writes to the file if it's open writable, otherwise keeps the paper
+        in memory, in this process only (and leaves papers already in the
+        file as they are).
+        """
+        features = paper_features(title, preview, categories)
+        with self._lock:
+            if not self.writable:
+                if paper_id in self._rows_by_paper_id:
+                    return
+                self._pending[paper_id] = self._embed(features, len(self) + 1)
+                self._pending_matrix = None
+                return
+            row = self._rows_by_paper_id.get(paper_id)
+            if row is None:
+                # counted once per paper, even if it's replaced.
+                buckets = [_hash_feature(feature, self.dims, self.num_buckets)[2] for feature in features]
+                np.add.at(self._doc_freqs, buckets, 1)
+                self._reserve(self._num_rows + 1)
+                row = self._num_rows
+            self._vectors[row] = self._embed(features, self._num_rows + 1)
+            self._paper_ids[row] = paper_id
+            if row == self._num_rows:
+                self._rows_by_paper_id[paper_id] = row
+                self._num_rows += 1
+                # last, so readers only see rows that are fully written.
+                self._num_papers[0] = self._num_rows
+
+    def append_paper(self, paper: Paper) -> None:
+        categories = paper.arxiv_metadata.categories if paper.arxiv_metadata is not None else None
+        self.append(paper.paper_id, paper.title, paper.preview, categories)
+
+    def flush(self) -> None:
+        """Write appended papers to disk (they're visible to readers before that)."""
+        with self._lock:
+            if self.writable:
+                for section in (self._doc_freqs, self._paper_ids, self._vectors, self._num_papers):
+                    section.flush()
+
+    def _reserve(self, num_rows: int) -> None:
+        """Grow the file, if needed, so it has room for `num_rows` papers."""
+        if num_rows <= self.capacity:
+            return
+        capacity = max(num_rows, 2 * self.capacity)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        _write_empty_file(tmp_path, self.dims, self.num_buckets, capacity)
+        grown = SimilarPapersIndex(tmp_path, writable=True)
+        grown._doc_freqs[:] = self._doc_freqs
+        grown._paper_ids[:self._num_rows] = self._paper_ids[:self._num_rows]
+        for start in range(0, self._num_rows, DEFAULT_CHUNK_ROWS):
+            end = min(start + DEFAULT_CHUNK_ROWS, self._num_rows)
+            grown._vectors[start:end] = self._vectors[start:end]
+        grown._num_papers[0] = self._num_rows
+        grown.flush()
+        del grown
+        # readers that have the old file mapped keep reading it until they refresh.
+        os.replace(tmp_path, self.path)
+        self._map()
+
+    def vectors_for(self, paper_ids: list[int]) -> tuple[list[int], np.ndarray]:
+        """Get the vectors of the papers that are in the index.
+
+        Returns:
+            The paper_ids found, and their vectors as a (len, dims) matrix.
+        """
+        found, vectors = [], []
+        for paper_id in paper_ids:
+            row = self._rows_by_paper_id.get(paper_id)
+            vector = self._vectors[row] if row is not None else self._pending.get(paper_id)
+            if vector is not None:
+                found.append(paper_id)
+                vectors.append(vector)
+        if not vectors:
+            return [], np.zeros((0, self.dims), dtype=np.float32)
+        return found, np.array(vectors, dtype=np.float32)
+
+    def _chunks(self, chunk_rows: int) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """Iterate over (paper_ids, vectors) chunks of every paper in the index."""
+        num_rows = self._num_rows
+        for start in range(0, num_rows, chunk_rows):
+            end = min(start + chunk_rows, num_rows)
+            yield self._paper_ids[start:end], self._vectors[start:end]
+        if self._pending:
+            if self._pending_matrix is None:
+                self._pending_matrix = (
+                    np.fromiter(self._pending, dtype=np.int64, count=len(self._pending)),
+                    np.array(list(self._pending.values()), dtype=np.float32),
+                )
+            yield self._pending_matrix
+
+    def similar_to_vectors(
+        self,
+        queries: np.ndarray,
+        k: int = 10,
+        exclude: Optional[list[int]] = None,
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    ) -> list[list[tuple[int, float]]]:
+        """Get the top `k` papers by cosine similarity to each query vector.
+
+        Args:
+            queries: (num_queries, dims) matrix of unit vectors
+            k: Number of papers per query
+            exclude: paper_id to leave out of each query's results, e.g.
+                the query paper itself, or None
+            chunk_rows: Rows of the matrix to score at a time
+
+        Returns:
+            For each query, list of (paper_id, similarity), most similar first.
+        """
+        num_queries = len(queries)
+        if num_queries == 0 or k <= 0:
+            return [[] for _ in range(num_queries)]
+        queries_t = np.ascontiguousarray(queries, dtype=np.float32).T
+        exclude_ids = np.asarray(exclude if exclude is not None else [-1] * num_queries, dtype=np.int64)
+        # the best `k` so far, as (query, paper_id, score) entries, and the
+        # score a paper needs to beat them, per query.
+        best_queries = np.zeros(0, dtype=np.int64)
+        best_ids = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        thresholds = np.full(num_queries, -np.inf, dtype=np.float32)
+        with self._lock:
+            for chunk_ids, chunk_vectors in self._chunks(chunk_rows):
+                chunk_ids = np.asarray(chunk_ids)
+                scores = chunk_vectors @ queries_t
+                if not len(best_ids):
+                    thresholds = self._seed_thresholds(scores, chunk_ids, exclude_ids, k)
+                # only the papers that can make the top `k` (much cheaper
+                # than partitioning every column of every chunk).
+                rows, cols = np.nonzero(scores >= thresholds)
+                ids = chunk_ids[rows]
+                keep = ids != exclude_ids[cols]
+                best_queries = np.concatenate([best_queries, cols[keep]])
+                best_ids = np.concatenate([best_ids, ids[keep]])
+                best_scores = np.concatenate([best_scores, scores[rows[keep], cols[keep]]])
+
+                # keep the best `k` per query, ties broken by paper_id.
+                order = np.lexsort((best_ids, -best_scores, best_queries))
+                best_queries, best_ids, best_scores = best_queries[order], best_ids[order], best_scores[order]
+                ranks = np.arange(len(order)) - np.searchsorted(best_queries, best_queries)
+                keep = ranks < k
+                best_queries, best_ids, best_scores = best_queries[keep], best_ids[keep], best_scores[keep]
+                is_kth = ranks[keep] == k - 1
+                thresholds[best_queries[is_kth]] = best_scores[is_kth]
+
+        ends = np.searchsorted(best_queries, np.arange(num_queries + 1))
+        return [
+            list(zip(best_ids[lo:hi].tolist(), best_scores[lo:hi].astype(np.float64).tolist()))
+            for lo, hi in zip(ends[:-1], ends[1:])
+        ]
+
+    @staticmethod
+    def _seed_thresholds(
+        scores: np.ndarray, chunk_ids: np.ndarray, exclude_ids: np.ndarray, k: int, seed_rows: int = 1024
+    ) -> np.ndarray:
+        """Get a lower bound on each query's k-th best score, from the first rows of a chunk.
+
+        The k-th best of a subset of papers is never better than the k-th
+        best of all of them, so papers scoring below it can be skipped.
+        """
+        seed = scores[:max(seed_rows, k)].copy()
+        seed[chunk_ids[:len(seed), None] == exclude_ids] = -np.inf
+        if len(seed) < k:
+            return np.full(scores.shape[1], -np.inf, dtype=np.float32)
+        return np.partition(seed, len(seed) - k, axis=0)[len(seed) - k]
+
+    def similar(self, paper_id: int, k: int = 10) -> list[tuple[int, float]]:
+        """Get the `k` papers most similar to a paper, or [] if it isn't in the index."""
+        return self.similar_to_each([paper_id], k=k).get(paper_id, [])
+
+    def similar_to_each(self, paper_ids: list[int], k: int = 10) -> dict[int, list[tuple[int, float]]]:
+        """Get the `k` papers most similar to each of the papers, in one pass over the matrix.
+
+        Returns:
+            Dictionary of paper_id -> list of (paper_id, similarity), for the
+            papers that are in the index.
+        """
+        with self._lock:
+            found, queries = self.vectors_for(list(dict.fromkeys(paper_ids)))
+            return dict(zip(found, self.similar_to_vectors(queries, k=k, exclude=found)))
+
+    def recommend_for_library(
+        self, paper_ids: list[int], k: int = 10, chunk_rows: int = DEFAULT_CHUNK_ROWS
+    ) -> list[tuple[int, float]]:
+        """Get the `k` papers most similar to any paper in a library.
+
+        Each paper is scored by its similarity to the most similar paper in
+        the library, so a library with several topics gets recommendations
+        for each of them. Papers in the library are left out.
+
+        Returns:
+            List of (paper_id, similarity), most similar first.
+        """
+        with self._lock:
+            found, queries = self.vectors_for(list(dict.fromkeys(paper_ids)))
+            if not found or k <= 0:
+                return []
+            queries_t = np.ascontiguousarray(queries.T)
+            library = np.asarray(paper_ids, dtype=np.int64)
+            best_scores, best_ids = [], []
+            for chunk_ids, chunk_vectors in self._chunks(chunk_rows):
+                scores = (chunk_vectors @ queries_t).max(axis=1)
+                scores[np.isin(chunk_ids, library)] = -np.inf
+                if len(scores) > k:
+                    top = np.argpartition(-scores, k - 1)[:k]
+                    scores, chunk_ids = scores[top], chunk_ids[top]
+                best_scores.append(scores)
+                best_ids.append(np.asarray(chunk_ids))
+        scores, ids = np.concatenate(best_scores), np.concatenate(best_ids)
+        order = np.lexsort((ids, -scores))[:k]
+        return [(int(ids[idx]), float(scores[idx])) for idx in order if scores[idx] > -np.inf]
+
+    @classmethod
+    def build(
+        cls,
+        path: str,
+        papers: Iterable[tuple[int, str, str, Optional[list[str]]]],
+        dims: int = DEFAULT_DIMS,
+        num_buckets: int = DEFAULT_NUM_BUCKETS,
+    ) -> "SimilarPapersIndex":
+        """Build an index file from (paper_id, title, preview, categories) tuples.
+
+        Much faster than `append`ing the papers one at a time, and the
+        document frequencies are final before any paper is embedded. The file
+        is replaced atomically. paper_ids must be unique.
+
+        Returns:
+            The index, open writable.
+        """
+        # (paper, feature id, tf) for every feature of every paper.
+        feature_ids: dict[str, int] = {}
+        paper_ids, num_features = array.array("q"), array.array("I")
+        posting_features, posting_tfs = array.array("I"), array.array("f")
+        for paper_id, title, preview, categories in papers:
+            features = paper_features(title, preview, categories)
+            paper_ids.append(paper_id)
+            num_features.append(len(features))
+            posting_features.extend(feature_ids.setdefault(feature, len(feature_ids)) for feature in features)
+            posting_tfs.extend(features.values())
+
+        num_docs = len(paper_ids)
+        hashes = [_hash_feature(feature, dims, num_buckets) for feature in feature_ids]
+        feature_dims, feature_signs, feature_buckets = (
+            (np.array(values) for values in zip(*hashes)) if hashes else (np.zeros(0, dtype=np.int64),) * 3
+        )
+        posting_features = np.frombuffer(posting_features, dtype=np.uint32)
+        feature_doc_freqs = np.bincount(posting_features, minlength=len(feature_ids))
+        doc_freqs = np.bincount(
+            feature_buckets.astype(np.int64), weights=feature_doc_freqs, minlength=num_buckets
+        ).astype(np.uint32)
+        feature_weights = _idf(doc_freqs[feature_buckets.astype(np.int64)], num_docs) * feature_signs
+        feature_dims = feature_dims.astype(np.int64)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        _write_empty_file(tmp_path, dims, num_buckets, capacity=max(1024, num_docs + num_docs // 4))
+        index = cls(tmp_path, writable=True)
+        index._doc_freqs[:] = doc_freqs
+        index._paper_ids[:num_docs] = np.frombuffer(paper_ids, dtype=np.int64)
+
+        # embed the papers a chunk at a time, to bound memory use.
+        posting_tfs = np.frombuffer(posting_tfs, dtype=np.float32)
+        num_features = np.frombuffer(num_features, dtype=np.uint32)
+        posting_ends = np.cumsum(num_features, dtype=np.int64)
+        chunk_docs = 16_384
+        for start in range(0, num_docs, chunk_docs):
+            end = min(start + chunk_docs, num_docs)
+            lo = int(posting_ends[start - 1]) if start else 0
+            hi = int(posting_ends[end - 1])
+            features = posting_features[lo:hi]
+            docs = np.repeat(np.arange(end - start), num_features[start:end])
+            weights = (1 + np.log(posting_tfs[lo:hi])) * feature_weights[features]
+            vectors = np.bincount(
+                docs * dims + feature_dims[features], weights=weights, minlength=(end - start) * dims
+            ).reshape(end - start, dims)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            index._vectors[start:end] = vectors / np.where(norms > 0, norms, 1)
+        index._num_papers[0] = index._num_rows = num_docs
+        index.flush()
+        del index
+        os.replace(tmp_path, path)
+        return cls(path, writable=True)
+
+
+def _catalog_row_tuple(row: dict) -> tuple[int, str, str, list[str]]:
+    return row["paper_id"], row["title"], row["preview"], row_categories(row)
+
+
+_catalog_columns = "paper_id, title, preview, metadata, metadata_str"
+
+
+def sync_similar_papers_index(path: Optional[str] = None) -> int:
+    """Append papers inserted since the file was last updated to it, or build it.
+
+    Run from one process at a time, e.g. a batch job. Processes with the
+    file open read-only pick up the new papers with `refresh`.
+
+    Returns:
+        Number of papers added.
+    """
+    path = path or env_vars.SIMILAR_PAPERS_INDEX_PATH
+    if not os.path.exists(path):
+        index = SimilarPapersIndex.build(
+            path, map(_catalog_row_tuple, iter_catalog_papers(columns=_catalog_columns))
+        )
+        logger.info(f"Built similar papers index with {len(index)} papers.")
+        return len(index)
+
+    index = SimilarPapersIndex.open(path, writable=True)
+    num_added = 0
+    for row in iter_catalog_papers(after_paper_id=index.max_paper_id, columns=_catalog_columns):
+        index.append(*_catalog_row_tuple(row))
+        num_added += 1
+    index.flush()
+    logger.info(f"Appended {num_added} papers to the similar papers index.")
+    return num_added
+
+
+_similar_papers_index: Optional[SimilarPapersIndex] = None
+_similar_papers_index_lock = threading.Lock()
+
+
+def get_similar_papers_index() -> SimilarPapersIndex:
+    """Get the process-wide index, opened read-only, and up to date with the file.
+
+    On first use, papers inserted since the file was last synced are embedded
+    in memory. The file isn't built here, since that reads the whole catalog;
+    build it with `sync_similar_papers_index`.
+
+    Raises:
+        FileNotFoundError: If the file hasn't been built yet.
+    """
+    global _similar_papers_index
+    if _similar_papers_index is None:
+        with _similar_papers_index_lock:
+            if _similar_papers_index is None:
+                path = env_vars.SIMILAR_PAPERS_INDEX_PATH
+                if not os.path.exists(path):
+                    raise FileNotFoundError(
+                        f"Similar papers index not built yet: {path}. Build it with sync_similar_papers_index()."
+                    )
+                index = SimilarPapersIndex.open(path)
+                num_pending = 0
+                for row in iter_catalog_papers(after_paper_id=index.max_paper_id, columns=_catalog_columns):
+                    index.append(*_catalog_row_tuple(row))
+                    num_pending += 1
+                logger.info(f"Opened similar papers index with {len(index)} papers ({num_pending} not synced).")
+                _similar_papers_index = index
+    _similar_papers_index.refresh()
+    return _similar_papers_index
+
+
+def set_similar_papers_index(index: Optional[SimilarPapersIndex]) -> None:
+    """Replace the process-wide index. Pass None to open it again on next use."""
+    global _similar_papers_index
+    with _similar_papers_index_lock:
+        _similar_papers_index = index
+
+
+def embed_new_paper(paper: Paper) -> None:
+    """Add a newly inserted paper to the process-wide index, if it's open.
+
+    If it isn't, the paper is picked up when the index is opened.
+    """
+    if _similar_papers_index is not None:
+        _similar_papers_index.append_paper(paper)
+
+
+if __name__ == "__main__":
+    sync_similar_papers_index(sys.argv[1] if len(sys.argv) > 1 else None)
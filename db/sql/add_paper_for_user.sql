@@ -0,0 +1,69 @@
+-- Add a paper to a user's library in one round trip and one transaction:
+-- upsert the paper (unless p_paper_id is given), the user's update for it
+-- and the user paper record, see `insert_paper_for_user` in
+-- db/insert_records_to_supabase.py. Called with
+-- storage_client.rpc("add_paper_for_user", {...}).
+--
+-- Returns {"paper_id", "update_id", "paper"}, where "paper" is the upserted
+-- row, or null if p_paper_id was given.
+create or replace function add_paper_for_user(
+    p_user_id int,
+    p_update jsonb,
+    p_paper_id int default null,
+    p_paper jsonb default null
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_paper papers;
+    v_paper_id int := p_paper_id;
+    v_update_id int;
+begin
+    if v_paper_id is null then
+        -- for papers, the URL is unique.
+        insert into papers (title, authors, preview, url, source, source_id, metadata, metadata_str, created_at)
+        select title, authors, preview, url, source, source_id, metadata, metadata_str, created_at
+        from jsonb_populate_record(null::papers, p_paper)
+        on conflict (url) do update set
+            title = excluded.title,
+            authors = excluded.authors,
+            preview = excluded.preview,
+            source = excluded.source,
+            source_id = excluded.source_id,
+            metadata = excluded.metadata,
+            metadata_str = excluded.metadata_str,
+            created_at = excluded.created_at
+        returning * into v_paper;
+        v_paper_id := v_paper.paper_id;
+    end if;
+
+    insert into updates (paper_id, user_id, message, reading_status, reading_progress, created_at)
+    values (
+        v_paper_id,
+        p_user_id,
+        p_update->>'message',
+        p_update->>'reading_status',
+        (p_update->>'reading_progress')::float,
+        p_update->>'created_at'
+    )
+    on conflict (paper_id, user_id) do update set
+        message = excluded.message,
+        reading_status = excluded.reading_status,
+        reading_progress = excluded.reading_progress,
+        created_at = excluded.created_at
+    returning update_id into v_update_id;
+
+    insert into user_paper_records (user_id, paper_id)
+    values (p_user_id, v_paper_id)
+    on conflict (user_id, paper_id) do nothing;
+
+    return jsonb_build_object(
+        'paper_id', v_paper_id,
+        'update_id', v_update_id,
+        'paper', case when p_paper_id is null then to_jsonb(v_paper) end
+    );
+end;
+$$;
+
+-- so PostgREST (Supabase's API) can call the new function right away.
+notify pgrst, 'reload schema';
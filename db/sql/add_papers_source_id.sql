@@ -0,0 +1,12 @@
+-- Key papers on their canonical ID in the source (e.g. the unversioned arXiv
+-- ID), so adding a paper that's already in the catalog doesn't fetch it again.
+alter table papers add column if not exists source_id text;
+
+-- backfill from the arXiv ID in the metadata, without the version suffix.
+update papers
+set source_id = regexp_replace(
+    coalesce(metadata->>'arxiv_id', metadata_str::jsonb->>'arxiv_id'), 'v[0-9]+$', ''
+)
+where source = 'arxiv' and source_id is null;
+
+create index if not exists idx_papers_source_source_id on papers (source, source_id);
@@ -9,3 +9,6 @@ ADD CONSTRAINT unique_user_paper UNIQUE (user_id, paper_id);
 
 ALTER TABLE users
 ADD CONSTRAINT unique_user_email UNIQUE (email);
+
+ALTER TABLE paper_ai_analyses
+ADD CONSTRAINT unique_analysis_content_hash UNIQUE (content_hash);
@@ -5,7 +5,9 @@ create table if not exists papers (
     preview text not null,
     url text not null,
     source text not null,
-    metadata_str text,
+    source_id text, -- canonical ID in the source, e.g. the arXiv ID
+    metadata jsonb,
+    metadata_str text, -- legacy, see migrate_metadata_str.sql
     created_at text not null
 );
 
@@ -32,3 +34,24 @@ create table if not exists user_paper_records (
     paper_id int not null references papers(paper_id),
     primary key (user_id, paper_id)
 );
+
+create table if not exists paper_ai_analyses (
+    analysis_id int generated always as identity primary key,
+    content_hash text not null, -- key of the paper content, prompt and model, see db/paper_ai_analysis.py
+    paper_id int not null references papers(paper_id),
+    prompt text not null,
+    model text not null,
+    response text not null,
+    created_at text not null
+);
+
+create index if not exists idx_paper_ai_analyses_paper_id on paper_ai_analyses (paper_id);
+
+create index if not exists idx_updates_user_id_created_at on updates (user_id, created_at, update_id);
+create index if not exists idx_updates_paper_id_created_at on updates (paper_id, created_at, update_id);
+
+-- each user's latest update per paper, i.e. their current reading state.
+create or replace view latest_updates as
+select distinct on (user_id, paper_id) *
+from updates
+order by user_id, paper_id, created_at desc, update_id desc;
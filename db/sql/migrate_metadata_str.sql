@@ -0,0 +1,10 @@
+-- Move paper metadata from the JSON-encoded `metadata_str` text column to a
+-- native `metadata` jsonb column, in bulk.
+alter table papers add column if not exists metadata jsonb;
+
+update papers
+set metadata = metadata_str::jsonb, metadata_str = null
+where metadata is null and metadata_str is not null;
+
+-- lets us filter on categories server-side, e.g. metadata @> '{"categories": ["cs.LG"]}'.
+create index if not exists idx_papers_metadata on papers using gin (metadata jsonb_path_ops);
@@ -0,0 +1,564 @@
+"""Storage backends behind the fetch/insert API.
+
+`db.fetch_records` and `db.insert_records_to_supabase` talk to storage
+through `storage_client`, which exposes the subset of the Supabase query
+builder that we use:
+
+    storage_client.table("papers").select("*").eq("paper_id", 1).execute().data
+
+and database functions, called in one round trip (see db/sql/):
+
+    storage_client.rpc("add_paper_for_user", {...}).execute().data
+
+Two backends implement it:
+- "supabase": the Supabase client (the default).
+- "sqlite": a local SQLite database with the same tables, unique
+  constraints and indexes, so upserts with `on_conflict` behave the same,
+  and Python versions of the database functions (`sqlite_functions`).
+  Useful for small deployments, batch jobs, tests and benchmarks.
+
+The backend is selected with the STORAGE_BACKEND env var (and, for SQLite,
+SQLITE_DB_PATH). The client is created on first use, so importing this
+module doesn't import `supabase` or connect to anything.
+
+Every query made through `storage_client` records its latency, errors and
+rows as the "storage.<select|insert|upsert|update|delete>" operation on its
+table, or as "storage.rpc" on the function's name (see lib/metrics.py), and
+goes through `lib.resilience`:
+- it isn't started once the caller's deadline has passed,
+- transient errors (connection errors, timeouts, 5xx responses, a locked
+  SQLite database) are retried with jittered backoff, except for inserts,
+  which aren't idempotent,
+- `storage_breaker` fails queries fast while storage keeps failing,
+- selects can be hedged, see `STORAGE_HEDGE_AFTER_SECONDS`.
+"""
+import json
+import sqlite3
+import threading
+from typing import Any, Optional
+
+from lib import env_vars
+from lib.metrics import timed
+from lib.resilience import CircuitBreaker, RetryPolicy, call_with_resilience
+
+# transient errors are retried after ~50ms, then ~100ms (jittered).
+STORAGE_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay_seconds=0.05, max_delay_seconds=1.0)
+# run a second copy of a select that hasn't returned after this many seconds,
+# e.g. 0.5 to cut tail latency at the cost of extra load; None to never hedge.
+STORAGE_HEDGE_AFTER_SECONDS: Optional[float] = None
+
+storage_breaker = CircuitBreaker("storage", failure_threshold=10, reset_timeout_seconds=10.0)
+
+# SQLite version of db/sql/create_table_queries.sql + db/sql/constraints.sql.
+sqlite_schema = """
+create table if not exists users (
+    user_id integer primary key autoincrement,
+    email text not null,
+    name text not null,
+    username text not null,
+    created_at text not null,
+    constraint unique_user_email unique (email)
+);
+
+create table if not exists papers (
+    paper_id integer primary key autoincrement,
+    title text not null,
+    authors text not null, -- JSON-encoded list of strings
+    preview text not null,
+    url text not null,
+    source text not null,
+    source_id text, -- canonical ID in the source, e.g. the arXiv ID
+    metadata text, -- JSON object
+    metadata_str text, -- legacy, migrated to metadata on startup
+    created_at text not null,
+    constraint unique_paper_url unique (url)
+);
+
+create table if not exists updates (
+    update_id integer primary key autoincrement,
+    paper_id integer not null references papers(paper_id),
+    user_id integer not null references users(user_id),
+    message text not null,
+    reading_status text not null,
+    reading_progress real not null,
+    created_at text not null,
+    constraint unique_update_paper_user unique (paper_id, user_id)
+);
+
+create table if not exists user_paper_records (
+    user_id integer not null references users(user_id),
+    paper_id integer not null references papers(paper_id),
+    primary key (user_id, paper_id)
+);
+
+create table if not exists paper_ai_analyses (
+    analysis_id integer primary key autoincrement,
+    content_hash text not null,
+    paper_id integer not null references papers(paper_id),
+    prompt text not null,
+    model text not null,
+    response text not null,
+    created_at text not null,
+    constraint unique_analysis_content_hash unique (content_hash)
+);
+
+create index if not exists idx_updates_user_id_created_at on updates (user_id, created_at, update_id);
+create index if not exists idx_updates_paper_id_created_at on updates (paper_id, created_at, update_id);
+create index if not exists idx_user_paper_records_paper_id on user_paper_records (paper_id);
+create index if not exists idx_paper_ai_analyses_paper_id on paper_ai_analyses (paper_id);
+
+-- each user's latest update per paper, i.e. their current reading state.
+create view if not exists latest_updates as
+select * from updates
+where not exists (
+    select 1 from updates as newer
+    where newer.user_id = updates.user_id
+    and newer.paper_id = updates.paper_id
+    and (
+        newer.created_at > updates.created_at
+        or (newer.created_at = updates.created_at and newer.update_id > updates.update_id)
+    )
+);
+"""
+
+# created after the migrations below, since older databases lack the column.
+sqlite_indexes = """
+create index if not exists idx_papers_source_source_id on papers (source, source_id);
+"""
+
+# columns stored as JSON text in SQLite (arrays in Postgres).
+json_columns: dict[str, set[str]] = {
+    "papers": {"authors", "metadata"},
+}
+
+# SQLite version of db/sql/migrate_metadata_str.sql, for databases created
+# before papers had a `metadata` column.
+sqlite_migrate_metadata_str = """
+update papers
+set metadata = metadata_str, metadata_str = null
+where metadata is null and metadata_str is not null and json_valid(metadata_str);
+"""
+
+
+class StorageResponse:
+    """Mirrors the `.data` of a Supabase APIResponse."""
+
+    def __init__(self, data: list[dict[str, Any]] | dict[str, Any]):
+        # the rows of a query, or a function's result.
+        self.data = data
+
+
+class SQLiteQuery:
+    """Query builder for one table, mirroring Supabase's query builder."""
+
+    def __init__(self, backend: "SQLiteStorageBackend", table: str):
+        if table not in backend.columns:
+            raise ValueError(f"Unknown table: {table}")
+        self._backend = backend
+        self._table = table
+        self._columns = backend.columns[table]
+        self._operation = "select"
+        self._selected = "*"
+        self._rows: list[dict[str, Any]] = []
+        self._on_conflict: list[str] = []
+        self._values: dict[str, Any] = {}
+        self._filters: list[tuple[str, list[Any]]] = []
+        self._order_by: list[str] = []
+        self._limit: Optional[int] = None
+
+    def _check_column(self, column: str) -> str:
+        column = column.strip()
+        if column not in self._columns:
+            raise ValueError(f"Unknown column for {self._table}: {column}")
+        return column
+
+    def _encode(self, row: dict[str, Any]) -> dict[str, Any]:
+        encoded = {}
+        for column, value in row.items():
+            column = self._check_column(column)
+            if column in json_columns.get(self._table, ()) and value is not None:
+                value = json.dumps(value)
+            encoded[column] = value
+        return encoded
+
+    def _decode(self, row: sqlite3.Row) -> dict[str, Any]:
+        decoded = dict(row)
+        for column in json_columns.get(self._table, ()):
+            if decoded.get(column) is not None:
+                decoded[column] = json.loads(decoded[column])
+        return decoded
+
+    def select(self, columns: str = "*") -> "SQLiteQuery":
+        self._operation = "select"
+        if columns.strip() != "*":
+            columns = ", ".join(self._check_column(c) for c in columns.split(","))
+        self._selected = columns
+        return self
+
+    def insert(self, rows: dict | list[dict]) -> "SQLiteQuery":
+        self._operation = "insert"
+        self._rows = [self._encode(row) for row in (rows if isinstance(rows, list) else [rows])]
+        return self
+
+    def upsert(self, rows: dict | list[dict], on_conflict: str = "") -> "SQLiteQuery":
+        self.insert(rows)
+        self._operation = "upsert"
+        self._on_conflict = (
+            [self._check_column(c) for c in on_conflict.split(",")]
+            if on_conflict
+            else self._backend.primary_keys[self._table]
+        )
+        return self
+
+    def update(self, values: dict[str, Any]) -> "SQLiteQuery":
+        self._operation = "update"
+        self._values = self._encode(values)
+        return self
+
+    def delete(self) -> "SQLiteQuery":
+        self._operation = "delete"
+        return self
+
+    def _filter(self, column: str, operator: str, value: Any) -> "SQLiteQuery":
+        self._filters.append((f"{self._check_column(column)} {operator} ?", [value]))
+        return self
+
+    def eq(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter(column, "=", value)
+
+    def neq(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter(column, "!=", value)
+
+    def gt(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter(column, ">", value)
+
+    def gte(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter(column, ">=", value)
+
+    def lt(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter(column, "<", value)
+
+    def lte(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter(column, "<=", value)
+
+    def in_(self, column: str, values: list[Any]) -> "SQLiteQuery":
+        values = list(values)
+        if not values:
+            self._filters.append(("0", []))
+        else:
+            placeholders = ", ".join("?" for _ in values)
+            self._filters.append((f"{self._check_column(column)} in ({placeholders})", values))
+        return self
+
+    def contains(self, column: str, value: dict[str, Any]) -> "SQLiteQuery":
+        """Filter to rows whose JSON `column` contains `value` (like jsonb's @>).
+
+        Supports values whose entries are scalars (must be equal) or lists
+        (every element must be in the row's list).
+        """
+        column = self._check_column(column)
+        for key, expected in value.items():
+            path = f"$.{key}"
+            if isinstance(expected, list):
+                for element in expected:
+                    self._filters.append(
+                        (
+                            f"exists (select 1 from json_each({column}, ?) where value = ?)",
+                            [path, element],
+                        )
+                    )
+            else:
+                self._filters.append((f"json_extract({column}, ?) = ?", [path, expected]))
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "SQLiteQuery":
+        self._order_by.append(f"{self._check_column(column)} {'desc' if desc else 'asc'}")
+        return self
+
+    def limit(self, count: int) -> "SQLiteQuery":
+        self._limit = int(count)
+        return self
+
+    def _where(self) -> tuple[str, list[Any]]:
+        if not self._filters:
+            return "", []
+        clauses = " and ".join(clause for clause, _ in self._filters)
+        params = [param for _, clause_params in self._filters for param in clause_params]
+        return f" where {clauses}", params
+
+    def execute(self) -> StorageResponse:
+        with self._backend.transaction() as conn:
+            if self._operation == "select":
+                where, params = self._where()
+                sql = f"select {self._selected} from {self._table}{where}"
+                if self._order_by:
+                    sql += f" order by {', '.join(self._order_by)}"
+                if self._limit is not None:
+                    sql += f" limit {self._limit}"
+                rows = conn.execute(sql, params).fetchall()
+            elif self._operation in ("insert", "upsert"):
+                rows = []
+                for row in self._rows:
+                    columns = list(row)
+                    sql = (
+                        f"insert into {self._table} ({', '.join(columns)}) "
+                        f"values ({', '.join('?' for _ in columns)})"
+                    )
+                    if self._operation == "upsert":
+                        updated = [c for c in columns if c not in self._on_conflict] or self._on_conflict[:1]
+                        sql += (
+                            f" on conflict ({', '.join(self._on_conflict)}) do update set "
+                            + ", ".join(f"{c} = excluded.{c}" for c in updated)
+                        )
+                    rows.extend(conn.execute(f"{sql} returning *", list(row.values())).fetchall())
+            elif self._operation == "update":
+                where, params = self._where()
+                assignments = ", ".join(f"{c} = ?" for c in self._values)
+                rows = conn.execute(
+                    f"update {self._table} set {assignments}{where} returning *",
+                    list(self._values.values()) + params,
+                ).fetchall()
+            else:
+                where, params = self._where()
+                rows = conn.execute(f"delete from {self._table}{where} returning *", params).fetchall()
+        return StorageResponse([self._decode(row) for row in rows])
+
+
+class _Transaction:
+    """Runs statements in one transaction. Transactions opened inside it (on
+    the same thread) join it, e.g. the queries of a database function."""
+
+    def __init__(self, backend: "SQLiteStorageBackend"):
+        self._backend = backend
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._backend._lock.acquire()
+        if self._backend._transaction_depth == 0:
+            self._backend._conn.execute("begin")
+        self._backend._transaction_depth += 1
+        return self._backend._conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            self._backend._transaction_depth -= 1
+            if self._backend._transaction_depth == 0:
+                self._backend._conn.execute("rollback" if exc_type else "commit")
+        finally:
+            self._backend._lock.release()
+
+
+class SQLiteFunctionCall:
+    """A call of one of `sqlite_functions`, run in one transaction by execute()."""
+
+    def __init__(self, backend: "SQLiteStorageBackend", name: str, params: dict[str, Any]):
+        self._backend = backend
+        self._name = name
+        self._params = params
+
+    def execute(self) -> StorageResponse:
+        function = sqlite_functions.get(self._name)
+        if function is None:
+            raise NotImplementedError(f"Unknown database function: {self._name}")
+        with self._backend.transaction():
+            return StorageResponse(function(self._backend, self._params))
+
+
+class SQLiteStorageBackend:
+    """Local SQLite database exposing the Supabase query builder subset we use."""
+
+    def __init__(self, path: Optional[str] = None):
+        path = env_vars.SQLITE_DB_PATH if path is None else path
+        self.path = path
+        self._lock = threading.RLock()
+        # number of nested transactions open, see _Transaction.
+        self._transaction_depth = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(sqlite_schema)
+        paper_columns = [c["name"] for c in self._conn.execute("pragma table_info(papers)")]
+        if "metadata" not in paper_columns:
+            self._conn.execute("alter table papers add column metadata text")
+        if "source_id" not in paper_columns:
+            self._conn.execute("alter table papers add column source_id text")
+        self._conn.executescript(sqlite_migrate_metadata_str)
+        self._backfill_source_ids()
+        self._conn.executescript(sqlite_indexes)
+        self.columns: dict[str, list[str]] = {}
+        self.primary_keys: dict[str, list[str]] = {}
+        for (table,) in self._conn.execute(
+            "select name from sqlite_master where type in ('table', 'view') and name not like 'sqlite_%'"
+        ).fetchall():
+            info = self._conn.execute(f"pragma table_info({table})").fetchall()
+            self.columns[table] = [column["name"] for column in info]
+            self.primary_keys[table] = [
+                column["name"] for column in sorted(info, key=lambda c: c["pk"]) if column["pk"]
+            ]
+
+    def _backfill_source_ids(self) -> None:
+        """Set source_id for arXiv papers inserted before papers had one.
+
+        Python version of db/sql/add_papers_source_id.sql, using the same
+        normalization as new inserts.
+        """
+        from api.arxiv_ids import normalize_arxiv_id
+
+        rows = self._conn.execute(
+            "select paper_id, url, json_extract(metadata, '$.arxiv_id') as arxiv_id from papers "
+            "where source = 'arxiv' and source_id is null"
+        ).fetchall()
+        source_ids = [
+            (normalize_arxiv_id(row["arxiv_id"] or row["url"]), row["paper_id"]) for row in rows
+        ]
+        with self.transaction() as conn:
+            conn.executemany(
+                "update papers set source_id = ? where paper_id = ?",
+                [(source_id, paper_id) for source_id, paper_id in source_ids if source_id is not None],
+            )
+
+    def table(self, name: str) -> SQLiteQuery:
+        return SQLiteQuery(self, name)
+
+    def transaction(self) -> _Transaction:
+        """Context manager running statements in one transaction."""
+        return _Transaction(self)
+
+    def rpc(self, name: str, params: dict[str, Any]) -> SQLiteFunctionCall:
+        """Call a database function, like Supabase's rpc()."""
+        return SQLiteFunctionCall(self, name, params)
+
+
+def _sqlite_add_paper_for_user(backend: SQLiteStorageBackend, params: dict[str, Any]) -> dict[str, Any]:
+    """SQLite version of db/sql/add_paper_for_user.sql."""
+    paper = None
+    paper_id = params.get("p_paper_id")
+    if paper_id is None:
+        paper = backend.table("papers").upsert(params["p_paper"], on_conflict="url").execute().data[0]
+        paper_id = paper["paper_id"]
+    update = {**params["p_update"], "paper_id": paper_id, "user_id": params["p_user_id"]}
+    update_id = (
+        backend.table("updates").upsert(update, on_conflict="paper_id, user_id").execute().data[0]["update_id"]
+    )
+    backend.table("user_paper_records").upsert(
+        {"user_id": params["p_user_id"], "paper_id": paper_id}, on_conflict="user_id, paper_id"
+    ).execute()
+    return {"paper_id": paper_id, "update_id": update_id, "paper": paper}
+
+
+# database function name -> its SQLite version, taking the backend and the
+# function's params. Each call runs in one transaction.
+sqlite_functions: dict[str, Any] = {
+    "add_paper_for_user": _sqlite_add_paper_for_user,
+}
+
+
+def create_storage_client(backend: Optional[str] = None) -> Any:
+    """Create the storage client for the given backend ("supabase" or "sqlite")."""
+    backend = env_vars.STORAGE_BACKEND if backend is None else backend
+    if backend == "supabase":
+        from db.supabase_db import get_supabase_client
+        return get_supabase_client()
+    if backend == "sqlite":
+        return SQLiteStorageBackend()
+    raise ValueError(f"Invalid storage backend: {backend}")
+
+
+_storage_client: Any = None
+_storage_client_lock = threading.Lock()
+
+
+def get_storage_client() -> Any:
+    """Get the configured storage client, creating it on first use."""
+    global _storage_client
+    if _storage_client is None:
+        with _storage_client_lock:
+            if _storage_client is None:
+                _storage_client = create_storage_client()
+    return _storage_client
+
+
+def set_storage_client(client: Any) -> None:
+    """Replace the process-wide storage client, e.g. with a SQLiteStorageBackend."""
+    global _storage_client
+    with _storage_client_lock:
+        _storage_client = client
+
+
+# query builder methods that set the kind of query.
+_query_operations = {"select", "insert", "upsert", "update", "delete"}
+
+
+class _TimedQuery:
+    """Wraps a query builder, recording the latency and rows of its execute()
+    as the "storage.<operation>" operation (see lib/metrics.py)."""
+
+    __slots__ = ("_query", "_table", "_operation", "_idempotent")
+
+    def __init__(self, query: Any, table: str, operation: str = "select", idempotent: Optional[bool] = None):
+        self._query = query
+        # the table, or the function for "rpc".
+        self._table = table
+        self._operation = operation
+        # None: everything but inserts is.
+        self._idempotent = idempotent
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._query, name)
+        operation = name if name in _query_operations else self._operation
+        if not callable(attr):
+            # e.g. supabase's `not_` property, which returns a builder.
+            return _TimedQuery(attr, self._table, operation, self._idempotent) if hasattr(attr, "execute") else attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if hasattr(result, "execute"):
+                return _TimedQuery(result, self._table, operation, self._idempotent)
+            return result
+        return call
+
+    def _execute_once(self, timeout: Optional[float]) -> Any:
+        # the clients don't take a timeout; the deadline is checked per attempt.
+        with timed(f"storage.{self._operation}", self._table) as op:
+            response = self._query.execute()
+            if isinstance(response.data, list):
+                op.rows = len(response.data)
+        return response
+
+    def execute(self) -> Any:
+        return call_with_resilience(
+            self._execute_once,
+            idempotent=self._operation != "insert" if self._idempotent is None else self._idempotent,
+            retry=STORAGE_RETRY_POLICY,
+            breaker=storage_breaker,
+            hedge_after_seconds=STORAGE_HEDGE_AFTER_SECONDS if self._operation == "select" else None,
+        )
+
+
+class _LazyStorageClient:
+    """Stands in for the storage client until it's first used."""
+
+    def table(self, name: str) -> Any:
+        return _TimedQuery(get_storage_client().table(name), name)
+
+    def rpc(self, name: str, params: dict[str, Any], idempotent: bool = False) -> Any:
+        """Call a database function in one round trip.
+
+        Args:
+            name: The function, e.g. "add_paper_for_user"
+            params: Its arguments, by name
+            idempotent: Whether a failed call can be retried
+
+        Raises NotImplementedError if the backend can't call functions.
+        """
+        client = get_storage_client()
+        if not hasattr(client, "rpc"):
+            raise NotImplementedError(f"{type(client).__name__} doesn't support database functions.")
+        return _TimedQuery(client.rpc(name, params), name, "rpc", idempotent)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(get_storage_client(), name)
+
+
+storage_client = _LazyStorageClient()
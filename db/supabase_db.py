@@ -1,6 +1,37 @@
-"""Client for interacting with Supabase."""
+"""Client for interacting with Supabase.
 
-from lib.env_vars import SUPABASE_PROJECT_URL, SUPABASE_PROJECT_API_KEY
-from supabase import create_client, Client
+The client is created on first use and then shared (it's safe to use across
+threads), so importing this module neither imports `supabase` nor reads
+credentials.
+"""
+import threading
+from typing import TYPE_CHECKING, Optional
 
-supabase_client: Client = create_client(SUPABASE_PROJECT_URL, SUPABASE_PROJECT_API_KEY)
+from lib import env_vars
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+_supabase_client: Optional["Client"] = None
+_supabase_client_lock = threading.Lock()
+
+
+def get_supabase_client() -> "Client":
+    """Get the shared Supabase client, creating it on first use."""
+    global _supabase_client
+    if _supabase_client is None:
+        with _supabase_client_lock:
+            if _supabase_client is None:
+                from supabase import create_client
+
+                _supabase_client = create_client(
+                    env_vars.SUPABASE_PROJECT_URL, env_vars.SUPABASE_PROJECT_API_KEY
+                )
+    return _supabase_client
+
+
+def __getattr__(name: str):
+    # keeps `from db.supabase_db import supabase_client` working, lazily.
+    if name == "supabase_client":
+        return get_supabase_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
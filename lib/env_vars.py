@@ -1,6 +1,13 @@
-import os
+"""Environment variables, loaded lazily from the project's .env file.
 
-from dotenv import load_dotenv
+The .env file is only read (and `dotenv` only imported) the first time a
+variable is accessed, e.g. `env_vars.SUPABASE_PROJECT_URL`, so importing this
+module is cheap. Access variables as attributes at the point of use, rather
+than with `from lib.env_vars import ...` at import time.
+"""
+import os
+import threading
+from typing import Optional
 
 from lib.constants import PROJECT_ROOT_DIR
 
@@ -8,16 +15,54 @@ env_paths = [
     os.path.join(PROJECT_ROOT_DIR, ".env"),
 ]
 
-for env_path in env_paths:
-    load_dotenv(env_path)
+# env var name -> default value.
+env_var_defaults: dict[str, Optional[str]] = {
+    "DIGITAL_OCEAN_PERSONAL_ACCESS_TOKEN": None,
+    "DIGITAL_OCEAN_IP_ADDRESS": None,
+    "GOOGLE_CLIENT_ID": None,
+    "GOOGLE_CLIENT_SECRET": None,
+    "SUPABASE_PROJECT_NAME": None,
+    "SUPABASE_POSTGRES_PW": None,
+    "SUPABASE_PROJECT_URL": None,
+    "SUPABASE_PROJECT_API_KEY": None,
+    "ARXIV_CACHE_PATH": os.path.join(PROJECT_ROOT_DIR, ".cache", "arxiv_metadata.sqlite"),
+    # built with api/arxiv_snapshot.py; lookups skip it if it doesn't exist.
+    "ARXIV_SNAPSHOT_PATH": os.path.join(PROJECT_ROOT_DIR, ".cache", "arxiv_snapshot.bin"),
+    "ARXIV_HARVEST_CHECKPOINT_DIR": os.path.join(PROJECT_ROOT_DIR, ".cache", "arxiv_harvest"),
+    "PAPER_SEARCH_INDEX_PATH": os.path.join(PROJECT_ROOT_DIR, ".cache", "paper_search_index.bin"),
+    "SIMILAR_PAPERS_INDEX_PATH": os.path.join(PROJECT_ROOT_DIR, ".cache", "similar_papers.bin"),
+    "READERS_ALSO_READ_PATH": os.path.join(PROJECT_ROOT_DIR, ".cache", "readers_also_read.bin"),
+    # "supabase" or "sqlite". See db/storage_backends.py.
+    "STORAGE_BACKEND": "supabase",
+    "SQLITE_DB_PATH": os.path.join(PROJECT_ROOT_DIR, "db", "goodpapers.sqlite"),
+    # "validate" or "trusted". See db/hydration.py.
+    "MODEL_HYDRATION": "validate",
+    # "text" or "json", and e.g. "db.insert_records_to_supabase=0.1". See lib/logger.py.
+    "LOG_FORMAT": "text",
+    "LOG_SAMPLING": None,
+}
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+
+def load_env() -> None:
+    """Load the .env files into os.environ, once per process."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _env_lock:
+        if _env_loaded:
+            return
+        from dotenv import load_dotenv
 
-DIGITAL_OCEAN_PERSONAL_ACCESS_TOKEN = os.environ.get("DIGITAL_OCEAN_PERSONAL_ACCESS_TOKEN")
-DIGITAL_OCEAN_IP_ADDRESS = os.environ.get("DIGITAL_OCEAN_IP_ADDRESS")
+        for env_path in env_paths:
+            load_dotenv(env_path)
+        _env_loaded = True
 
-GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
-GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
 
-SUPABASE_PROJECT_NAME = os.environ.get("SUPABASE_PROJECT_NAME")
-SUPABASE_POSTGRES_PW = os.environ.get("SUPABASE_POSTGRES_PW")
-SUPABASE_PROJECT_URL = os.environ.get("SUPABASE_PROJECT_URL")
-SUPABASE_PROJECT_API_KEY = os.environ.get("SUPABASE_PROJECT_API_KEY")
+def __getattr__(name: str) -> Optional[str]:
+    if name not in env_var_defaults:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    load_env()
+    return os.environ.get(name, env_var_defaults[name])
@@ -1,41 +1,251 @@
+"""Loggers that don't block the caller.
+
+`get_logger(name)` loggers hand records to a bounded queue, and a background
+thread formats and writes them to stderr, so a log call on the request path
+costs a record and a queue put. If the queue is full (the writer can't keep
+up), INFO and DEBUG records are dropped and counted rather than blocking;
+warnings and errors wait briefly for room, and are then written on the
+calling thread, so they're never lost. See `get_log_stats`. Queued records
+are written at exit.
+
+Set with env vars, read on the first log call:
+- LOG_FORMAT: "text" (colored, the default) or "json", one object per line
+  with the structured fields passed as `extra`, e.g.
+  `logger.info("Inserted paper", extra={"user_id": 1, "paper_id": 2})`.
+- LOG_SAMPLING: keep only a fraction of a logger's INFO and DEBUG records,
+  e.g. "db.insert_records_to_supabase=0.1,db.paper_ai_analysis=0.5".
+  Warnings and errors are always kept. See also `set_log_sampling`.
+"""
+import atexit
+import functools
+import itertools
 import logging
 import os
-from typing import Optional
+import queue
+import threading
+from typing import Any, Optional
 
 # ANSI color codes
 YELLOW = "\033[33m"
 RED = "\033[31m"
 RESET = "\033[0m"
 
+# max records waiting to be written before new ones are dropped.
+LOG_QUEUE_SIZE = 10_000
+# how long a warning or error waits for room in a full queue, before it's
+# written on the calling thread.
+LOG_QUEUE_WAIT_SECONDS = 0.1
+
+# attributes every LogRecord has; the others were passed as `extra`.
+_record_attrs = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "module_path"}
+
+
+@functools.lru_cache(maxsize=None)
+def _module_path(pathname: str) -> str:
+    # Get the relative path from project root
+    rel_path = os.path.relpath(pathname)
+    # Convert path separators to dots and remove .py extension
+    return rel_path.replace(os.sep, '.').replace('.py', '')
+
+
 class ColoredFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord) -> str:
-        # Get the relative path from project root
-        filepath = record.pathname
-        rel_path = os.path.relpath(filepath)
-        # Convert path separators to dots and remove .py extension
-        module_path = rel_path.replace(os.sep, '.').replace('.py', '')
-        
+        module_path = _module_path(record.pathname)
+
         # Color the module path based on level
         color = ''
         if record.levelno == logging.WARNING:
             color = YELLOW
         elif record.levelno >= logging.ERROR:
             color = RED
-            
+
         record.module_path = f"{color}[{module_path}]{RESET}"
         return super().format(record)
 
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with their `extra` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        # imported here, since only the json mode needs them.
+        import json
+        from datetime import datetime, timezone
+
+        entry: dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "module_path": _module_path(record.pathname),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _record_attrs:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 in every 1/rate INFO and DEBUG records; warnings and errors always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self._every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        return self._every > 0 and next(self._counter) % self._every == 0
+
+
+class _QueueHandler(logging.Handler):
+    """Queues records for a background writer. If the queue is full, drops
+    INFO and DEBUG records, and writes warnings and errors itself."""
+
+    def __init__(self):
+        super().__init__()
+        self.queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.dropped = 0
+        self.written_directly = 0
+        # writes records on the calling thread; a handler of its own, so it
+        # doesn't wait for the writer's lock.
+        self._direct_handler: Optional[logging.Handler] = None
+        self._writer: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+        self._stop_at_exit = False
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._writer is not None:
+                # forked: the writer thread didn't survive, start a new one.
+                self.queue = queue.Queue(LOG_QUEUE_SIZE)
+            _configure_from_env()
+            formatter = JsonFormatter() if _log_format == "json" else ColoredFormatter('%(module_path)s: %(message)s')
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(formatter)
+            self._direct_handler = logging.StreamHandler()
+            self._direct_handler.setFormatter(formatter)
+            self._writer = threading.Thread(
+                target=self._write, args=(self.queue, stream_handler), name="log-writer", daemon=True
+            )
+            self._writer.start()
+            if not self._stop_at_exit:
+                atexit.register(self.stop)
+                self._stop_at_exit = True
+            self._pid = os.getpid()
+
+    @staticmethod
+    def _write(records: queue.Queue, stream_handler: logging.Handler) -> None:
+        while True:
+            record = records.get()
+            if record is None:
+                return
+            stream_handler.handle(record)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            # only do what has to happen on the calling thread: merge the args
+            # (they could change) and render the traceback (it can't be queued).
+            if record.args:
+                record.msg = record.getMessage()
+                record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            if record.levelno < logging.WARNING:
+                self.queue.put_nowait(record)
+            else:
+                self._put_or_write(record)
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _put_or_write(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put(record, timeout=LOG_QUEUE_WAIT_SECONDS)
+        except queue.Full:
+            # the writer is far behind: write it here rather than lose it,
+            # out of order with the queued records.
+            self.written_directly += 1
+            self._direct_handler.handle(record)
+
+    def stop(self) -> None:
+        """Write the queued records and stop the writer."""
+        with self._start_lock:
+            if self._writer is not None and self._pid == os.getpid():
+                self.queue.put(None)
+                self._writer.join()
+                self._writer = None
+                self._pid = None
+
+
+_handler = _QueueHandler()
+_log_format = "text"
+# logger name -> sampling rate.
+_sampling_rates: dict[str, float] = {}
+_configured = False
+
+
+def _configure_from_env() -> None:
+    """Read LOG_FORMAT and LOG_SAMPLING, once per process."""
+    global _configured, _log_format
+    if _configured:
+        return
+    # imported here, so importing a module that logs doesn't read the .env file.
+    from lib import env_vars
+
+    _log_format = env_vars.LOG_FORMAT
+    for item in (env_vars.LOG_SAMPLING or "").split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            set_log_sampling(name.strip(), float(rate))
+    _configured = True
+
+
+def set_log_sampling(name: str, rate: Optional[float]) -> None:
+    """Keep only `rate` of a logger's INFO and DEBUG records (None to keep all)."""
+    logger = logging.getLogger(name)
+    for log_filter in list(logger.filters):
+        if isinstance(log_filter, SamplingFilter):
+            logger.removeFilter(log_filter)
+    if rate is None or rate >= 1:
+        _sampling_rates.pop(name, None)
+    else:
+        _sampling_rates[name] = rate
+        logger.addFilter(SamplingFilter(rate))
+
+
+def get_log_stats() -> dict[str, int]:
+    """Get the number of records waiting to be written, dropped because the
+    queue was full, and written on the calling thread (warnings and errors)
+    because it was."""
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped, "written_directly": _handler.written_directly}
+
+
+def flush_logs() -> None:
+    """Write the queued records now, e.g. before a process exits abnormally."""
+    _handler.stop()
+
+
 def get_logger(name: Optional[str] = None) -> logging.Logger:
-    """Get a logger instance with colored formatting."""
+    """Get a logger instance with colored formatting, written from a background thread."""
     logger = logging.getLogger(name)
-    
+
     if not logger.handlers:
-        handler = logging.StreamHandler()
-        formatter = ColoredFormatter('%(module_path)s: %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        logger.addHandler(_handler)
         logger.setLevel(logging.INFO)
-    
+
     return logger
 
 # Create default logger instance
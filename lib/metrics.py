@@ -0,0 +1,344 @@
+"""Latency metrics and spans for storage queries, arXiv requests and other operations.
+
+Each operation is recorded by name and target, e.g. ("storage.select",
+"papers") or ("arxiv.request", "export.arxiv.org"), as:
+- a latency histogram, in seconds,
+- an error count,
+- payload sizes: rows for storage queries, bytes for HTTP requests.
+
+    with timed("storage.select", "papers") as op:
+        response = query.execute()
+        op.rows = len(response.data)
+
+    get_metrics_registry().render_prometheus()  # Prometheus text format
+
+Spans tie the operations of one call together, e.g. one
+`user_inserts_new_paper`. Operations (and spans) that run inside a span,
+in the same thread or task, are recorded as its children:
+
+    @traced("user_inserts_new_paper")
+    def user_inserts_new_paper(...): ...
+
+Finished root spans are passed to span listeners (see `add_span_listener`),
+and ones slower than `SLOW_SPAN_SECONDS` are logged with their children.
+
+Recording an operation is a perf_counter call, a bisect and a few additions
+under a lock, i.e. a few microseconds. Spans only cost anything while one
+is open.
+"""
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+# upper bounds of the latency histogram buckets, in seconds.
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# root spans slower than this are logged with their children's timings.
+SLOW_SPAN_SECONDS = 2.0
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _OperationStats:
+    __slots__ = ("bucket_counts", "count", "total_seconds", "errors", "rows", "num_bytes")
+
+    def __init__(self, num_buckets: int):
+        # the last bucket is +Inf.
+        self.bucket_counts = [0] * (num_buckets + 1)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.errors = 0
+        self.rows = 0
+        self.num_bytes = 0
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """Thread-safe per-operation latency histograms and counters."""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS, namespace: str = "goodpapers"):
+        self.buckets = tuple(sorted(buckets))
+        self.namespace = namespace
+        self._stats: dict[tuple[str, str], _OperationStats] = {}
+        self._lock = threading.Lock()
+
+    def observe(
+        self,
+        operation: str,
+        target: str,
+        seconds: float,
+        error: bool = False,
+        rows: Optional[int] = None,
+        num_bytes: Optional[int] = None,
+    ) -> None:
+        """Record one run of an operation."""
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            stats = self._stats.get((operation, target))
+            if stats is None:
+                stats = self._stats[(operation, target)] = _OperationStats(len(self.buckets))
+            stats.bucket_counts[bucket] += 1
+            stats.count += 1
+            stats.total_seconds += seconds
+            stats.errors += error
+            if rows is not None:
+                stats.rows += rows
+            if num_bytes is not None:
+                stats.num_bytes += num_bytes
+
+    def quantile(self, operation: str, target: str, q: float) -> Optional[float]:
+        """Estimate a latency quantile (e.g. 0.99) from the histogram, like
+        Prometheus' histogram_quantile. None if the operation hasn't run."""
+        with self._lock:
+            stats = self._stats.get((operation, target))
+            if stats is None or stats.count == 0:
+                return None
+            bucket_counts = list(stats.bucket_counts)
+            count = stats.count
+        rank = q * count
+        cumulative = 0
+        for idx, bucket_count in enumerate(bucket_counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if idx == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[idx - 1] if idx else 0.0
+                return lower + (self.buckets[idx] - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict[tuple[str, str], dict[str, float]]:
+        """Get (operation, target) -> count, errors, rows, bytes, mean/p50/p99 seconds."""
+        with self._lock:
+            keys = list(self._stats)
+        snapshot = {}
+        for operation, target in keys:
+            with self._lock:
+                stats = self._stats[(operation, target)]
+                count, total_seconds = stats.count, stats.total_seconds
+                errors, rows, num_bytes = stats.errors, stats.rows, stats.num_bytes
+            snapshot[(operation, target)] = {
+                "count": count,
+                "errors": errors,
+                "rows": rows,
+                "bytes": num_bytes,
+                "mean_seconds": total_seconds / count if count else 0.0,
+                "p50_seconds": self.quantile(operation, target, 0.5),
+                "p99_seconds": self.quantile(operation, target, 0.99),
+            }
+        return snapshot
+
+    def render_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            items = sorted(
+                (key, list(stats.bucket_counts), stats.count, stats.total_seconds, stats.errors, stats.rows, stats.num_bytes)
+                for key, stats in self._stats.items()
+            )
+        name = f"{self.namespace}_operation"
+        duration_lines = [
+            f"# HELP {name}_duration_seconds Latency of storage queries, arXiv requests and spans.",
+            f"# TYPE {name}_duration_seconds histogram",
+        ]
+        errors_lines = [f"# HELP {name}_errors_total Operations that raised.", f"# TYPE {name}_errors_total counter"]
+        rows_lines = [f"# HELP {name}_rows_total Rows returned by storage queries.", f"# TYPE {name}_rows_total counter"]
+        bytes_lines = [f"# HELP {name}_bytes_total Bytes received by HTTP requests.", f"# TYPE {name}_bytes_total counter"]
+        for (operation, target), bucket_counts, count, total_seconds, errors, rows, num_bytes in items:
+            labels = f'operation="{_escape_label(operation)}",target="{_escape_label(target)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                duration_lines.append(f'{name}_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            duration_lines.append(f"{name}_duration_seconds_sum{{{labels}}} {total_seconds!r}")
+            duration_lines.append(f"{name}_duration_seconds_count{{{labels}}} {count}")
+            errors_lines.append(f"{name}_errors_total{{{labels}}} {errors}")
+            if rows:
+                rows_lines.append(f"{name}_rows_total{{{labels}}} {rows}")
+            if num_bytes:
+                bytes_lines.append(f"{name}_bytes_total{{{labels}}} {num_bytes}")
+        return "\n".join(duration_lines + errors_lines + rows_lines + bytes_lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+class Span:
+    """A timed call and the operations and spans run inside it."""
+
+    __slots__ = ("name", "target", "trace_id", "span_id", "parent_id", "start_time", "seconds", "error", "children")
+
+    def __init__(self, name: str, target: str, trace_id: str, span_id: str, parent_id: Optional[str]):
+        self.name = name
+        self.target = target
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start_time = time.time()
+        self.seconds = 0.0
+        self.error = False
+        self.children: list["Span"] = []
+
+    def format(self, indent: int = 0) -> str:
+        """Format the span and its children as an indented tree of timings."""
+        label = f"{self.name} {self.target}".strip()
+        lines = [f"{'  ' * indent}{label}: {self.seconds * 1000:.1f} ms{' (error)' if self.error else ''}"]
+        lines.extend(child.format(indent + 1) for child in self.children)
+        return "\n".join(lines)
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+_span_listeners: list[Callable[[Span], Any]] = []
+
+
+def current_span() -> Optional[Span]:
+    """Get the span open in this thread or task, if any."""
+    return _current_span.get()
+
+
+def add_span_listener(listener: Callable[[Span], Any]) -> None:
+    """Call `listener` with each finished root span, e.g. to export traces."""
+    _span_listeners.append(listener)
+
+
+def remove_span_listener(listener: Callable[[Span], Any]) -> None:
+    _span_listeners.remove(listener)
+
+
+def _get_logger():
+    # imported on first use, so api.arxiv_fetch_api doesn't import logging.
+    from lib.logger import get_logger
+    return get_logger(__name__)
+
+
+def _finish_root_span(root: Span) -> None:
+    if root.seconds >= SLOW_SPAN_SECONDS:
+        _get_logger().warning(f"Slow {root.name} (trace {root.trace_id}):\n{root.format()}")
+    for listener in list(_span_listeners):
+        try:
+            listener(root)
+        except Exception as e:
+            _get_logger().error(f"Span listener failed: {e}")
+
+
+class timed:
+    """Context manager recording an operation's latency, errors and payload size.
+
+    Set `rows` or `num_bytes` on it to record the payload size. With
+    `span=True`, operations run inside it are recorded as its children.
+    """
+
+    __slots__ = ("operation", "target", "rows", "num_bytes", "registry", "_span", "_open_span", "_token", "_start")
+
+    def __init__(
+        self, operation: str, target: str = "", registry: Optional[MetricsRegistry] = None, span: bool = False
+    ):
+        self.operation = operation
+        self.target = target
+        self.rows: Optional[int] = None
+        self.num_bytes: Optional[int] = None
+        self.registry = registry
+        self._open_span = span
+        self._span: Optional[Span] = None
+        self._token = None
+
+    def __enter__(self) -> "timed":
+        parent = _current_span.get()
+        if self._open_span or parent is not None:
+            span_id = os.urandom(8).hex()
+            self._span = Span(
+                self.operation,
+                self.target,
+                trace_id=parent.trace_id if parent is not None else span_id,
+                span_id=span_id,
+                parent_id=parent.span_id if parent is not None else None,
+            )
+            if self._open_span:
+                self._token = _current_span.set(self._span)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        seconds = time.perf_counter() - self._start
+        error = exc_type is not None
+        (self.registry or get_metrics_registry()).observe(
+            self.operation, self.target, seconds, error=error, rows=self.rows, num_bytes=self.num_bytes
+        )
+        span = self._span
+        if span is None:
+            return
+        span.seconds = seconds
+        span.error = error
+        if self._token is not None:
+            _current_span.reset(self._token)
+        if span.parent_id is None:
+            _finish_root_span(span)
+        else:
+            _current_span.get().children.append(span)
+
+
+def span(name: str, target: str = "") -> timed:
+    """Open a span: time a call, and tie the operations run inside it to it."""
+    return timed(name, target, span=True)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator running a function in a span named after it (or `name`)."""
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """Get the process-wide metrics registry."""
+    return _registry
+
+
+def set_metrics_registry(registry: MetricsRegistry) -> None:
+    """Replace the process-wide metrics registry, e.g. with a fresh one in a benchmark."""
+    global _registry
+    _registry = registry
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> Any:
+    """Serve the process-wide metrics at http://host:port/metrics from a background thread.
+
+    Returns:
+        The http.server server; call its shutdown() to stop it.
+    """
+    # imported here, since most processes don't serve metrics.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = get_metrics_registry().render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    _get_logger().info(f"Serving metrics at http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,435 @@
+"""Deadlines, retries, circuit breakers and hedged calls for remote calls.
+
+Deadlines are set by the caller and passed down implicitly (a contextvar),
+so every arXiv request and storage query made inside one gets at most the
+time that's left:
+
+    with deadline(5.0):
+        user_inserts_new_paper(...)  # raises DeadlineExceeded after 5s
+
+`call_with_resilience(fn, ...)` runs `fn(timeout)` with:
+- the timeout left before the deadline (or a default one),
+- retries with capped, fully jittered exponential backoff on transient
+  errors (see `is_transient_error`), only if the call is idempotent, and
+  never sleeping past the deadline,
+- a `CircuitBreaker`, which fails fast with `CircuitOpenError` once a
+  dependency keeps failing, letting one trial call through after a pause,
+- optionally, a hedged second attempt if the first hasn't returned after
+  `hedge_after_seconds`, for reads whose tail latency matters more than
+  the extra load.
+
+`async_call_with_resilience` is the same for coroutines, without hedging.
+"""
+import contextlib
+import contextvars
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# max threads running hedged calls, across all callers.
+HEDGE_MAX_WORKERS = 16
+
+# monotonic time the current call has to finish by, or None.
+_deadline_at: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline_at", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The caller's deadline passed before the call could finish."""
+
+
+class _AttemptTimedOut(DeadlineExceeded):
+    """The attempt itself ran out of time, so the dependency is likely hung."""
+
+
+class CircuitOpenError(RuntimeError):
+    """A circuit breaker is open, so the call wasn't attempted."""
+
+
+@contextlib.contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """Give the calls made inside the block at most `seconds` in total.
+
+    Nested deadlines can only shorten the enclosing one. None leaves the
+    current deadline (if any) as it is.
+    """
+    if seconds is None:
+        yield
+        return
+    deadline_at = time.monotonic() + seconds
+    current = _deadline_at.get()
+    token = _deadline_at.set(deadline_at if current is None else min(current, deadline_at))
+    try:
+        yield
+    finally:
+        _deadline_at.reset(token)
+
+
+def remaining_seconds() -> Optional[float]:
+    """Get the seconds left before the current deadline, or None if there's none."""
+    deadline_at = _deadline_at.get()
+    return None if deadline_at is None else deadline_at - time.monotonic()
+
+
+def check_deadline() -> None:
+    """Raise DeadlineExceeded if the current deadline has passed."""
+    remaining = remaining_seconds()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("Deadline exceeded.")
+
+
+def is_transient_error(e: BaseException) -> bool:
+    """Whether a call that raised `e` could succeed if retried.
+
+    Connection errors, timeouts, DNS lookup failures, HTTP 429 and 5xx
+    responses, and a locked SQLite database are transient. Other HTTP errors
+    (e.g. 404), other OS errors (e.g. a missing file, or a certificate that
+    doesn't verify), bad data and bugs aren't, and neither are
+    DeadlineExceeded and CircuitOpenError.
+    """
+    if isinstance(e, (DeadlineExceeded, CircuitOpenError)):
+        return False
+    # urllib's HTTPError has .code, httpx's HTTPStatusError has .response.
+    status = getattr(e, "code", None)
+    if not isinstance(status, int):
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    # urllib's URLError wraps the error in .reason.
+    reason = getattr(e, "reason", None)
+    if isinstance(e, OSError) and isinstance(reason, BaseException):
+        return is_transient_error(reason)
+    # includes socket timeouts and connection resets.
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    # matched by name, so checking doesn't import httpx, http.client or socket.
+    error_names = {cls.__name__ for cls in type(e).__mro__}
+    if error_names & {"TransportError", "RemoteProtocolError", "IncompleteRead", "RemoteDisconnected", "gaierror"}:
+        return True
+    return "OperationalError" in error_names and "locked" in str(e)
+
+
+class RetryPolicy:
+    """How many times to try an idempotent call, and how long to wait in between.
+
+    The wait before retry n (from 0) is uniform in [0, min(max_delay_seconds,
+    base_delay_seconds * 2**n)], so clients retrying at once spread out.
+    """
+
+    __slots__ = ("max_attempts", "base_delay_seconds", "max_delay_seconds")
+
+    def __init__(self, max_attempts: int = 3, base_delay_seconds: float = 0.1, max_delay_seconds: float = 2.0):
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+
+    def backoff_seconds(self, retry: int) -> float:
+        return random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2 ** retry))
+
+
+NO_RETRIES = RetryPolicy(max_attempts=1)
+
+
+class CircuitBreaker:
+    """Fails calls fast while a dependency is down.
+
+    Closed: calls go through, and `failure_threshold` consecutive transient
+    failures open it. Open: calls raise CircuitOpenError without being
+    attempted, for `reset_timeout_seconds`. Half-open: one trial call goes
+    through (the others still fail fast); it closes the breaker if it
+    succeeds and re-opens it if it fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError if the call shouldn't be attempted."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if (
+                self._state == self.OPEN
+                and time.monotonic() - self._opened_at >= self.reset_timeout_seconds
+            ):
+                self._state = self.HALF_OPEN
+                self._trial_running = False
+            if self._state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            self._stats["rejected"] += 1
+        raise CircuitOpenError(f"Circuit breaker {self.name!r} is open.")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                _get_logger().info(f"Circuit breaker {self.name!r} closed.")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+                self._stats["opened"] += 1
+                _get_logger().warning(
+                    f"Circuit breaker {self.name!r} opened after {self._failures} failures, "
+                    f"failing fast for {self.reset_timeout_seconds}s."
+                )
+
+    def release_trial(self) -> None:
+        """Let another half-open trial through, for a trial that ended without
+        saying whether the dependency is up (e.g. it was cancelled)."""
+        with self._lock:
+            self._trial_running = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def stats(self) -> dict[str, int | str]:
+        """Get the state, consecutive failures, and times opened / calls rejected."""
+        state = self.state
+        with self._lock:
+            return {"state": state, "failures": self._failures, **self._stats}
+
+
+_stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_resilience_stats() -> dict[str, int]:
+    """Get counts of calls, retries, hedged attempts (and how many of them
+    returned first), and calls cut short by their deadline."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+_hedge_executor: Any = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _get_hedge_executor() -> Any:
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_executor_lock:
+            if _hedge_executor is None:
+                # imported here, since it imports logging, and only hedged calls need it.
+                from concurrent.futures import ThreadPoolExecutor
+
+                _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+    return _hedge_executor
+
+
+def _call_hedged(fn: Callable[[Optional[float]], T], timeout: Optional[float], hedge_after_seconds: float) -> T:
+    """Run fn, and a second copy if the first hasn't returned after
+    `hedge_after_seconds`; return the first result, or raise the last error.
+
+    The slower copy isn't cancelled (a blocking request can't be), but it's
+    bounded by `timeout` too.
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    executor = _get_hedge_executor()
+    # copies of the caller's context, so the attempts see its deadline and span.
+    first = executor.submit(contextvars.copy_context().run, fn, timeout)
+    done, _ = wait([first], timeout=hedge_after_seconds)
+    if done:
+        return first.result()
+    _count("hedges")
+    second_timeout = None if timeout is None else max(0.0, timeout - hedge_after_seconds)
+    second = executor.submit(contextvars.copy_context().run, fn, second_timeout)
+    pending = {first, second}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            raise _AttemptTimedOut("Deadline exceeded waiting for a hedged call.")
+        for future in done:
+            if future.exception() is None:
+                if future is second:
+                    _count("hedge_wins")
+                return future.result()
+            error = future.exception()
+    assert error is not None
+    raise error
+
+
+def _record_error(breaker: CircuitBreaker, error: BaseException, transient: bool) -> None:
+    if transient or isinstance(error, _AttemptTimedOut):
+        breaker.record_failure()
+    elif isinstance(error, DeadlineExceeded):
+        # the caller's deadline passed, which says nothing about the dependency.
+        breaker.release_trial()
+    else:
+        # e.g. a 404: the dependency is up.
+        breaker.record_success()
+
+
+def _attempt_timeout(default_timeout_seconds: Optional[float]) -> Optional[float]:
+    """Get the timeout for the next attempt, raising if the deadline has passed."""
+    remaining = remaining_seconds()
+    if remaining is None:
+        return default_timeout_seconds
+    if remaining <= 0:
+        _count("deadline_exceeded")
+        raise DeadlineExceeded("Deadline exceeded.")
+    return remaining if default_timeout_seconds is None else min(remaining, default_timeout_seconds)
+
+
+def _retry_delay(retry: RetryPolicy, attempt: int) -> Optional[float]:
+    """Get the wait before the next attempt, or None if there's no time for one."""
+    delay = retry.backoff_seconds(attempt)
+    remaining = remaining_seconds()
+    if remaining is not None and delay >= remaining:
+        return None
+    return delay
+
+
+def call_with_resilience(
+    fn: Callable[[Optional[float]], T],
+    *,
+    idempotent: bool,
+    retry: RetryPolicy = NO_RETRIES,
+    breaker: Optional[CircuitBreaker] = None,
+    default_timeout_seconds: Optional[float] = None,
+    hedge_after_seconds: Optional[float] = None,
+    is_transient: Callable[[BaseException], bool] = is_transient_error,
+) -> T:
+    """Call `fn(timeout)`, within the current deadline, retrying transient errors.
+
+    Args:
+        fn: The call, taking the seconds it has (None for no limit)
+        idempotent: Whether the call can safely run more than once. If not,
+            it's never retried or hedged
+        retry: How many times to try, and the backoff in between
+        breaker: Fails the call fast while open; transient errors and
+            attempts that time out count as failures, other errors (e.g. a
+            404) mean the dependency is up
+        default_timeout_seconds: Timeout per attempt without a deadline
+        hedge_after_seconds: Start a second attempt if the first hasn't
+            returned after this long (idempotent calls only)
+        is_transient: Whether an error is worth retrying
+
+    Returns:
+        The result of `fn`. Raises its last error, DeadlineExceeded, or
+        CircuitOpenError.
+    """
+    _count("calls")
+    max_attempts = retry.max_attempts if idempotent else 1
+    for attempt in range(max_attempts):
+        timeout = _attempt_timeout(default_timeout_seconds)
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            if idempotent and hedge_after_seconds is not None:
+                result = _call_hedged(fn, timeout, hedge_after_seconds)
+            else:
+                result = fn(timeout)
+        except Exception as e:
+            transient = is_transient(e)
+            if breaker is not None:
+                _record_error(breaker, e, transient)
+            if not transient or attempt == max_attempts - 1:
+                raise
+            delay = _retry_delay(retry, attempt)
+            if delay is None:
+                raise
+            _count("retries")
+            time.sleep(delay)
+            continue
+        except BaseException:
+            # cancelled or interrupted: don't leave a half-open trial running forever.
+            if breaker is not None:
+                breaker.release_trial()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        return result
+    raise AssertionError("unreachable")
+
+
+async def async_call_with_resilience(
+    fn: Callable[[Optional[float]], Awaitable[T]],
+    *,
+    idempotent: bool,
+    retry: RetryPolicy = NO_RETRIES,
+    breaker: Optional[CircuitBreaker] = None,
+    default_timeout_seconds: Optional[float] = None,
+    is_transient: Callable[[BaseException], bool] = is_transient_error,
+) -> T:
+    """Same as `call_with_resilience`, for a coroutine function. Each attempt
+    is cancelled once its timeout passes."""
+    # imported here, since only the async clients need it.
+    import asyncio
+
+    _count("calls")
+    max_attempts = retry.max_attempts if idempotent else 1
+    for attempt in range(max_attempts):
+        timeout = _attempt_timeout(default_timeout_seconds)
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = await asyncio.wait_for(fn(timeout), timeout=timeout)
+        except Exception as e:
+            transient = is_transient(e)
+            if breaker is not None:
+                _record_error(breaker, e, transient)
+            if not transient or attempt == max_attempts - 1:
+                raise
+            delay = _retry_delay(retry, attempt)
+            if delay is None:
+                raise
+            _count("retries")
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # cancelled or interrupted: don't leave a half-open trial running forever.
+            if breaker is not None:
+                breaker.release_trial()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        return result
+    raise AssertionError("unreachable")
+
+
+def _get_logger():
+    # imported here, so the clients importing this module don't pay for the logger.
+    from lib.logger import get_logger
+
+    return get_logger(__name__)
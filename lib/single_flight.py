@@ -0,0 +1,110 @@
+"""Single-flight call coalescing.
+
+Concurrent calls for the same key share one execution: the first caller runs
+the function, and the others wait for and get its result (or its exception).
+Once the call finishes, the key is forgotten, so this deduplicates in-flight
+work rather than caching results.
+
+`SingleFlight` is for threads, `AsyncSingleFlight` for coroutines on one
+event loop. Both count how many calls were coalesced, e.g.:
+
+    flights = SingleFlight()
+    paper_id = flights.do(("arxiv", "2410.08698"), lambda: fetch_and_insert(...))
+    flights.stats()  # {"calls": 10, "executions": 1, "coalesced": 9, "coalescing_ratio": 0.9}
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _Stats:
+    def __init__(self):
+        self.calls = 0
+        self.executions = 0
+
+    def as_dict(self) -> dict[str, float]:
+        coalesced = self.calls - self.executions
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": coalesced,
+            "coalescing_ratio": coalesced / self.calls if self.calls else 0.0,
+        }
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key across threads."""
+
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = _Stats()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Run `fn`, unless a call for `key` is in flight, then share its result."""
+        with self._lock:
+            self._stats.calls += 1
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+                self._stats.executions += 1
+
+        if not is_leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self) -> dict[str, float]:
+        """Get call/execution/coalesced counts and the coalescing ratio."""
+        with self._lock:
+            return self._stats.as_dict()
+
+
+class AsyncSingleFlight:
+    """Coalesces concurrent calls with the same key across coroutines."""
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self._stats = _Stats()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `fn()`, unless a call for `key` is in flight, then share its result."""
+        self._stats.calls += 1
+        future = self._calls.get(key)
+        if future is not None:
+            # shielded, so a waiter being cancelled doesn't cancel the shared call.
+            return await asyncio.shield(future)
+
+        self._stats.executions += 1
+        future = self._calls[key] = asyncio.ensure_future(fn())
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                del self._calls[key]
+            else:
+                # the leader was cancelled, let the call finish for the others.
+                future.add_done_callback(lambda _: self._calls.pop(key, None))
+
+    def stats(self) -> dict[str, float]:
+        """Get call/execution/coalesced counts and the coalescing ratio."""
+        return self._stats.as_dict()
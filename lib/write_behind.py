@@ -0,0 +1,274 @@
+"""Write-behind buffering with per-key coalescing.
+
+Values put into a `WriteBehindBuffer` are held by key, and a newer value for
+a key replaces the pending one, so only the last one is written. A background
+thread writes the pending values in one batch once `max_pending` keys are
+waiting or the oldest has waited `flush_interval_seconds`, and on exit.
+
+Writes that can't wait go through `write_through` (or `write_through_many`
+for a bulk write), which drops the key's pending value and, if the key is in
+a batch being written, waits for that batch, so an older buffered value
+never lands after it. Writes for other keys aren't held up: no lock is held
+while writing, and a batch skips keys that are being written through.
+
+A batch that fails with a transient error (see `is_transient_error`) is
+kept and retried with the next flush. Any other error is taken to be caused
+by a bad value (e.g. one breaking a foreign key), so the batch is split in
+halves until the bad values are found; they're logged and dropped, see
+`dead_letters`, and the rest are written.
+
+    buffer = WriteBehindBuffer(write_rows, max_pending=500, flush_interval_seconds=1.0)
+    buffer.put(("paper", 1), row)  # written in the next batch
+    buffer.write_through(("paper", 1), lambda: write_rows([newer_row]))
+    buffer.stats()  # {"pending": 0, "puts": 1, "coalesced": 0, ...}
+"""
+import atexit
+import collections
+import threading
+import time
+from typing import Any, Callable, Hashable, Iterable, Optional
+
+from lib.logger import get_logger
+from lib.resilience import is_transient_error
+
+logger = get_logger(__name__)
+
+# number of dropped values kept for `dead_letters`.
+MAX_DEAD_LETTERS = 100
+
+
+class WriteBehindBuffer:
+    """Buffers values by key and writes the latest ones in batches from a background thread."""
+
+    def __init__(
+        self,
+        write: Callable[[list[Any]], Any],
+        max_pending: int = 500,
+        flush_interval_seconds: float = 1.0,
+        name: str = "write-behind",
+    ):
+        """
+        Args:
+            write: Writes a batch of values, raising if it fails (the batch is
+                then retried with the next flush if the error is transient,
+                else split to drop the bad values)
+            max_pending: Flush once this many keys are pending
+            flush_interval_seconds: Flush once the oldest pending value has
+                waited this long
+            name: Name of the flush thread, used in logs
+        """
+        self._write = write
+        self.max_pending = max_pending
+        self.flush_interval_seconds = flush_interval_seconds
+        self.name = name
+        self._pending: dict[Hashable, Any] = {}
+        # when the oldest pending value was put.
+        self._pending_since: Optional[float] = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # keys being written by a flush or a write-through. A key is only
+        # written by one at a time, so writes of a key don't reorder.
+        self._in_flight: set[Hashable] = set()
+        self._in_flight_done = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._dead_letters: collections.deque = collections.deque(maxlen=MAX_DEAD_LETTERS)
+        self._stats = {
+            "puts": 0,
+            "coalesced": 0,
+            "written_through": 0,
+            "flushes": 0,
+            "flushed": 0,
+            "failed_flushes": 0,
+            "dead_lettered": 0,
+            "last_flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+            "total_flush_seconds": 0.0,
+        }
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Buffer a value, replacing the pending value for the key if there is one."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} buffer is closed.")
+            self._stats["puts"] += 1
+            if key in self._pending:
+                self._stats["coalesced"] += 1
+            elif not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending[key] = value
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            if len(self._pending) >= self.max_pending:
+                self._wakeup.notify()
+
+    def write_through(self, key: Hashable, write: Callable[[], Any]) -> Any:
+        """Run a write for a key now, dropping the key's pending value.
+
+        Waits for a batch (or another write-through) writing the key, so it
+        can't overwrite this write.
+
+        Returns:
+            The result of `write`.
+        """
+        return self.write_through_many([key], write)
+
+    def write_through_many(self, keys: Iterable[Hashable], write: Callable[[], Any]) -> Any:
+        """Run one write for many keys now, e.g. a bulk upsert, dropping the
+        keys' pending values. See `write_through`.
+
+        Returns:
+            The result of `write`.
+        """
+        keys = set(keys)
+        with self._lock:
+            while not self._in_flight.isdisjoint(keys):
+                self._in_flight_done.wait()
+            for key in keys:
+                self._pending.pop(key, None)
+                self._stats["written_through"] += 1
+            if not self._pending:
+                self._pending_since = None
+            self._in_flight |= keys
+        try:
+            return write()
+        finally:
+            self._done_writing(keys)
+
+    def _done_writing(self, keys: Iterable[Hashable]) -> None:
+        with self._lock:
+            self._in_flight.difference_update(keys)
+            self._in_flight_done.notify_all()
+
+    def flush(self) -> int:
+        """Write the pending values now.
+
+        Values of keys being written through are left pending, for the next
+        flush. Values that fail with a non-transient error are dropped, see
+        `dead_letters`.
+
+        Returns:
+            Number of values written. Raises if the write fails with a
+            transient error, after putting the values not yet written back
+            (unless newer ones were put since).
+        """
+        with self._lock:
+            batch = {key: value for key, value in self._pending.items() if key not in self._in_flight}
+            for key in batch:
+                del self._pending[key]
+            self._pending_since = time.monotonic() if self._pending else None
+            self._in_flight.update(batch)
+        if not batch:
+            return 0
+        start = time.perf_counter()
+        # chunks of (key, value) items left to write, the next one last.
+        chunks = [list(batch.items())]
+        num_written = 0
+        try:
+            while chunks:
+                chunk = chunks.pop()
+                try:
+                    self._write([value for _, value in chunk])
+                except Exception as e:
+                    if is_transient_error(e):
+                        chunks.append(chunk)
+                        raise
+                    if len(chunk) > 1:
+                        # retry each half, to find the values the write fails on.
+                        middle = len(chunk) // 2
+                        chunks += [chunk[middle:], chunk[:middle]]
+                    else:
+                        self._dead_letter(*chunk[0], e)
+                    continue
+                num_written += len(chunk)
+        except Exception:
+            with self._lock:
+                self._stats["failed_flushes"] += 1
+                self._stats["flushed"] += num_written
+                for chunk in chunks:
+                    for key, value in chunk:
+                        self._pending.setdefault(key, value)
+                self._pending_since = time.monotonic()
+            raise
+        finally:
+            self._done_writing(batch)
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["flushed"] += num_written
+            self._stats["last_flush_seconds"] = seconds
+            self._stats["max_flush_seconds"] = max(self._stats["max_flush_seconds"], seconds)
+            self._stats["total_flush_seconds"] += seconds
+        return num_written
+
+    def _dead_letter(self, key: Hashable, value: Any, error: Exception) -> None:
+        logger.error(f"Dropped the {self.name} buffer's value for {key}, the write failed: {error!r}")
+        with self._lock:
+            self._stats["dead_lettered"] += 1
+            self._dead_letters.append((key, value, error))
+
+    def dead_letters(self) -> list[tuple[Hashable, Any, Exception]]:
+        """Get the last values dropped since their write failed with a
+        non-transient error, as (key, value, error), oldest first."""
+        with self._lock:
+            return list(self._dead_letters)
+
+    def _run(self) -> None:
+        # after a failed flush, wait an interval before retrying, even if full.
+        retry_at = 0.0
+        while True:
+            with self._lock:
+                while not self._closed:
+                    now = time.monotonic()
+                    if self._pending_since is None:
+                        wait_seconds = None
+                    elif now < retry_at:
+                        wait_seconds = retry_at - now
+                    elif len(self._pending) >= self.max_pending:
+                        break
+                    else:
+                        wait_seconds = self._pending_since + self.flush_interval_seconds - now
+                        if wait_seconds <= 0:
+                            break
+                    self._wakeup.wait(wait_seconds)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush {self.name} buffer, retrying: {e}")
+                retry_at = time.monotonic() + self.flush_interval_seconds
+
+    def close(self) -> None:
+        """Stop the flush thread and write the pending values."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Failed to flush {self.name} buffer on close, {len(self)} values lost: {e}")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self) -> dict[str, float]:
+        """Get the queue depth (pending values and the oldest one's age in
+        seconds), put/coalesced/write-through counts, flush counts and latency,
+        and the number of values dropped by failed writes."""
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "oldest_pending_seconds": (
+                    time.monotonic() - self._pending_since if self._pending_since is not None else 0.0
+                ),
+                **self._stats,
+            }